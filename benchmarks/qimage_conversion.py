@@ -0,0 +1,62 @@
+"""Micro-benchmark of the numpy -> QImage conversion.
+
+Compares the native-format, zero-copy `array_to_qimage` with the previous
+ARGB32 packing path on random images of increasing size::
+
+    python benchmarks/qimage_conversion.py --megapixels 1 5 20 50
+"""
+
+import time
+from typing import Callable, List
+
+import click
+import numpy as np
+from PySide6.QtGui import QImage
+
+from juiced.conversion import array_to_qimage
+
+
+def argb32_to_qimage(array: np.ndarray) -> QImage:
+    """The ARGB32 packing path that `array_to_qimage` replaces"""
+    if len(array.shape) == 2:
+        array = np.expand_dims(array, -1)
+    if array.shape[2] == 1:
+        array = np.stack([array[:, :, 0]] * 3, -1)
+    height, width = array.shape[:2]
+    array = array.astype(np.uint32)
+    r, g, b = [array[:, :, i] for i in range(3)]
+    data = (255 << 24 | r << 16 | g << 8 | b).flatten()
+    return QImage(data, width, height, QImage.Format_ARGB32)
+
+
+def timeit(fn: Callable[[np.ndarray], QImage], array: np.ndarray, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(array)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+@click.command()
+@click.option("-m", "--megapixels", type=float, multiple=True, default=[1, 5, 20, 50])
+@click.option("-c", "--channels", type=int, multiple=True, default=[1, 3])
+@click.option("-r", "--repeat", type=int, default=5)
+def main(megapixels: List[float], channels: List[int], repeat: int) -> None:
+    rng = np.random.default_rng(0)
+    print(f"{'MP':>6} {'ch':>3} {'argb32 [ms]':>12} {'native [ms]':>12} {'speedup':>8}")
+    for mp in megapixels:
+        side = int((mp * 1e6) ** 0.5)
+        for c in channels:
+            shape = (side, side) if c == 1 else (side, side, c)
+            array = rng.integers(0, 256, shape, dtype=np.uint8)
+            old = timeit(argb32_to_qimage, array, repeat)
+            new = timeit(array_to_qimage, array, repeat)
+            print(
+                f"{mp:>6g} {c:>3} {old * 1e3:>12.2f} {new * 1e3:>12.2f} "
+                f"{old / new:>7.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+"""Benchmark suite of the hot paths of juiced, runs headless.
+
+Synthetic underfolders are generated in a temporary folder, then the suite
+measures:
+
+    - `Scene` construction time, metadata loading time and peak traced memory
+    - `PipelimeImageProvider.requestImage` latency, per dtype and image size, at
+      full resolution and at a requested size
+    - `_sanitize_item` and `_to_qimage` throughput, in milliseconds per megapixel
+    - the latency of an edit, from `Sample.setLabel` to the end of its write
+
+Results are saved as JSON and compared with the ones of a previous run::
+
+    python -m benchmarks.suite --samples 1000 10000 --output baseline.json
+    python -m benchmarks.suite --samples 1000 10000 --baseline baseline.json
+
+All metrics are "lower is better". With a baseline, the metrics that got worse by
+more than `--threshold` are reported as regressions and the exit code is 1.
+Memory is traced with `tracemalloc` while loading, so loading times include its
+overhead, consistently across runs.
+"""
+
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import click
+import numpy as np
+from PySide6.QtCore import QSize
+from PySide6.QtGui import QGuiApplication
+
+from juiced.image_provider import PipelimeImageProvider
+from juiced.loading import MetadataLoader
+from juiced.persistence import WriteBehind
+from juiced.scene import Dataset, Scene
+
+from benchmarks.synthetic import generate_underfolder
+
+Results = Dict[str, Dict[str, float]]
+
+
+def percentiles(samples: List[float]) -> Tuple[float, float]:
+    """The median and the 95th percentile, in milliseconds"""
+    p50, p95 = np.percentile(np.array(samples) * 1e3, [50, 95])
+    return float(p50), float(p95)
+
+
+def wait(app: QGuiApplication, done: Callable[[], bool], timeout: float) -> None:
+    """Process events until `done` returns True"""
+    deadline = time.perf_counter() + timeout
+    while not done():
+        if time.perf_counter() > deadline:
+            raise TimeoutError("Benchmark timed out")
+        app.processEvents()
+        time.sleep(0.0005)
+
+
+def open_scene(folder: Path, quiet_ms: int = 500) -> Tuple[Scene, Dataset]:
+    scene = Scene(
+        folder,
+        loader_factory=lambda: MetadataLoader(processes=False),
+        writer_factory=lambda: WriteBehind(quiet_ms=quiet_ms),
+    )
+    return scene, scene.dataset
+
+
+def close_scene(scene: Scene, dataset: Dataset) -> None:
+    scene.close()
+    PipelimeImageProvider.get_instance().remove_dataset(dataset.name)
+
+
+def bench_scene(app: QGuiApplication, folder: Path, samples: int) -> Results:
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    scene, dataset = open_scene(folder)
+    t1 = time.perf_counter()
+    wait(app, lambda: dataset.ready, timeout=3600)
+    t2 = time.perf_counter()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    close_scene(scene, dataset)
+    return {
+        f"scene.construct.{samples}": {"value": t1 - t0, "unit": "s"},
+        f"scene.load.{samples}": {"value": t2 - t1, "unit": "s"},
+        f"scene.peak_memory.{samples}": {"value": peak / 2**20, "unit": "MiB"},
+    }
+
+
+def bench_request_image(name: str, count: int, repeat: int) -> Results:
+    provider = PipelimeImageProvider.get_instance()
+    results = {}
+    for label, requested in (("full", QSize()), ("256", QSize(256, 256))):
+        latencies = []
+        for _ in range(repeat):
+            provider.cache.invalidate(name)
+            for idx in range(count):
+                t0 = time.perf_counter()
+                provider.requestImage(f"{name}/{idx}/image", QSize(), requested)
+                latencies.append(time.perf_counter() - t0)
+        p50, p95 = percentiles(latencies)
+        results[f"request_image.{name}.{label}.p50"] = {"value": p50, "unit": "ms"}
+        results[f"request_image.{name}.{label}.p95"] = {"value": p95, "unit": "ms"}
+    return results
+
+
+def bench_conversion(name: str, repeat: int) -> Results:
+    provider = PipelimeImageProvider.get_instance()
+    sample = provider._datasets[name][0]
+    array, _ = provider._read_item(sample, "image", QSize())
+    megapixels = array.shape[0] * array.shape[1] / 1e6
+
+    # The first call of the normalizer computes the statistics, it is excluded
+    provider._sanitize_item(array, name, "image")
+    sanitize, convert = [], []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        sanitized = provider._sanitize_item(array, name, "image")
+        t1 = time.perf_counter()
+        provider._to_qimage(sanitized)
+        t2 = time.perf_counter()
+        sanitize.append((t1 - t0) / megapixels)
+        convert.append((t2 - t1) / megapixels)
+    return {
+        f"sanitize_item.{name}": {"value": percentiles(sanitize)[0], "unit": "ms/MP"},
+        f"to_qimage.{name}": {"value": percentiles(convert)[0], "unit": "ms/MP"},
+    }
+
+
+def bench_edit(app: QGuiApplication, folder: Path, edits: int) -> Results:
+    scene, dataset = open_scene(folder, quiet_ms=0)
+    wait(app, lambda: dataset.ready, timeout=3600)
+    criterion = dataset.criteria[0]
+    choices = criterion.data["choices"]
+    writer = dataset.writer
+
+    latencies = []
+    for i in range(edits):
+        sample = dataset.samples.get(i)
+        value = choices[(choices.index(sample.labels[criterion.name]) + 1) % 2]
+        t0 = time.perf_counter()
+        sample.setLabel(criterion.name, value)
+        writer.flush()
+        wait(app, lambda: writer.pendingWrites == 0, timeout=60)
+        latencies.append(time.perf_counter() - t0)
+    close_scene(scene, dataset)
+
+    p50, p95 = percentiles(latencies)
+    return {
+        "edit.p50": {"value": p50, "unit": "ms"},
+        "edit.p95": {"value": p95, "unit": "ms"},
+    }
+
+
+def compare(results: Results, baseline: Results, threshold: float) -> List[str]:
+    """Print the changes with respect to a baseline, returns the regressions"""
+    regressions = []
+    print(f"{'metric':<48} {'baseline':>12} {'current':>12} {'change':>8}")
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        old, new = baseline[key]["value"], result["value"]
+        change = (new - old) / old if old > 0 else 0.0
+        flag = ""
+        if change > threshold:
+            regressions.append(key)
+            flag = "  REGRESSION"
+        print(f"{key:<48} {old:>12.4g} {new:>12.4g} {change:>+7.1%}{flag}")
+    return regressions
+
+
+@click.command()
+@click.option("-n", "--samples", type=int, multiple=True, default=[1000, 10000])
+@click.option("-s", "--sizes", type=(int, int), multiple=True, default=[(512, 512)])
+@click.option("-d", "--dtypes", multiple=True, default=["uint8", "uint16", "float32"])
+@click.option("--criteria", type=int, default=8)
+@click.option("--shapes", type=int, default=0)
+@click.option("--edits", type=int, default=50)
+@click.option("-r", "--repeat", type=int, default=3)
+@click.option("-o", "--output", type=Path, default=None)
+@click.option("-b", "--baseline", type=Path, default=None)
+@click.option("-t", "--threshold", type=float, default=0.1)
+@click.option("--workdir", type=Path, default=None)
+def main(
+    samples: List[int],
+    sizes: List[Tuple[int, int]],
+    dtypes: List[str],
+    criteria: int,
+    shapes: int,
+    edits: int,
+    repeat: int,
+    output: Optional[Path],
+    baseline: Optional[Path],
+    threshold: float,
+    workdir: Optional[Path],
+) -> None:
+    # No display is needed, must be set before the application is created
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    app = QGuiApplication(sys.argv)
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+        tmp = Path(tmp)
+        provider = PipelimeImageProvider.get_instance()
+        provider.tile_cache = tmp / "tiles"
+        results: Results = {}
+
+        for n in samples:
+            folder = generate_underfolder(
+                tmp / f"scene_{n}", n, criteria=criteria, shapes=shapes
+            )
+            results.update(bench_scene(app, folder, n))
+            print(f"scene: {n} samples done")
+
+        for width, height in sizes:
+            for dtype in dtypes:
+                name = f"{dtype}_{width}x{height}"
+                folder = generate_underfolder(
+                    tmp / name, 16, (width, height), dtype, criteria=criteria
+                )
+                # The dataset is registered in the provider with the folder name
+                scene, dataset = open_scene(folder)
+                results.update(bench_request_image(name, 16, repeat))
+                results.update(bench_conversion(name, repeat * 10))
+                close_scene(scene, dataset)
+                print(f"images: {name} done")
+
+        folder = generate_underfolder(tmp / "edits", max(edits, 1), criteria=criteria)
+        results.update(bench_edit(app, folder, edits))
+        print("edits done")
+
+    report = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "samples": list(samples),
+        },
+        "results": results,
+    }
+    if output is not None:
+        output.write_text(json.dumps(report, indent=2))
+    else:
+        for key, result in results.items():
+            print(f"{key:<48} {result['value']:>12.4g} {result['unit']}")
+
+    if baseline is not None:
+        previous = json.loads(baseline.read_text())["results"]
+        regressions = compare(results, previous, threshold)
+        if regressions:
+            print(f"{len(regressions)} regressions over {threshold:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""Generators of synthetic underfolders, for benchmarks.
+
+Every sample has an image, and a metadata item with labels for all the criteria,
+a region and a list of shapes, named as juiced expects by default. The criteria
+are stored in a root item::
+
+    python benchmarks/synthetic.py /tmp/synthetic --samples 100000 --shapes 500
+
+To keep the generation of millions of samples fast, only a few distinct images
+are written and the others are hard links to them, and metadata is written as
+JSON, which is valid YAML.
+"""
+
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import click
+import numpy as np
+from PIL import Image
+
+# Criterion types are cycled in this order
+CRITERION_TYPES = ("choice", "bool", "int", "range")
+
+
+def make_criteria(count: int) -> List[Dict[str, Any]]:
+    """`count` criteria, of all the supported types"""
+    criteria = []
+    for i in range(count):
+        type_ = CRITERION_TYPES[i % len(CRITERION_TYPES)]
+        criterion: Dict[str, Any] = {"name": f"{type_}{i}", "type": type_}
+        if type_ == "choice":
+            criterion["data"] = {"choices": [f"class{j}" for j in range(8)]}
+            criterion["default"] = "class0"
+        elif type_ == "bool":
+            criterion["default"] = False
+        elif type_ == "int":
+            criterion["data"] = {"from": 0, "to": 10}
+            criterion["default"] = 0
+        else:
+            criterion["data"] = {"from": 0.0, "to": 1.0, "step": 0.1}
+            criterion["default"] = 0.0
+        criteria.append(criterion)
+    return criteria
+
+
+def make_image(
+    rng: np.random.Generator, size: Tuple[int, int], dtype: str, channels: int
+) -> np.ndarray:
+    """A random (height, width[, channels]) image of the given dtype"""
+    width, height = size
+    shape = (height, width) if channels == 1 else (height, width, channels)
+    dtype = np.dtype(dtype)
+    if dtype.kind == "f":
+        return rng.random(shape, dtype=np.float32).astype(dtype)
+    info = np.iinfo(dtype)
+    return rng.integers(info.min, info.max, shape, dtype=dtype, endpoint=True)
+
+
+def make_metadata(
+    rng: np.random.Generator,
+    criteria: List[Dict[str, Any]],
+    size: Tuple[int, int],
+    shapes: int,
+) -> Dict[str, Any]:
+    """Random labels, region and shapes of a sample"""
+    labels: Dict[str, Any] = {}
+    for c in criteria:
+        if c["type"] == "choice":
+            labels[c["name"]] = str(rng.choice(c["data"]["choices"]))
+        elif c["type"] == "bool":
+            labels[c["name"]] = bool(rng.integers(2))
+        elif c["type"] == "int":
+            labels[c["name"]] = int(rng.integers(0, 11))
+        else:
+            labels[c["name"]] = round(float(rng.random()), 1)
+
+    width, height = size
+    boxes = np.column_stack(
+        [
+            rng.random(shapes + 1) * width,
+            rng.random(shapes + 1) * height,
+            rng.random(shapes + 1) * width / 10 + 1,
+            rng.random(shapes + 1) * height / 10 + 1,
+            rng.random(shapes + 1) * np.pi,
+        ]
+    ).round(2)
+    keys = ("x", "y", "w", "h", "angle")
+    region = {"type": "box", **dict(zip(keys, boxes[0].tolist()))}
+    items = [
+        {"type": "box", "label": f"class{i % 8}", **dict(zip(keys, b.tolist()))}
+        for i, b in enumerate(boxes[1:])
+    ]
+    return {"labels": labels, "shape": region, "shapes": items}
+
+
+def generate_underfolder(
+    folder: Path,
+    samples: int = 1000,
+    image_size: Tuple[int, int] = (512, 512),
+    dtype: str = "uint8",
+    channels: int = 3,
+    criteria: int = 4,
+    shapes: int = 0,
+    distinct: int = 16,
+    seed: int = 0,
+) -> Path:
+    """Write a synthetic underfolder, replacing `folder` if it exists.
+
+    Args:
+        folder (Path): The underfolder to write.
+        samples (int, optional): The number of samples. Defaults to 1000.
+        image_size (Tuple[int, int], optional): The (width, height) of the images.
+        Defaults to (512, 512).
+        dtype (str, optional): The dtype of the images, uint8 images are stored as
+        png, any other as npy. Defaults to "uint8".
+        channels (int, optional): The channels of the images. Defaults to 3.
+        criteria (int, optional): The number of labeling criteria. Defaults to 4.
+        shapes (int, optional): The number of shapes of every sample. Defaults to 0.
+        distinct (int, optional): The number of distinct images and metadata, the
+        other samples link or repeat them. Defaults to 16.
+        seed (int, optional): The seed of the random generator. Defaults to 0.
+
+    Returns:
+        Path: The written underfolder.
+    """
+    folder = Path(folder)
+    if folder.exists():
+        shutil.rmtree(folder)
+    data = folder / "data"
+    data.mkdir(parents=True)
+
+    rng = np.random.default_rng(seed)
+    criteria_list = make_criteria(criteria)
+    (folder / "criteria.yml").write_text(json.dumps(criteria_list))
+
+    digits = max(6, len(str(samples - 1)))
+    suffix = ".png" if np.dtype(dtype) == np.uint8 else ".npy"
+    distinct = max(1, min(distinct, samples))
+    images: List[Path] = []
+    metadata: List[str] = []
+    for i in range(distinct):
+        image = make_image(rng, image_size, dtype, channels)
+        path = folder / f"image{i}{suffix}"
+        if suffix == ".npy":
+            np.save(path, image)
+        else:
+            Image.fromarray(image).save(path)
+        images.append(path)
+        sample = make_metadata(rng, criteria_list, image_size, shapes)
+        metadata.append(json.dumps(sample))
+
+    for idx in range(samples):
+        name = f"{idx:0{digits}d}"
+        source = images[idx % distinct]
+        target = data / f"{name}_image{suffix}"
+        try:
+            os.link(source, target)
+        except OSError:
+            shutil.copyfile(source, target)
+        (data / f"{name}_metadata.yml").write_text(metadata[idx % distinct])
+
+    for path in images:
+        path.unlink()
+    return folder
+
+
+@click.command()
+@click.argument("folder", type=Path)
+@click.option("-n", "--samples", type=int, default=1000)
+@click.option("-s", "--size", type=(int, int), default=(512, 512))
+@click.option("-d", "--dtype", type=str, default="uint8")
+@click.option("-c", "--channels", type=int, default=3)
+@click.option("--criteria", type=int, default=4)
+@click.option("--shapes", type=int, default=0)
+@click.option("--seed", type=int, default=0)
+def main(
+    folder: Path,
+    samples: int,
+    size: Tuple[int, int],
+    dtype: str,
+    channels: int,
+    criteria: int,
+    shapes: int,
+    seed: int,
+) -> None:
+    generate_underfolder(
+        folder,
+        samples,
+        size,
+        dtype,
+        channels,
+        criteria=criteria,
+        shapes=shapes,
+        seed=seed,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,422 @@
+from __future__ import annotations
+
+import io
+import json
+import mmap
+import os
+import pickle
+import re
+import struct
+import tarfile
+import zipfile
+import zlib
+from collections.abc import Mapping
+from pathlib import Path
+from threading import Lock
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import yaml
+from PIL import Image
+
+from juiced.loading import SafeLoader
+
+ARCHIVE_SUFFIXES = (".zip", ".tar")
+
+IMAGE_SUFFIXES = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff")
+
+DICT_SUFFIXES = (".yml", ".yaml", ".json")
+
+# Items of a sample, e.g. "data/000042_image.jpg", and root items, e.g. "criteria.yml"
+_SAMPLE_ITEM = re.compile(r"^(?:.*/)?data/(\d+)_([^/.]+)(\.[^/]+)$")
+_ROOT_ITEM = re.compile(r"^(?:[^/]+/)?([^/.]+)(\.[^/]+)$")
+
+_STORED, _DEFLATED = 0, 8
+_ZIP_LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+
+
+def decode(data: bytes, suffix: str) -> Any:
+    """Decode the content of an item file from its extension"""
+    if suffix in IMAGE_SUFFIXES:
+        return np.asarray(Image.open(io.BytesIO(data)))
+    if suffix in (".yml", ".yaml"):
+        return yaml.load(data, Loader=SafeLoader)
+    if suffix == ".json":
+        return json.loads(data)
+    if suffix == ".npy":
+        return np.load(io.BytesIO(data))
+    if suffix == ".txt":
+        return np.loadtxt(io.BytesIO(data))
+    if suffix in (".pkl", ".pickle"):
+        return pickle.loads(data)
+    return data
+
+
+def encode(value: Any, suffix: str) -> bytes:
+    """Encode an item to the content of a file with the given extension"""
+    if suffix in IMAGE_SUFFIXES:
+        buffer = io.BytesIO()
+        image = Image.fromarray(np.asarray(value))
+        image.save(buffer, format=Image.registered_extensions()[suffix])
+        return buffer.getvalue()
+    if suffix in (".yml", ".yaml"):
+        return yaml.safe_dump(value).encode()
+    if suffix == ".json":
+        return json.dumps(value).encode()
+    if suffix == ".npy":
+        buffer = io.BytesIO()
+        np.save(buffer, np.asarray(value))
+        return buffer.getvalue()
+    if suffix == ".txt":
+        buffer = io.BytesIO()
+        np.savetxt(buffer, np.asarray(value))
+        return buffer.getvalue()
+    if suffix in (".pkl", ".pickle"):
+        return pickle.dumps(value)
+    return bytes(value)
+
+
+class ArchiveIndex:
+    """The offsets of all the items of an underfolder packed in a zip or tar file.
+
+    The index is a structured array with one row per item: the sample index (-1 for
+    root items), the item, the offset and size of its data in the archive and the
+    compression method. Rows are sorted by sample, so the items of a sample are
+    found with a binary search. The index is built once, by reading only the
+    archive directory, and saved next to the archive as `.npy`, so that it is
+    memory mapped when the archive is opened again.
+    """
+
+    DTYPE = np.dtype(
+        [
+            ("sample", "<i8"),
+            ("item", "<i4"),
+            ("method", "<i4"),
+            ("offset", "<i8"),
+            ("size", "<i8"),
+        ]
+    )
+
+    def __init__(self, archive: Path) -> None:
+        archive = Path(archive)
+        self._path = archive.with_name(archive.name + ".index.npy")
+        meta_path = archive.with_name(archive.name + ".index.json")
+        stat = archive.stat()
+        stamp = [stat.st_size, stat.st_mtime_ns]
+
+        meta = None
+        if meta_path.exists() and self._path.exists():
+            meta = json.loads(meta_path.read_text())
+            if meta.get("stamp") != stamp:
+                meta = None
+        if meta is None:
+            rows, names = self._build(archive)
+            self._save(self._path, rows)
+            meta = {"stamp": stamp, "names": names}
+            tmp = meta_path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(meta))
+            tmp.replace(meta_path)
+
+        # Item names with extension, e.g. "image.jpg"
+        self._names: List[str] = meta["names"]
+        self._rows = np.load(self._path, mmap_mode="r")
+        self._samples = self._rows["sample"]
+        self._length = int(self._samples[-1]) + 1 if len(self._rows) else 0
+
+    def __len__(self) -> int:
+        """The number of samples"""
+        return self._length
+
+    def items(self, sample: int) -> Dict[str, Tuple[str, int, int, int]]:
+        """The items of a sample as `{key: (suffix, method, offset, size)}`"""
+        lo, hi = np.searchsorted(self._samples, [sample, sample + 1])
+        items = {}
+        for row in self._rows[lo:hi]:
+            key, suffix = os.path.splitext(self._names[row["item"]])
+            method, offset, size = (int(row[f]) for f in ("method", "offset", "size"))
+            items[key] = (suffix, method, offset, size)
+        return items
+
+    @classmethod
+    def _build(cls, archive: Path) -> Tuple[np.ndarray, List[str]]:
+        if archive.suffix == ".zip":
+            members = cls._zip_members(archive)
+        elif archive.suffix == ".tar":
+            members = cls._tar_members(archive)
+        else:
+            raise ValueError(f"Unsupported archive: {archive}")
+
+        names: Dict[str, int] = {}
+        rows = []
+        for name, method, offset, size in members:
+            match = _SAMPLE_ITEM.match(name)
+            if match is not None:
+                sample, key, suffix = int(match[1]), match[2], match[3]
+            else:
+                match = _ROOT_ITEM.match(name)
+                if match is None:
+                    continue
+                sample, key, suffix = -1, match[1], match[2]
+            item = names.setdefault(key + suffix, len(names))
+            rows.append((sample, item, method, offset, size))
+
+        array = np.array(rows, dtype=cls.DTYPE)
+        array = array[np.argsort(array["sample"], kind="stable")]
+        return array, list(names)
+
+    @staticmethod
+    def _zip_members(archive: Path) -> Iterator[Tuple[str, int, int, int]]:
+        with open(archive, "rb") as f, zipfile.ZipFile(f) as zf:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for info in zf.infolist():
+                    if info.is_dir():
+                        continue
+                    if info.compress_type not in (_STORED, _DEFLATED):
+                        raise ValueError(f"Unsupported compression: {info.filename}")
+                    # The data follows the local header, whose extra field may differ
+                    # from the one in the central directory
+                    header = _ZIP_LOCAL_HEADER.unpack_from(buffer, info.header_offset)
+                    offset = info.header_offset + _ZIP_LOCAL_HEADER.size
+                    offset += header[-2] + header[-1]
+                    yield info.filename, info.compress_type, offset, info.compress_size
+            finally:
+                buffer.close()
+
+    @staticmethod
+    def _tar_members(archive: Path) -> Iterator[Tuple[str, int, int, int]]:
+        # Only uncompressed tar files can be read with slices
+        with tarfile.open(archive, mode="r:") as tf:
+            for member in tf:
+                if member.isfile():
+                    yield member.name, _STORED, member.offset_data, member.size
+
+    @staticmethod
+    def _save(path: Path, rows: np.ndarray) -> None:
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "wb") as f:
+            np.save(f, rows)
+        tmp.replace(path)
+
+
+class ArchiveSample(Mapping):
+    """A sample of an `ArchiveStream`, items are decoded lazily when accessed.
+
+    Root items of the underfolder (e.g. "criteria") are available in every sample.
+    """
+
+    filesmap: Dict[str, str] = {}
+
+    def __init__(self, stream: ArchiveStream, idx: int) -> None:
+        self._stream = stream
+        self._idx = idx
+        self._keys = stream.keys(idx)
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in self._keys:
+            raise KeyError(key)
+        data, _ = self._stream.get_data(self._idx, key)
+        return data
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._keys)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def open_item(self, key: str) -> Tuple[BinaryIO, str]:
+        """A file-like object on the raw content of an item, and its extension"""
+        data, suffix = self._stream.read(self._idx, key)
+        return io.BytesIO(data), suffix
+
+    def open_array(self, key: str) -> Optional[np.ndarray]:
+        """A read-only array on the archive map for stored .npy items, if any"""
+        return self._stream.array(self._idx, key)
+
+    def item_stamp(self, key: str) -> str:
+        """A string that identifies the content of an item across sessions"""
+        return self._stream.stamp(self._idx, key)
+
+
+class ArchiveStream:
+    """Reads and writes an underfolder packed in a single zip or tar file.
+
+    The archive is memory mapped once and located through an `ArchiveIndex`, so
+    reading an item is a slice of the map rather than a file open, and opening a
+    dataset costs a handful of syscalls, regardless of the number of samples. It
+    mimics the `UnderfolderStream` interface used by juiced::
+
+        stream = ArchiveStream("dataset.zip")
+        metadata, _ = stream.get_data(0, "metadata")
+        stream.set_data(0, "metadata", metadata)
+
+    The archive is never rewritten: edited items are appended to an overlay file
+    next to it, `dataset.zip.overlay`, and read from there from then on.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self._path = Path(path)
+        self._index = ArchiveIndex(self._path)
+        self._file = open(self._path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._root = self._index.items(-1)
+
+        self._overlay_path = self._path.with_name(self._path.name + ".overlay")
+        self._overlay: Dict[Tuple[int, str], Tuple[str, int, int]] = {}
+        self._overlay_file = open(self._overlay_path, "ab+")
+        self._lock = Lock()
+        self._load_overlay()
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    @property
+    def reader(self) -> _ArchiveReader:
+        """A sequence of samples, like `UnderfolderStream.reader`"""
+        return _ArchiveReader(self)
+
+    def get_sample(self, idx: int) -> ArchiveSample:
+        return ArchiveSample(self, idx)
+
+    def keys(self, idx: int) -> List[str]:
+        keys = set(self._root) | set(self._index.items(idx))
+        keys.update(k for i, k in self._overlay if i == idx)
+        return sorted(keys)
+
+    def read(self, idx: int, key: str) -> Tuple[bytes, str]:
+        """The raw content of an item and its extension"""
+        with self._lock:
+            entry = self._overlay.get((idx, key))
+            if entry is not None:
+                suffix, offset, size = entry
+                self._overlay_file.seek(offset)
+                return self._overlay_file.read(size), suffix
+
+        item = self._index.items(idx).get(key) or self._root.get(key)
+        if item is None:
+            raise KeyError(f"Item {key} not found in sample {idx}")
+        suffix, method, offset, size = item
+        data = self._mmap[offset : offset + size]
+        if method == _DEFLATED:
+            data = zlib.decompress(data, -zlib.MAX_WBITS)
+        return data, suffix
+
+    def array(self, idx: int, key: str) -> Optional[np.ndarray]:
+        """A read-only array backed by the archive map, without reading its data.
+
+        Only uncompressed .npy items that were not edited can be mapped, None is
+        returned for any other item.
+        """
+        with self._lock:
+            if (idx, key) in self._overlay:
+                return None
+        item = self._index.items(idx).get(key) or self._root.get(key)
+        if item is None or item[0] != ".npy" or item[1] != _STORED:
+            return None
+        _, _, offset, size = item
+
+        # The header is padded to a few tens of bytes, and at most 64 KiB
+        header = io.BytesIO(self._mmap[offset : offset + min(size, 2**16 + 10)])
+        version = np.lib.format.read_magic(header)
+        if version == (1, 0):
+            shape, fortran, dtype = np.lib.format.read_array_header_1_0(header)
+        else:
+            shape, fortran, dtype = np.lib.format.read_array_header_2_0(header)
+        if dtype.hasobject:
+            return None
+        return np.ndarray(
+            shape,
+            dtype,
+            buffer=self._mmap,
+            offset=offset + header.tell(),
+            order="F" if fortran else "C",
+        )
+
+    def stamp(self, idx: int, key: str) -> str:
+        with self._lock:
+            entry = self._overlay.get((idx, key))
+        if entry is not None:
+            return f"{self._overlay_path.resolve()}:{entry[1]}"
+        item = self._index.items(idx).get(key) or self._root.get(key)
+        stat = os.fstat(self._file.fileno())
+        return f"{self._path.resolve()}:{stat.st_mtime_ns}:{item[2] if item else key}"
+
+    def get_data(
+        self, idx: int, key: str, format: Optional[str] = None
+    ) -> Tuple[Any, str]:
+        """The decoded item and its extension, `format` is unused"""
+        data, suffix = self.read(idx, key)
+        return decode(data, suffix), suffix
+
+    def set_data(
+        self, idx: int, key: str, value: Any, format: Optional[str] = None
+    ) -> None:
+        """Append an item to the overlay, keeping its original extension"""
+        try:
+            _, suffix = self.read(idx, key)
+        except KeyError:
+            suffix = ".yml" if format == "dict" else ".pkl"
+        data = encode(value, suffix)
+        header = json.dumps({"sample": idx, "key": key, "suffix": suffix}).encode()
+        with self._lock:
+            self._overlay_file.seek(0, os.SEEK_END)
+            self._overlay_file.write(struct.pack("<2L", len(header), len(data)))
+            self._overlay_file.write(header)
+            offset = self._overlay_file.tell()
+            self._overlay_file.write(data)
+            self._overlay_file.flush()
+            self._overlay[(idx, key)] = (suffix, offset, len(data))
+
+    def close(self) -> None:
+        try:
+            self._mmap.close()
+        except BufferError:
+            # Arrays returned by `array` are still alive, the map is released with them
+            pass
+        self._file.close()
+        self._overlay_file.close()
+
+    def _load_overlay(self) -> None:
+        # Records are appended as lengths, json header and data, the last one wins
+        f = self._overlay_file
+        end = os.fstat(f.fileno()).st_size
+        start = f.seek(0)
+        while True:
+            lengths = f.read(8)
+            if len(lengths) < 8:
+                break
+            header_size, size = struct.unpack("<2L", lengths)
+            header = f.read(header_size)
+            offset = f.tell()
+            if len(header) < header_size or offset + size > end:
+                break
+            start = f.seek(size, os.SEEK_CUR)
+            header = json.loads(header)
+            entry = (header["suffix"], offset, size)
+            self._overlay[(header["sample"], header["key"])] = entry
+
+        # Drop a record truncated by a crash, so that new ones can be appended
+        if start < end:
+            f.truncate(start)
+
+
+class _ArchiveReader:
+    def __init__(self, stream: ArchiveStream) -> None:
+        self._stream = stream
+
+    def __len__(self) -> int:
+        return len(self._stream)
+
+    def __getitem__(self, idx: int) -> ArchiveSample:
+        if not -len(self) <= idx < len(self):
+            raise IndexError(idx)
+        return self._stream.get_sample(idx % len(self))
+
+
+def is_archive(path: Path) -> bool:
+    """Whether a dataset path is an archive readable by `ArchiveStream`"""
+    return Path(path).suffix in ARCHIVE_SUFFIXES
@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+import sys
+from collections import OrderedDict
+from threading import RLock
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+
+def deep_sizeof(obj: Any) -> int:
+    """Estimate the size in bytes of an object, including nested containers"""
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k) + deep_sizeof(v) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(deep_sizeof(x) for x in obj)
+    return size
+
+
+class LRUCache:
+    """A thread-safe least-recently-used cache with a memory budget in bytes.
+
+    Every entry is stored together with its size in bytes. Keys are strings of the
+    form `NAMESPACE/...`, so that all entries belonging to a namespace (e.g. a
+    dataset) can be invalidated at once::
+
+        cache = LRUCache(capacity=256 * 2**20)
+        cache.put("my_dataset/0/image", qimage, qimage.sizeInBytes())
+        cache.get("my_dataset/0/image")
+        cache.invalidate("my_dataset")
+
+    When the total size exceeds `capacity`, the least recently used entry of the
+    namespace using the most memory is evicted, so that namespaces sharing the
+    budget get a fair share of it: a namespace is never evicted to make room for
+    another one that uses more memory. With a single namespace, this is plain LRU.
+    """
+
+    def __init__(self, capacity: int) -> None:
+        self._capacity = capacity
+        self._entries: Dict[Hashable, Tuple[Any, int]] = {}
+        self._lru: Dict[str, OrderedDict[Hashable, None]] = {}
+        self._usage: Dict[str, int] = {}
+        self._size = 0
+        self._hits = 0
+        self._misses = 0
+        self._lock = RLock()
+
+    @property
+    def capacity(self) -> int:
+        """The memory budget in bytes"""
+        return self._capacity
+
+    @capacity.setter
+    def capacity(self, value: int) -> None:
+        with self._lock:
+            self._capacity = value
+            self._evict()
+
+    @property
+    def size(self) -> int:
+        """The total size in bytes of the cached entries"""
+        return self._size
+
+    @property
+    def hits(self) -> int:
+        return self._hits
+
+    @property
+    def misses(self) -> int:
+        return self._misses
+
+    def usage(self, namespace: str) -> int:
+        """The total size in bytes of the entries of a namespace"""
+        return self._usage.get(namespace, 0)
+
+    @property
+    def namespaces(self) -> List[str]:
+        return list(self._usage)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def get(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return default
+            self._lru[self._namespace(key)].move_to_end(key)
+            self._hits += 1
+            return entry[0]
+
+    def nbytes(self, key: Hashable) -> int:
+        """The size in bytes of an entry, without touching it, or 0 if missing"""
+        entry = self._entries.get(key)
+        return 0 if entry is None else entry[1]
+
+    def put(self, key: Hashable, value: Any, nbytes: int) -> None:
+        with self._lock:
+            self._discard(key)
+            if nbytes > self._capacity:
+                return
+            namespace = self._namespace(key)
+            self._entries[key] = (value, nbytes)
+            self._lru.setdefault(namespace, OrderedDict())[key] = None
+            self._usage[namespace] = self._usage.get(namespace, 0) + nbytes
+            self._size += nbytes
+            self._evict()
+
+    def invalidate(self, namespace: str) -> None:
+        """Remove all the entries whose key starts with `namespace/`"""
+        with self._lock:
+            for key in self._lru.pop(namespace, {}):
+                self._size -= self._entries.pop(key)[1]
+            self._usage.pop(namespace, None)
+
+    def invalidate_where(
+        self, namespace: str, predicate: Callable[[Hashable, Any], bool]
+    ) -> None:
+        """Remove the entries of a namespace for which `predicate(key, value)` holds"""
+        with self._lock:
+            lru = self._lru.get(namespace, {})
+            for key in [k for k in lru if predicate(k, self._entries[k][0])]:
+                self._discard(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._lru.clear()
+            self._usage.clear()
+            self._size = 0
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self._hits = 0
+            self._misses = 0
+
+    @staticmethod
+    def _namespace(key: Hashable) -> str:
+        return str(key).split("/", maxsplit=1)[0]
+
+    def _discard(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        namespace = self._namespace(key)
+        lru = self._lru[namespace]
+        del lru[key]
+        self._usage[namespace] -= entry[1]
+        if not lru:
+            del self._lru[namespace]
+            del self._usage[namespace]
+        self._size -= entry[1]
+
+    def _evict(self) -> None:
+        while self._size > self._capacity and self._entries:
+            namespace = max(self._usage, key=self._usage.__getitem__)
+            key = next(iter(self._lru[namespace]))
+            self._discard(key)
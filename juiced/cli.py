@@ -0,0 +1,78 @@
+"""The "juiced" command.
+
+Only click is imported to parse the arguments, so `--help` is immediate. Qt is
+imported next to show a splash, everything else is imported in background by
+`juiced.startup`, see `Launcher`.
+"""
+
+from __future__ import annotations
+
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+import click
+
+
+class StartupProfile:
+    """Start time and duration of the stages of the startup, on any thread"""
+
+    def __init__(self) -> None:
+        self._start = time.perf_counter()
+        # Name, start and duration in seconds, whether on the main thread
+        self._stages: List[Tuple[str, float, Optional[float], bool]] = []
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Time the enclosed code as a stage"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._add(name, start, time.perf_counter() - start)
+
+    def mark(self, name: str) -> None:
+        """Record an instant, e.g. the first frame"""
+        self._add(name, time.perf_counter(), None)
+
+    def print(self) -> None:
+        """Print all the stages in order of start, to stderr"""
+        click.echo(f"{'stage':<40} {'start ms':>10} {'duration ms':>12}", err=True)
+        for name, start, duration, main in sorted(self._stages, key=lambda s: s[1]):
+            name = name if main else f"{name} (background)"
+            ms = "-" if duration is None else f"{duration * 1000:.1f}"
+            click.echo(f"{name:<40} {start * 1000:>10.1f} {ms:>12}", err=True)
+
+    def _add(self, name: str, start: float, duration: Optional[float]) -> None:
+        main = threading.current_thread() is threading.main_thread()
+        self._stages.append((name, start - self._start, duration, main))
+
+
+@click.command()
+@click.option(
+    "-i",
+    "--input_folder",
+    type=Path,
+    required=True,
+    multiple=True,
+    help="An underfolder, or a zip or tar archive of one. Can be repeated.",
+)
+@click.option(
+    "--profile-startup",
+    is_flag=True,
+    help="Print how long the imports and the initialisation took.",
+)
+def main(input_folder: Tuple[Path, ...], profile_startup: bool) -> None:
+    """Browse and label pipelime underfolders"""
+    profile = StartupProfile()
+    with profile.stage("import PySide6"):
+        from juiced.startup import run
+
+    sys.exit(run(input_folder, profile, profile_startup))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+from typing import Dict, Tuple
+
+import numpy as np
+from PySide6.QtGui import QImage
+
+# Native QImage format for every (dtype, channels) array layout
+QIMAGE_FORMATS: Dict[Tuple[np.dtype, int], QImage.Format] = {
+    (np.dtype(np.uint8), 1): QImage.Format_Grayscale8,
+    (np.dtype(np.uint8), 3): QImage.Format_RGB888,
+    (np.dtype(np.uint8), 4): QImage.Format_RGBA8888,
+    (np.dtype(np.uint16), 1): QImage.Format_Grayscale16,
+    (np.dtype(np.uint16), 4): QImage.Format_RGBA64,
+}
+
+
+def array_to_qimage(array: np.ndarray) -> QImage:
+    """Wrap an HxW or HxWxC uint8/uint16 array into a QImage without copying it.
+
+    The QImage format is chosen to match the array layout, so that no per-pixel
+    conversion is needed. The QImage shares the memory of the array, which is kept
+    alive by PySide until the QImage data is released. A copy is made only if the
+    array is not C-contiguous, or for 16 bit RGB arrays that have no matching format
+    and are padded to `Format_RGBX64`.
+
+    Args:
+        array (np.ndarray): The array to convert.
+
+    Raises:
+        ValueError: If the array layout is not supported.
+
+    Returns:
+        QImage: The converted image.
+    """
+    if array.ndim == 3 and array.shape[2] == 1:
+        array = array[:, :, 0]
+    channels = 1 if array.ndim == 2 else array.shape[2]
+
+    if array.dtype == np.uint16 and channels == 3:
+        padded = np.empty((*array.shape[:2], 4), dtype=np.uint16)
+        padded[:, :, :3] = array
+        padded[:, :, 3] = np.iinfo(np.uint16).max
+        array, format_ = padded, QImage.Format_RGBX64
+    else:
+        format_ = QIMAGE_FORMATS.get((array.dtype, channels))
+        if format_ is None:
+            raise ValueError(
+                f"Unsupported array layout: {array.dtype} with {channels} channels"
+            )
+
+    if not array.flags.c_contiguous:
+        array = np.ascontiguousarray(array)
+
+    height, width = array.shape[:2]
+    return QImage(array, width, height, array.strides[0], format_)
@@ -1,14 +1,33 @@
 from __future__ import annotations
 
+import hashlib
+import os
+import tempfile
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from threading import Lock
 from traceback import print_exc
-from typing import Any
+from typing import Any, BinaryIO, Dict, Optional, Tuple, Union
+from urllib.parse import parse_qsl
 
 import numpy as np
 from pipelime.sequences.samples import SamplesSequence
-from PySide6.QtCore import QSize
+from PIL import Image
+from PySide6.QtCore import QRunnable, QSize, QThreadPool
 from PySide6.QtGui import QImage
 from PySide6.QtQml import QQmlImageProviderBase
-from PySide6.QtQuick import QQuickImageProvider
+from PySide6.QtQuick import (
+    QQuickAsyncImageProvider,
+    QQuickImageProvider,
+    QQuickImageResponse,
+    QQuickTextureFactory,
+)
+
+from juiced.cache import LRUCache
+from juiced.conversion import array_to_qimage
+from juiced.instrumentation import Instrumentation
+from juiced.normalization import Normalizer
+from juiced.pyramid import ImagePyramid
 
 
 class PipelimeImageProvider(QQuickImageProvider):
@@ -48,49 +67,568 @@ class PipelimeImageProvider(QQuickImageProvider):
 
         - `ITEM_NAME` is the name of the image item to display
 
+    If the qml `Image` sets a `sourceSize`, only the pixels needed to fit inside it
+    are decoded: JPEGs are decoded at reduced resolution directly by the codec, any
+    other item is downsampled by an integer factor. The original size of the image is
+    always reported to qml, and can be queried with `image_size`, or read in
+    background with `request_size`.
+
+    Non uint8 items are normalized to uint8 by a `Normalizer`, with a strategy that
+    depends on their dtype and statistics computed once per dataset.
+
+    Decoded images are kept in an LRU cache with a memory budget of `cache_size`
+    bytes, shared among all datasets with fair eviction, so that the memory used
+    does not grow with the number of datasets. Replacing a dataset with
+    `add_dataset` invalidates all its cached images, `remove_dataset` releases
+    everything related to a dataset. Every requested resolution is cached
+    separately. Hit/miss counters are available through the `cache` property::
+
+        provider.cache.capacity = 512 * 2**20
+        print(provider.cache.hits, provider.cache.misses)
+
+    The `metadata_cache`, with a budget of `metadata_cache_size` bytes, is shared
+    in the same way by the datasets of the `Scene` to keep the metadata of their
+    samples.
+
+    Array items stored as `.npy` files are memory mapped instead of being loaded,
+    and a single plane or channel can be requested with a suffix on the item name::
+
+        image://PROVIDER_NAME/DATASET_NAME/SAMPLE_INDEX/ITEM_NAME?slice=10
+        image://PROVIDER_NAME/DATASET_NAME/SAMPLE_INDEX/ITEM_NAME?channel=2
+
+    where `slice` indexes the first axis and `channel` the last one, so that only
+    the pages of the requested view are read from disk.
+
+    Very large images can be requested in tiles, with the following url::
+
+        image://PROVIDER_NAME/DATASET_NAME/SAMPLE_INDEX/ITEM_NAME/LEVEL/TX/TY
+
+    where `LEVEL` is the level of a resolution pyramid (0 is the full resolution,
+    every level halves the size of the previous one) and `TX`, `TY` are the column
+    and row of a `tile_size` x `tile_size` tile. Pyramids are built lazily on the
+    first tile request and stored in `tile_cache`, on disk. A pyramid is built by the
+    first request of one of its tiles, concurrent requests of the same pyramid wait
+    for it, the other requests are not blocked.
+
     """
 
     _instance: PipelimeImageProvider = None
 
+    # Formats whose size can be read from the header and that support draft decoding
+    HEADER_FORMATS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff")
+    DRAFT_FORMATS = (".jpg", ".jpeg")
+
     @classmethod
     def get_instance(cls) -> PipelimeImageProvider:
         if cls._instance is None:
             cls._instance = PipelimeImageProvider()
         return cls._instance
 
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        cache_size: int = 256 * 2**20,
+        tile_size: int = 256,
+        tile_cache: Optional[Path] = None,
+        metadata_cache_size: int = 256 * 2**20,
+    ) -> None:
         super().__init__(QQmlImageProviderBase.ImageType.Image)
         self._datasets = {}
+        self._cache = LRUCache(cache_size)
+        self._metadata_cache = LRUCache(metadata_cache_size)
+        self._normalizer = Normalizer(on_update=self._on_window_update)
+        self._sizes: Dict[str, Tuple[int, int]] = {}
+        self._sizes_lock = Lock()
+        self._sizes_executor = ThreadPoolExecutor(2, thread_name_prefix="image-size")
+
+        self.tile_size = tile_size
+        if tile_cache is None:
+            tile_cache = Path(tempfile.gettempdir()) / "juiced" / "tiles"
+        self.tile_cache = Path(tile_cache)
+        # Pyramids being built or built, by image id
+        self._pyramids: Dict[str, Future] = {}
+        self._pyramids_lock = Lock()
+        self._window_updates = 0
+        self._metrics = Instrumentation.get_instance()
+
+    @property
+    def cache(self) -> LRUCache:
+        return self._cache
+
+    @property
+    def metadata_cache(self) -> LRUCache:
+        return self._metadata_cache
+
+    @property
+    def normalizer(self) -> Normalizer:
+        return self._normalizer
 
     def add_dataset(self, dataset: SamplesSequence, id_: str) -> None:
         self._datasets[id_] = dataset
+        self._invalidate(id_)
+        self._normalizer.invalidate(id_)
 
-    def _sanitize_item(self, item: Any) -> np.ndarray:
-        array: np.ndarray = item
-        if len(array.shape) == 2:
-            array = np.expand_dims(array, -1)
-        if array.shape[2] == 1:
-            array = np.stack([array[:, :, 0]] * 3, -1)
-        if array.dtype == np.float32:
-            array = (array - array.min()) / (array.max() - array.min()) * 255
-        array = array.astype(np.uint8)
+    def remove_dataset(self, id_: str) -> None:
+        """Forget a dataset and release all its cached data"""
+        self._datasets.pop(id_, None)
+        self._invalidate(id_)
+        self._metadata_cache.invalidate(id_)
+        self._normalizer.remove(id_)
+
+    def prefetch(self, id_: str, requested_size: Optional[QSize] = None) -> int:
+        """Decode an image into the cache, if not already present.
+
+        Returns:
+            int: The size in bytes of the cached image.
+        """
+        requested_size = QSize() if requested_size is None else requested_size
+        key = self._cache_key(id_, requested_size)
+        if key not in self._cache:
+            self.requestImage(id_, QSize(), requested_size)
+        return self._cache.nbytes(key)
+
+    def item_path(self, id_: str) -> Optional[Path]:
+        """The file an item is stored into, if the dataset is on the filesystem"""
+        dataset, idx, key = id_.split("/", maxsplit=3)
+        return self._item_path(self._datasets[dataset][int(idx)], key)
+
+    def item_stamp(self, id_: str) -> Optional[str]:
+        """A string that changes when the content of an item changes, if known"""
+        dataset, idx, key = id_.split("/", maxsplit=3)
+        return self._item_stamp(self._datasets[dataset][int(idx)], key)
+
+    def dataset_length(self, id_: str) -> int:
+        return len(self._datasets[id_])
+
+    def image_size(self, id_: str) -> Tuple[int, int]:
+        """The original (width, height) of an image, reading as little as possible"""
+        size = self._sizes.get(id_)
+        if size is not None:
+            return size
+        dataset, idx, key = id_.split("/", maxsplit=3)
+        sample = self._datasets[dataset][int(idx)]
+        source, suffix = self._item_source(sample, key)
+        array = self._item_array(sample, key) if suffix == ".npy" else None
+        if array is not None:
+            array = self._select(array, key)
+            self._set_size(id_, (array.shape[1], array.shape[0]))
+        elif source is not None and suffix in self.HEADER_FORMATS:
+            with Image.open(source) as img:
+                self._set_size(id_, img.size)
+        else:
+            self.requestImage(id_, QSize(), QSize())
+        return self._sizes.get(id_, (0, 0))
+
+    def known_size(self, id_: str) -> Optional[Tuple[int, int]]:
+        """The original (width, height) of an image if already read, None otherwise"""
+        with self._sizes_lock:
+            return self._sizes.get(id_)
+
+    def request_size(self, id_: str) -> Future:
+        """Read the original (width, height) of an image on a background thread"""
+        return self._sizes_executor.submit(self.image_size, id_)
+
+    def placeholder(self) -> QImage:
+        """The image returned when an item cannot be loaded, with an "error" text"""
+        qimg = self._to_qimage(np.zeros((256, 256, 3), dtype=np.uint8))
+        qimg.setText("error", "1")
+        return qimg
+
+    def _set_size(self, id_: str, size: Tuple[int, int]) -> None:
+        with self._sizes_lock:
+            self._sizes[id_] = size
+
+    def _invalidate(self, id_: str) -> None:
+        self._cache.invalidate(id_)
+        prefix = f"{id_}/"
+        with self._sizes_lock:
+            for k in [k for k in self._sizes if k.startswith(prefix)]:
+                del self._sizes[k]
+        with self._pyramids_lock:
+            for k in [k for k in self._pyramids if k.startswith(prefix)]:
+                del self._pyramids[k]
+
+    def _on_window_update(self, dataset: str, key: str, dtype: str) -> None:
+        # Only the images decoded from the item with the window are stale, the
+        # cached ones and the tiles know the dtype they were decoded from
+        def stale(cache_key: str, entry: Tuple[QImage, Tuple[int, int]]) -> bool:
+            item = cache_key.split("/", maxsplit=2)[2].partition("@")[0]
+            if item.count("/") == 3:
+                item = item.split("/", maxsplit=1)[0]
+            base = item.partition("?")[0]
+            return base == key and entry[0].text("dtype") == dtype
+
+        self._cache.invalidate_where(dataset, stale)
+        # Loaded pyramids are loaded again, those baked with another window are
+        # rebuilt. The ones being built are dropped when done.
+        prefix = f"{dataset}/"
+        with self._pyramids_lock:
+            self._window_updates += 1
+            for k, future in list(self._pyramids.items()):
+                item = k.split("/", maxsplit=2)[2].partition("?")[0]
+                if k.startswith(prefix) and item == key and future.done():
+                    del self._pyramids[k]
+
+    def _cache_key(self, id_: str, requested_size: QSize) -> str:
+        if self._is_requested(requested_size):
+            return f"{id_}@{requested_size.width()}x{requested_size.height()}"
+        return id_
+
+    def _is_requested(self, requested_size: QSize) -> bool:
+        return requested_size.width() > 0 or requested_size.height() > 0
+
+    def _split_view(self, key: str) -> Tuple[str, Dict[str, int]]:
+        # "depth?slice=3&channel=0" -> "depth", {"slice": 3, "channel": 0}
+        key, _, query = key.partition("?")
+        view = {k: int(v) for k, v in parse_qsl(query)}
+        unknown = set(view) - {"slice", "channel"}
+        if unknown:
+            raise ValueError(f"Unknown view parameters: {', '.join(unknown)}")
+        return key, view
+
+    def _select(self, array: np.ndarray, key: str) -> np.ndarray:
+        # The view of an array requested with the suffix of an item name, lazily
+        _, view = self._split_view(key)
+        if "slice" in view:
+            array = array[view["slice"]]
+        if "channel" in view:
+            array = array[..., view["channel"]]
         return array
 
-    def _to_qimage(self, array: np.ndarray) -> QImage:
+    def _item_path(self, sample: Any, key: str) -> Optional[Path]:
+        key, _ = self._split_view(key)
+        path = getattr(sample, "filesmap", {}).get(key)
+        return None if path is None else Path(path)
+
+    def _item_source(
+        self, sample: Any, key: str
+    ) -> Tuple[Optional[Union[Path, BinaryIO]], str]:
+        # The raw file of an item, or a file-like object for packed datasets
+        path = self._item_path(sample, key)
+        if path is not None:
+            return path, path.suffix.lower()
+        if hasattr(sample, "open_item"):
+            source, suffix = sample.open_item(self._split_view(key)[0])
+            return source, suffix.lower()
+        return None, ""
+
+    def _item_array(self, sample: Any, key: str) -> Optional[np.ndarray]:
+        # A read-only memory map of a .npy item, None if it cannot be mapped
+        path = self._item_path(sample, key)
+        if path is not None:
+            if path.suffix.lower() != ".npy":
+                return None
+            return np.load(path, mmap_mode="r")
+        if hasattr(sample, "open_array"):
+            return sample.open_array(self._split_view(key)[0])
+        return None
+
+    def _item_stamp(self, sample: Any, key: str) -> Optional[str]:
+        # Views of the same item get different stamps
+        base, _, query = key.partition("?")
+        path = self._item_path(sample, base)
+        if path is not None:
+            stat = path.stat()
+            stamp = f"{path.resolve()}:{stat.st_mtime_ns}:{stat.st_size}"
+        elif hasattr(sample, "item_stamp"):
+            stamp = sample.item_stamp(base)
+        else:
+            return None
+        return f"{stamp}?{query}" if query else stamp
+
+    def _target_size(
+        self, width: int, height: int, requested_size: QSize
+    ) -> Tuple[int, int]:
+        # Fit inside the requested size preserving aspect ratio, a non positive
+        # dimension means "unconstrained"
+        rw, rh = requested_size.width(), requested_size.height()
+        scale = min(
+            rw / width if rw > 0 else 1.0,
+            rh / height if rh > 0 else 1.0,
+            1.0,
+        )
+        return max(1, round(width * scale)), max(1, round(height * scale))
+
+    def _read_item(
+        self, sample: Any, key: str, requested_size: QSize
+    ) -> Tuple[np.ndarray, Tuple[int, int]]:
+        # JPEG supports decoding at 1/2, 1/4 or 1/8 of the resolution for free
+        if self._is_requested(requested_size):
+            source, suffix = self._item_source(sample, key)
+        else:
+            source, suffix = None, ""
+        if source is not None and suffix in self.DRAFT_FORMATS:
+            with Image.open(source) as img:
+                original = img.size
+                img.draft(img.mode, self._target_size(*original, requested_size))
+                array = np.asarray(img)
+            return array, original
+
+        array = self._read_array(sample, key)
+        return array, (array.shape[1], array.shape[0])
+
+    def _read_array(self, sample: Any, key: str) -> np.ndarray:
+        # .npy items are mapped rather than loaded, and only the view is touched
+        array = self._item_array(sample, key)
+        if array is None:
+            array = np.asarray(sample[self._split_view(key)[0]])
+        return self._select(array, key)
+
+    def _downsample(self, array: np.ndarray, target: Tuple[int, int]) -> np.ndarray:
         height, width = array.shape[:2]
-        format_ = QImage.Format_ARGB32
-        array = array.astype(np.uint32)
-        r, g, b = [array[:, :, i] for i in range(3)]
-        data = (255 << 24 | r << 16 | g << 8 | b).flatten()
-        return QImage(data, width, height, format_)
+        factor = min(width // target[0], height // target[1])
+        if factor < 2:
+            return array
+
+        # Cheap strided subsampling down to twice the target, then a 2x2 area
+        # average to get rid of most of the aliasing
+        stride = factor // 2
+        if stride > 1:
+            array = array[::stride, ::stride]
+        h, w = array.shape[0] // 2 * 2, array.shape[1] // 2 * 2
+        blocks = array[:h, :w].reshape(h // 2, 2, w // 2, 2, *array.shape[2:])
+        return blocks.mean(axis=(1, 3), dtype=np.float32).astype(array.dtype)
+
+    def _sanitize_item(self, item: Any, dataset: str, key: str) -> np.ndarray:
+        array: np.ndarray = item
+        if len(array.shape) == 3 and array.shape[2] not in (1, 3, 4):
+            array = array[:, :, :3] if array.shape[2] > 4 else array[:, :, :1]
+        sequence = self._datasets[dataset]
+        # Statistics are shared by all the views of an item, but computed on views
+        return self._normalizer.normalize(
+            array,
+            dataset,
+            self._split_view(key)[0],
+            lambda i: self._read_array(sequence[i], key),
+            len(sequence),
+        )
+
+    def _to_qimage(self, array: np.ndarray) -> QImage:
+        return array_to_qimage(array)
+
+    def _pyramid_folder(self, id_: str, sample: Any, key: str) -> Path:
+        # Pyramids of files are identified by path, mtime and size, so that they can
+        # be reused across sessions and are rebuilt when the file changes
+        name = self._item_stamp(sample, key)
+        if name is None:
+            name = f"{os.getpid()}:{id(self._datasets[id_.split('/')[0]])}:{id_}"
+        digest = hashlib.sha1(name.encode()).hexdigest()
+        return self.tile_cache / f"{digest}_{self.tile_size}"
+
+    def _pyramid(self, id_: str) -> ImagePyramid:
+        # The lock only guards the futures, the first request builds the pyramid and
+        # the others wait for its future
+        with self._pyramids_lock:
+            future = self._pyramids.get(id_)
+            owner = future is None
+            if owner:
+                future = self._pyramids[id_] = Future()
+                updates = self._window_updates
+        if owner:
+            try:
+                future.set_result(self._load_pyramid(id_))
+                with self._pyramids_lock:
+                    if self._window_updates != updates:
+                        self._pyramids.pop(id_, None)
+            except BaseException as e:
+                # Forget the failure, the next request will try again
+                with self._pyramids_lock:
+                    if self._pyramids.get(id_) is future:
+                        del self._pyramids[id_]
+                future.set_exception(e)
+        return future.result()
+
+    def _load_pyramid(self, id_: str) -> ImagePyramid:
+        dataset, idx, key = id_.split("/")
+        sample = self._datasets[dataset][int(idx)]
+        folder = self._pyramid_folder(id_, sample, key)
+        base = self._split_view(key)[0]
+        pyramid = ImagePyramid(folder) if ImagePyramid.exists(folder) else None
+        # Pyramids built by older versions may have fewer levels or no source, and
+        # pyramids baked with another normalization window are stale: all are rebuilt
+        if pyramid is not None:
+            levels = ImagePyramid.count_levels(*pyramid.size, self.tile_size)
+            source = pyramid.source
+            if (
+                pyramid.levels != levels
+                or source is None
+                or source["window"] is None
+                or source["window"]
+                != self._normalizer.stamp(dataset, base, source["dtype"])
+            ):
+                pyramid = None
+        if pyramid is None:
+            array, _ = self._read_item(sample, key, QSize())
+            # The stamp is taken before normalizing, a window updated meanwhile
+            # makes the pyramid stale rather than wrongly fresh
+            dtype = array.dtype.name
+            source = {
+                "dtype": dtype,
+                "window": self._normalizer.stamp(dataset, base, dtype),
+            }
+            array = self._sanitize_item(array, dataset, key)
+            pyramid = ImagePyramid.build(array, folder, self.tile_size, source)
+        self._set_size(id_, pyramid.size)
+        return pyramid
+
+    def _request_tile(self, id_: str, size: QSize, cache_key: str) -> QImage:
+        image_id, level, tx, ty = id_.rsplit("/", maxsplit=3)
+        pyramid = self._pyramid(image_id)
+        tile = pyramid.tile(int(level), int(tx), int(ty))
+        qimg = self._to_qimage(tile)
+        qimg.setText("dtype", pyramid.source["dtype"])
+        size.setWidth(qimg.width())
+        size.setHeight(qimg.height())
+        entry = (qimg, (qimg.width(), qimg.height()))
+        self._cache.put(cache_key, entry, qimg.sizeInBytes())
+        return qimg
 
     def requestImage(self, id: str, size: QSize, requestedSize: QSize) -> QImage:
-        dataset, idx, key = id.split("/", maxsplit=3)
+        metrics = self._metrics
+        cache_key = self._cache_key(id, requestedSize)
+        entry = self._cache.get(cache_key)
+        if entry is not None:
+            metrics.count("image.cache.hit")
+            qimg, original = entry
+            size.setWidth(original[0])
+            size.setHeight(original[1])
+            return qimg
+        metrics.count("image.cache.miss")
+
+        if id.count("/") == 5:
+            try:
+                with metrics.timer("image.tile"):
+                    return self._request_tile(id, size, cache_key)
+            except:
+                print_exc()
+                return self.placeholder()
+
         try:
-            item = self._datasets[dataset][int(idx)][key]
-            array = self._sanitize_item(item)
+            qimg, original = self.decode(id, requestedSize)
         except:
-            array = np.zeros((256, 256, 3), dtype=np.uint8)
             print_exc()
-        qimg = self._to_qimage(array)
+            return self.placeholder()
+
+        size.setWidth(original[0])
+        size.setHeight(original[1])
+        self._cache.put(cache_key, (qimg, original), qimg.sizeInBytes())
         return qimg
+
+    def decode(self, id_: str, requested_size: QSize) -> Tuple[QImage, Tuple[int, int]]:
+        """Decode an image and its original (width, height), bypassing the cache"""
+        metrics = self._metrics
+        dataset, idx, key = id_.split("/", maxsplit=3)
+        sample = self._datasets[dataset][int(idx)]
+        with metrics.timer("image.read"):
+            array, original = self._read_item(sample, key, requested_size)
+            if self._is_requested(requested_size):
+                target = self._target_size(*original, requested_size)
+                array = self._downsample(array, target)
+        dtype = array.dtype.name
+        with metrics.timer("image.sanitize"):
+            array = self._sanitize_item(array, dataset, key)
+        self._set_size(id_, original)
+        with metrics.timer("image.convert"):
+            qimg = self._to_qimage(array)
+        qimg.setText("dtype", dtype)
+        return qimg, original
+
+
+class PipelimeImageResponse(QQuickImageResponse):
+    """The response to an asynchronous image request, decoded on a thread pool.
+
+    If the request is canceled before a worker picks it up, it is removed from the
+    pool and never decoded.
+    """
+
+    def __init__(
+        self,
+        provider: QQuickImageProvider,
+        pool: QThreadPool,
+        id_: str,
+        requested_size: QSize,
+    ) -> None:
+        super().__init__()
+        self._image = QImage()
+        self._canceled = False
+        self._pool = pool
+        self._runnable = _ImageRunnable(self, provider, id_, requested_size)
+        pool.start(self._runnable)
+
+    @property
+    def canceled(self) -> bool:
+        return self._canceled
+
+    def textureFactory(self) -> QQuickTextureFactory:
+        return QQuickTextureFactory.textureFactoryForImage(self._image)
+
+    def cancel(self) -> None:
+        self._canceled = True
+        if self._pool.tryTake(self._runnable):
+            self.finished.emit()
+
+    def set_image(self, image: QImage) -> None:
+        self._image = image
+        self.finished.emit()
+
+
+class _ImageRunnable(QRunnable):
+    def __init__(
+        self,
+        response: PipelimeImageResponse,
+        provider: QQuickImageProvider,
+        id_: str,
+        requested_size: QSize,
+    ) -> None:
+        super().__init__()
+        self.setAutoDelete(False)
+        self._response = response
+        self._provider = provider
+        self._id = id_
+        self._requested_size = requested_size
+
+    def run(self) -> None:
+        if self._response.canceled:
+            self._response.set_image(QImage())
+            return
+        image = self._provider.requestImage(self._id, QSize(), self._requested_size)
+        self._response.set_image(image)
+
+
+class PipelimeAsyncImageProvider(QQuickAsyncImageProvider):
+    """Asynchronous variant of `PipelimeImageProvider`.
+
+    Requests are decoded by a synchronous provider, by default the singleton
+    `PipelimeImageProvider` instance so that datasets and cache are shared, on a
+    bounded thread pool with `workers` threads, keeping the GUI responsive while
+    large images are loading. The url scheme is the same of the wrapped provider::
+
+        provider = PipelimeAsyncImageProvider(workers=4)
+        engine.addImageProvider("pipelime", provider)
+
+    """
+
+    def __init__(
+        self,
+        provider: Optional[QQuickImageProvider] = None,
+        workers: Optional[int] = None,
+    ) -> None:
+        super().__init__()
+        if provider is None:
+            provider = PipelimeImageProvider.get_instance()
+        self._provider = provider
+        self._pool = QThreadPool()
+        if workers is not None:
+            self._pool.setMaxThreadCount(workers)
+
+    @property
+    def provider(self) -> QQuickImageProvider:
+        return self._provider
+
+    @property
+    def pool(self) -> QThreadPool:
+        return self._pool
+
+    def requestImageResponse(
+        self, id: str, requestedSize: QSize
+    ) -> PipelimeImageResponse:
+        return PipelimeImageResponse(self._provider, self._pool, id, requestedSize)
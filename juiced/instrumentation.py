@@ -0,0 +1,271 @@
+from __future__ import annotations
+
+import csv
+import json
+import math
+import time
+from contextlib import nullcontext
+from pathlib import Path
+from threading import Lock
+from traceback import print_exc
+from typing import Any, ContextManager, Dict, List, Optional
+
+import numpy as np
+from PySide6.QtCore import Property, QObject, QTimer, Signal, Slot
+
+_NULL = nullcontext()
+
+
+class LatencyHistogram:
+    """Rolling percentiles of durations, in a fixed-size histogram.
+
+    Durations are counted in logarithmic bins, `resolution` per decade from 1 µs to
+    1000 s, so recording is O(1) and percentiles are accurate within a bin (about
+    12% with the default resolution). Counts are kept in two windows of `window_s`
+    seconds, the current and the previous one, so percentiles cover the last one to
+    two windows.
+    """
+
+    LOW, HIGH = -6, 3
+
+    def __init__(self, window_s: float = 60.0, resolution: int = 20) -> None:
+        self._window = window_s
+        self._resolution = resolution
+        bins = (self.HIGH - self.LOW) * resolution
+        self._current = np.zeros(bins, dtype=np.int64)
+        self._previous = np.zeros(bins, dtype=np.int64)
+        self._started = time.monotonic()
+        self._total = 0
+        self._lock = Lock()
+
+    @property
+    def total(self) -> int:
+        """The number of durations recorded since the start"""
+        return self._total
+
+    def record(self, seconds: float) -> None:
+        log = math.log10(seconds) if seconds > 0 else self.LOW
+        index = int((log - self.LOW) * self._resolution)
+        index = min(max(index, 0), len(self._current) - 1)
+        with self._lock:
+            self._rotate()
+            self._current[index] += 1
+            self._total += 1
+
+    def percentiles(self, ps: List[float]) -> List[float]:
+        """The given percentiles of the recent durations, in seconds, NaN if none"""
+        with self._lock:
+            self._rotate()
+            counts = self._current + self._previous
+        total = counts.sum()
+        if total == 0:
+            return [math.nan] * len(ps)
+        cumulative = np.cumsum(counts)
+        indices = np.searchsorted(cumulative, [p / 100 * total for p in ps])
+        indices = np.minimum(indices, len(counts) - 1)
+        # The geometric centre of the bin
+        return [10 ** (self.LOW + (i + 0.5) / self._resolution) for i in indices]
+
+    def count(self) -> int:
+        """The number of recent durations"""
+        with self._lock:
+            self._rotate()
+            return int(self._current.sum() + self._previous.sum())
+
+    def _rotate(self) -> None:
+        elapsed = time.monotonic() - self._started
+        if elapsed < self._window:
+            return
+        if elapsed < 2 * self._window:
+            self._previous = self._current
+        else:
+            self._previous = np.zeros_like(self._current)
+        self._current = np.zeros_like(self._current)
+        self._started = time.monotonic()
+
+
+class _Timer:
+    def __init__(self, histogram: LatencyHistogram) -> None:
+        self._histogram = histogram
+
+    def __enter__(self) -> _Timer:
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self._histogram.record(time.perf_counter() - self._start)
+
+
+class Instrumentation(QObject):
+    """Opt-in timers and counters of the hot paths of the application.
+
+    Instrumented code times its stages and counts its events by name::
+
+        metrics = Instrumentation.get_instance()
+        with metrics.timer("image.read"):
+            ...
+        metrics.count("image.cache.hit")
+
+    When disabled, `timer` returns a shared no-op context and `count` returns
+    immediately, so the overhead is a single attribute check. When enabled, every
+    timer keeps rolling p50/p95/p99 in a `LatencyHistogram`. A snapshot of all the
+    metrics is exposed to qml as `metrics`, refreshed every `interval_ms`, and can
+    be dumped periodically to a JSON or CSV file, by suffix, with `dump_to`.
+    """
+
+    _instance: Instrumentation = None
+
+    enabledChanged = Signal()
+    updated = Signal()
+
+    PERCENTILES = (50, 95, 99)
+    MAX_FRAME_S = 1.0
+
+    @classmethod
+    def get_instance(cls) -> Instrumentation:
+        if cls._instance is None:
+            cls._instance = Instrumentation()
+        return cls._instance
+
+    def __init__(
+        self,
+        interval_ms: int = 1000,
+        window_s: float = 60.0,
+        parent: Optional[QObject] = None,
+    ) -> None:
+        super().__init__(parent)
+        self._enabled = False
+        self._window = window_s
+        self._histograms: Dict[str, LatencyHistogram] = {}
+        self._counters: Dict[str, int] = {}
+        self._lock = Lock()
+        self._last_frame: Optional[float] = None
+
+        self._timer = QTimer(self)
+        self._timer.setInterval(interval_ms)
+        self._timer.timeout.connect(self.updated)
+
+        self._dump_path: Optional[Path] = None
+        self._dump_timer = QTimer(self)
+        self._dump_timer.timeout.connect(self.dump)
+
+    def timer(self, name: str) -> ContextManager:
+        """A context that records its duration, if enabled"""
+        if not self._enabled:
+            return _NULL
+        return _Timer(self.histogram(name))
+
+    def record(self, name: str, seconds: float) -> None:
+        """Record a duration measured elsewhere, if enabled"""
+        if self._enabled:
+            self.histogram(name).record(seconds)
+
+    def count(self, name: str, n: int = 1) -> None:
+        """Increment a counter, if enabled"""
+        if not self._enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def histogram(self, name: str) -> LatencyHistogram:
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(
+                    name, LatencyHistogram(self._window)
+                )
+        return histogram
+
+    @Slot()
+    def frame(self) -> None:
+        """Record the time since the previous frame, connect to `frameSwapped`"""
+        now = time.perf_counter()
+        if self._enabled and self._last_frame is not None:
+            # Nothing is rendered while idle, longer gaps are not frames
+            if now - self._last_frame < self.MAX_FRAME_S:
+                self.histogram("qml.frame").record(now - self._last_frame)
+        self._last_frame = now
+
+    def snapshot(self) -> Dict[str, Any]:
+        """All the timers, as milliseconds percentiles and counts, and all counters"""
+        timers = {}
+        for name, histogram in sorted(self._histograms.items()):
+            values = histogram.percentiles(list(self.PERCENTILES))
+            timers[name] = {
+                "count": histogram.count(),
+                "total": histogram.total,
+                **{
+                    f"p{p}": None if math.isnan(v) else v * 1000
+                    for p, v in zip(self.PERCENTILES, values)
+                },
+            }
+        with self._lock:
+            counters = dict(sorted(self._counters.items()))
+        return {"time": time.time(), "timers": timers, "counters": counters}
+
+    def dump_to(self, path: Optional[Path], interval_s: float = 60.0) -> None:
+        """Dump a snapshot every `interval_s` seconds while enabled, None to stop"""
+        self._dump_path = None if path is None else Path(path)
+        self._dump_timer.setInterval(int(interval_s * 1000))
+        self._update_timers()
+
+    @Slot()
+    def dump(self) -> None:
+        """Append a snapshot to the dump file: a JSON line or some CSV rows"""
+        if self._dump_path is None:
+            return
+        try:
+            self._dump_path.parent.mkdir(parents=True, exist_ok=True)
+            snapshot = self.snapshot()
+            if self._dump_path.suffix == ".csv":
+                self._dump_csv(snapshot)
+            else:
+                with open(self._dump_path, "a") as f:
+                    f.write(json.dumps(snapshot) + "\n")
+        except Exception:
+            print_exc()
+
+    def _dump_csv(self, snapshot: Dict[str, Any]) -> None:
+        header = not self._dump_path.exists()
+        fields = ["time", "name", "count", "total"]
+        fields += [f"p{p}" for p in self.PERCENTILES]
+        with open(self._dump_path, "a", newline="") as f:
+            # Counters only have a count, their other fields are left empty
+            writer = csv.DictWriter(f, fields, restval="")
+            if header:
+                writer.writeheader()
+            for name, timer in snapshot["timers"].items():
+                writer.writerow({"time": snapshot["time"], "name": name, **timer})
+            for name, value in snapshot["counters"].items():
+                row = {"time": snapshot["time"], "name": name, "count": value}
+                writer.writerow(row)
+
+    def _update_timers(self) -> None:
+        for timer, active in (
+            (self._timer, self._enabled),
+            (self._dump_timer, self._enabled and self._dump_path is not None),
+        ):
+            if active and not timer.isActive():
+                timer.start()
+            elif not active:
+                timer.stop()
+
+    @Property(bool, notify=enabledChanged)
+    def enabled(self) -> bool:
+        return self._enabled
+
+    @enabled.setter
+    def enabled(self, value: bool) -> None:
+        if value != self._enabled:
+            self._enabled = value
+            self._last_frame = None
+            self._update_timers()
+            self.enabledChanged.emit()
+
+    @Property("QVariantList", notify=updated)
+    def metrics(self) -> List[Dict[str, Any]]:
+        """Rows with name, count and percentiles in ms of timers, then counters"""
+        snapshot = self.snapshot()
+        rows = [{"name": k, **v} for k, v in snapshot["timers"].items()]
+        rows += [{"name": k, "count": v} for k, v in snapshot["counters"].items()]
+        return rows
@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import json
+import os
+import time
+from pathlib import Path
+from traceback import print_exc
+from typing import Any, Dict, List, Optional
+
+
+class EditJournal:
+    """An append-only journal of edit operations, with undo/redo history.
+
+    Every edit is appended to `journal.jsonl` as a single json line with the sample
+    index, the item, the key path inside the item, the old and the new value and a
+    timestamp, so that committing an edit costs O(1) no matter how large the item
+    is. Once edits are written to the dataset files, the journal is compacted with
+    `compact`. A lock file is kept while the journal is open: if it is found when
+    opening, the previous session did not shut down cleanly and the `entries` left
+    in the journal must be replayed::
+
+        journal = EditJournal(folder)
+        for entry in journal.entries():
+            apply(entry["sample"], entry["item"], entry["key"], entry["new"])
+        journal.record(0, "metadata", "labels.digit", "zero", "one")
+        entry = journal.undo()
+
+    Consecutive edits of the same key within `merge_ms` milliseconds (e.g. while
+    dragging a shape) are merged into a single undo step. Undo and redo are
+    appended to the journal as regular edits, so replaying it is always correct.
+    """
+
+    JOURNAL_FILE = "journal.jsonl"
+    LOCK_FILE = "journal.lock"
+
+    def __init__(self, folder: Path, merge_ms: int = 1000) -> None:
+        self._folder = Path(folder)
+        self._folder.mkdir(parents=True, exist_ok=True)
+        self._path = self._folder / self.JOURNAL_FILE
+        self._lock_path = self._folder / self.LOCK_FILE
+        self._merge = merge_ms / 1000
+
+        self._unclean = self._lock_path.exists()
+        self._lock_path.write_text(str(os.getpid()))
+        self._file = open(self._path, "a", encoding="utf-8")
+
+        self._undo: List[Dict[str, Any]] = []
+        self._redo: List[Dict[str, Any]] = []
+
+    @property
+    def unclean(self) -> bool:
+        """True if the previous session did not shut down cleanly"""
+        return self._unclean
+
+    @property
+    def can_undo(self) -> bool:
+        return len(self._undo) > 0
+
+    @property
+    def can_redo(self) -> bool:
+        return len(self._redo) > 0
+
+    def entries(self) -> List[Dict[str, Any]]:
+        """The edits left in the journal, in order, corrupted lines are skipped"""
+        entries = []
+        if not self._path.exists():
+            return entries
+        with open(self._path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # A line truncated by a crash can only be the last one
+                    print_exc()
+        return entries
+
+    def record(self, sample: int, item: str, key: str, old: Any, new: Any) -> None:
+        """Append an edit and push it to the undo history, clearing redo"""
+        entry = self._append(sample, item, key, old, new)
+        self._redo.clear()
+        last = self._undo[-1] if self._undo else None
+        if (
+            last is not None
+            and (last["sample"], last["item"], last["key"]) == (sample, item, key)
+            and entry["time"] - last["time"] < self._merge
+        ):
+            last["new"] = new
+            last["time"] = entry["time"]
+        else:
+            self._undo.append(entry)
+
+    def undo(self) -> Optional[Dict[str, Any]]:
+        """Append the inverse of the last edit, returns it or None if none is left"""
+        if not self._undo:
+            return None
+        entry = self._undo.pop()
+        self._redo.append(entry)
+        return self._append(
+            entry["sample"], entry["item"], entry["key"], entry["new"], entry["old"]
+        )
+
+    def redo(self) -> Optional[Dict[str, Any]]:
+        """Append again the last undone edit, returns it or None if none is left"""
+        if not self._redo:
+            return None
+        entry = self._redo.pop()
+        self._undo.append(entry)
+        return self._append(
+            entry["sample"], entry["item"], entry["key"], entry["old"], entry["new"]
+        )
+
+    def compact(self) -> None:
+        """Drop all the edits in the journal, once they are written to the dataset.
+
+        The undo/redo history is kept in memory.
+        """
+        self._file.seek(0)
+        self._file.truncate()
+        self._file.flush()
+
+    def close(self) -> None:
+        """Compact the journal and release the lock, marking a clean shutdown"""
+        if self._file.closed:
+            return
+        self.compact()
+        self._file.close()
+        try:
+            self._lock_path.unlink()
+        except FileNotFoundError:
+            pass
+
+    def _append(
+        self, sample: int, item: str, key: str, old: Any, new: Any
+    ) -> Dict[str, Any]:
+        entry = {
+            "sample": sample,
+            "item": item,
+            "key": key,
+            "old": old,
+            "new": new,
+            "time": time.time(),
+        }
+        try:
+            self._file.write(json.dumps(entry) + "\n")
+            self._file.flush()
+        except Exception:
+            print_exc()
+        return entry
@@ -0,0 +1,205 @@
+from __future__ import annotations
+
+from typing import Any, Callable, Dict, List, Mapping, Optional, Sequence
+
+import numpy as np
+
+from juiced.criterion import Criterion
+
+_MISSING = object()
+
+
+class LabelStore:
+    """Columnar in-memory store of the labels of all the samples of a dataset.
+
+    Every criterion is stored in a single NumPy array with one entry per sample:
+    categorical codes for "choice", bool for "bool", int32 for "int" and float64 for
+    "range", so that counting, filtering and exporting are vectorised operations::
+
+        store = LabelStore(criteria, len(dataset))
+        store.load(0, [{"color": "blue", "anomalous": True}, ...])
+        blue = store.column("color") == store.code("color", "blue")
+
+    Values that do not fit the column of their criterion (e.g. a string default of
+    an "int" criterion) are kept as they are in a sparse overflow dictionary, so
+    that `get` always returns the value that was set.
+
+    `on_set` is called with the sample index, the criterion name, the old and the new
+    value every time a label is changed with `set`, but not by `load`.
+    """
+
+    DTYPES = {
+        "choice": np.int16,
+        "bool": np.bool_,
+        "int": np.int32,
+        "range": np.float64,
+    }
+    TYPES = {"bool": {bool}, "int": {int}, "range": {int, float}}
+
+    def __init__(
+        self,
+        criteria: Sequence[Criterion],
+        length: int,
+        on_set: Optional[Callable[[int, str, Any, Any], None]] = None,
+    ) -> None:
+        self.on_set = on_set
+        self._criteria = {c.name: c for c in criteria}
+        self._length = length
+        self._choices: Dict[str, List[Any]] = {}
+        self._codes: Dict[str, Dict[Any, int]] = {}
+        self._columns: Dict[str, Optional[np.ndarray]] = {}
+        self._overflow: Dict[str, Dict[int, Any]] = {}
+        for c in criteria:
+            dtype = self.DTYPES.get(c.type)
+            self._columns[c.name] = None if dtype is None else np.zeros(length, dtype)
+            self._overflow[c.name] = {}
+            if c.type == "choice":
+                choices = list(c.data.get("choices", []))
+                self._choices[c.name] = choices
+                self._codes[c.name] = {v: i for i, v in enumerate(choices)}
+
+    def __len__(self) -> int:
+        return self._length
+
+    @property
+    def names(self) -> List[str]:
+        return list(self._criteria)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the columns, overflow values excluded"""
+        return sum(c.nbytes for c in self._columns.values() if c is not None)
+
+    def criterion(self, name: str) -> Criterion:
+        return self._criteria[name]
+
+    def column(self, name: str) -> Optional[np.ndarray]:
+        """A read-only view on the column of a criterion, None if not columnar.
+
+        Entries whose value is in the overflow are meaningless, see `overflow`.
+        """
+        column = self._columns[name]
+        if column is None:
+            return None
+        view = column.view()
+        view.flags.writeable = False
+        return view
+
+    def overflow(self, name: str) -> Dict[int, Any]:
+        """The values of a criterion that are not stored in its column"""
+        return self._overflow[name]
+
+    def choices(self, name: str) -> List[Any]:
+        """The values of the codes of a "choice" criterion"""
+        return self._choices[name]
+
+    def code(self, name: str, value: Any) -> int:
+        """The code of a "choice" value, -1 if it is not a valid choice"""
+        return self._codes[name].get(value, -1)
+
+    def encode(self, name: str, value: Any) -> Optional[Any]:
+        """The value as stored in the column of a criterion, None if it does not fit"""
+        encoded = self._encode(name, value)
+        return None if encoded is _MISSING else encoded
+
+    def get(self, idx: int, name: str) -> Any:
+        """The value of a label of a sample, as a plain python object"""
+        overflow = self._overflow[name]
+        if overflow and idx in overflow:
+            return overflow[idx]
+        value = self._columns[name][idx]
+        if name in self._choices:
+            return self._choices[name][value]
+        return value.item()
+
+    def set(self, idx: int, name: str, value: Any) -> None:
+        """Set the value of a label of a sample"""
+        old = self.get(idx, name)
+        self._set(idx, name, value)
+        if self.on_set is not None:
+            self.on_set(idx, name, old, value)
+
+    def _set(self, idx: int, name: str, value: Any) -> None:
+        encoded = self._encode(name, value)
+        if encoded is _MISSING:
+            self._overflow[name][idx] = value
+        else:
+            self._columns[name][idx] = encoded
+            self._overflow[name].pop(idx, None)
+
+    def row(self, idx: int) -> Dict[str, Any]:
+        """All the labels of a sample, as a new dictionary"""
+        return {name: self.get(idx, name) for name in self._criteria}
+
+    def load(
+        self, start: int, rows: Sequence[Optional[Mapping[str, Any]]]
+    ) -> np.ndarray:
+        """Set the labels of the consecutive samples starting at `start`.
+
+        Every column is filled in a single vectorised assignment, labels missing
+        from a row are set to the default of their criterion.
+
+        Returns:
+            np.ndarray: A bool mask of the rows that had missing labels.
+        """
+        missing = np.zeros(len(rows), dtype=bool)
+        stop = start + len(rows)
+        for name, criterion in self._criteria.items():
+            values = [_MISSING if r is None else r.get(name, _MISSING) for r in rows]
+            for i, value in enumerate(values):
+                if value is _MISSING:
+                    values[i] = criterion.default
+                    missing[i] = True
+
+            overflow = self._overflow[name]
+            for idx in [k for k in overflow if start <= k < stop]:
+                del overflow[idx]
+
+            column = self._columns[name]
+            if column is None:
+                overflow.update(enumerate(values, start=start))
+                continue
+
+            encoded = self._encode_many(name, values)
+            if encoded is not None:
+                column[start:stop] = encoded
+                continue
+
+            # Slow path, some values do not fit the column
+            for idx, value in enumerate(values, start=start):
+                self._set(idx, name, value)
+        return missing
+
+    def _encode(self, name: str, value: Any) -> Any:
+        criterion = self._criteria[name]
+        column = self._columns[name]
+        if column is None:
+            return _MISSING
+        if criterion.type == "choice":
+            try:
+                code = self._codes[name].get(value, -1)
+            except TypeError:
+                return _MISSING
+            return _MISSING if code < 0 else code
+        if type(value) not in self.TYPES[criterion.type]:
+            return _MISSING
+        if criterion.type == "int":
+            info = np.iinfo(column.dtype)
+            if not info.min <= value <= info.max:
+                return _MISSING
+        return value
+
+    def _encode_many(self, name: str, values: List[Any]) -> Optional[np.ndarray]:
+        # None if any value does not fit the column
+        criterion = self._criteria[name]
+        dtype = self._columns[name].dtype
+        try:
+            if criterion.type == "choice":
+                lookup = self._codes[name]
+                codes = np.array([lookup.get(v, -1) for v in values], dtype=dtype)
+                return None if (codes < 0).any() else codes
+            if not set(map(type, values)) <= self.TYPES[criterion.type]:
+                return None
+            return np.array(values, dtype=dtype)
+        except (TypeError, OverflowError):
+            return None
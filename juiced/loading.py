@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import multiprocessing
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from threading import Event, Thread
+from traceback import print_exc
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import yaml
+from PySide6.QtCore import QObject, Signal
+
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:  # pragma: no cover
+    from yaml import SafeLoader
+
+
+def load_yaml(path: Path) -> Optional[Dict[str, Any]]:
+    """Load a yaml file, returns None on failure"""
+    try:
+        with open(path) as f:
+            return yaml.load(f, Loader=SafeLoader)
+    except Exception:
+        print_exc()
+        return None
+
+
+# An executor, the function to map, its arguments and the chunk size
+_Job = Tuple[Executor, Callable, Sequence, int]
+
+
+class MetadataLoader(QObject):
+    """Loads the metadata of all the samples of a dataset in background.
+
+    Yaml parsing is CPU bound and holds the GIL, so files are parsed on a pool of
+    `workers` processes. Metadata that is not stored in files is read with a
+    `reader` function on a pool of threads instead. Results are delivered in
+    order, in batches of `batch_size` (except the first one, which is delivered
+    alone), through the `batchLoaded` signal, which is always received on the
+    thread the loader lives in.
+    """
+
+    batchLoaded = Signal(int, object)
+    finished = Signal()
+
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        batch_size: int = 512,
+        processes: bool = True,
+        parent: Optional[QObject] = None,
+    ) -> None:
+        super().__init__(parent)
+        self._workers = workers
+        self._batch_size = batch_size
+        self._processes = processes
+        self._thread: Optional[Thread] = None
+        self._stop = Event()
+        self._started = 0.0
+
+    @property
+    def started(self) -> float:
+        """The time at which loading started"""
+        return self._started
+
+    def load_files(self, paths: Sequence[Path]) -> None:
+        """Parse a sequence of yaml files in background"""
+        self._start(lambda: self._files_job(paths))
+
+    def load(self, reader: Callable[[int], Any], length: int) -> None:
+        """Call `reader` on all the indices from 0 to `length` in background"""
+        self._start(lambda: self._reader_job(reader, length))
+
+    def load_listed(
+        self,
+        list_files: Callable[[], Optional[Sequence[Path]]],
+        reader: Callable[[int], Any],
+        length: int,
+    ) -> None:
+        """Parse the files listed by `list_files`, or call `reader` if it returns None.
+
+        Files are listed in background too, so that listing a large dataset never
+        blocks the caller.
+        """
+
+        def job() -> _Job:
+            paths = list_files()
+            if paths is None:
+                return self._reader_job(reader, length)
+            return self._files_job(paths)
+
+        self._start(job)
+
+    def stop(self) -> None:
+        """Stop loading, batches that are already loaded may still be delivered"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _files_job(self, paths: Sequence[Path]) -> _Job:
+        if self._processes:
+            # Qt threads are running, forking is not safe
+            context = multiprocessing.get_context("spawn")
+            executor = ProcessPoolExecutor(self._workers, mp_context=context)
+        else:
+            executor = ThreadPoolExecutor(self._workers)
+        workers = self._workers or multiprocessing.cpu_count()
+        chunksize = max(1, min(self._batch_size, len(paths) // (4 * workers)))
+        return executor, load_yaml, paths, chunksize
+
+    def _reader_job(self, reader: Callable[[int], Any], length: int) -> _Job:
+        return ThreadPoolExecutor(self._workers), reader, range(length), 1
+
+    def _start(self, job: Callable[[], _Job]) -> None:
+        # The job is called on the loading thread
+        self._started = time.monotonic()
+        self._thread = Thread(target=self._run, args=(job,), daemon=True)
+        self._thread.start()
+
+    def _run(self, job: Callable[[], _Job]) -> None:
+        start = 0
+        batch: List[Any] = []
+        executor: Optional[Executor] = None
+        try:
+            executor, fn, args, chunksize = job()
+            for result in executor.map(fn, args, chunksize=chunksize):
+                if self._stop.is_set():
+                    break
+                batch.append(result)
+                # The first result is delivered alone, as soon as possible
+                if len(batch) >= self._batch_size or start == 0:
+                    self.batchLoaded.emit(start, batch)
+                    start += len(batch)
+                    batch = []
+            if batch and not self._stop.is_set():
+                self.batchLoaded.emit(start, batch)
+        except Exception:
+            print_exc()
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+            self.finished.emit()
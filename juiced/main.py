@@ -1,45 +1,161 @@
 import sys
 from pathlib import Path
+from typing import Any, Dict, Optional, Sequence, Tuple
 
 import click
 from choixe.configurations import XConfig
-from pipelime.sequences.readers.filesystem import UnderfolderReader
+from pipelime.sequences.streams.underfolder import UnderfolderStream
 from PySide6.QtCore import QUrl
 from PySide6.QtQml import QQmlApplicationEngine
 from PySide6.QtWidgets import QApplication
 
-from image_provider import PipelimeImageProvider
-from scene import Scene
+from juiced.image_provider import PipelimeAsyncImageProvider, PipelimeImageProvider
+from juiced.instrumentation import Instrumentation
+from juiced.loading import MetadataLoader
+from juiced.persistence import WriteBehind, install_signal_handlers
+from juiced.prefetch import Prefetcher
+from juiced.scene import Scene
+from juiced.shapes import ShapeImageProvider
+from juiced.thumbnails import ThumbnailImageProvider
 
 this_folder = Path(__file__).parent
 
 
-@click.command()
-@click.option("-i", "--input_folder", type=Path, required=True)
-def gui(input_folder: Path) -> None:
-    # Create app, engine and context
-    app = QApplication(sys.argv)
-    engine = QQmlApplicationEngine()
+def load_config() -> Dict[str, Any]:
+    """Load the xconfig from "config.yml" as a plain dictionary"""
+    return XConfig(this_folder / "config.yml").to_dict()
+
+
+def setup(
+    app: QApplication,
+    engine: QQmlApplicationEngine,
+    config: Dict[str, Any],
+    input_folder: Sequence[Path],
+    streams: Optional[Dict[Path, Tuple[UnderfolderStream, Path]]] = None,
+) -> None:
+    """Create the scene and the image providers, then load "main.qml" in `engine`.
+
+    `streams` are the datasets opened in advance with `open_stream`, if any.
+    """
+    # Opt-in timers of the hot paths, shown by the performance overlay
+    instrumentation_cfg = config["instrumentation"]
+    instrumentation = Instrumentation.get_instance()
+    instrumentation.enabled = instrumentation_cfg["enabled"]
+    if instrumentation_cfg["dumpPath"]:
+        instrumentation.dump_to(
+            Path(instrumentation_cfg["dumpPath"]).expanduser(),
+            instrumentation_cfg["dumpSeconds"],
+        )
 
-    # Load an xconfig from "config.yml" as a plain dictionary
-    config = XConfig(this_folder / "config.yml").to_dict()
+    # Configure how non uint8 images are normalized, before any dataset is added
+    provider = PipelimeImageProvider.get_instance()
+    provider.normalizer.configure_from_dict(config["normalization"])
+
+    # Setup scene, every input folder is a dataset, opened when first selected.
+    # Metadata is loaded in background while the splash is shown, and kept in a
+    # cache shared by all the datasets
+    metadata_cfg = config["metadata"]
+    provider.metadata_cache.capacity = metadata_cfg["cacheSize"]
+
+    def loader_factory() -> MetadataLoader:
+        return MetadataLoader(
+            workers=metadata_cfg["workers"],
+            batch_size=metadata_cfg["batchSize"],
+            processes=metadata_cfg["processes"],
+        )
 
-    # Setup scene
-    scene = Scene(input_folder)
+    # Edits are journaled and written in background, pending writes are flushed
+    # before exiting, also when the app is terminated by a signal
+    persistence_cfg = config["persistence"]
+
+    def writer_factory() -> WriteBehind:
+        return WriteBehind(
+            quiet_ms=persistence_cfg["quietMillis"],
+            batch_size=persistence_cfg["batchSize"],
+        )
+
+    scene = Scene(
+        input_folder,
+        loader_factory=loader_factory,
+        writer_factory=writer_factory,
+        defaults=config["dataset"]["defaults"],
+        undo_merge_ms=persistence_cfg["undoMergeMillis"],
+        streams=streams,
+    )
+    app.aboutToQuit.connect(scene.close)
+    install_signal_handlers(app)
 
     # Make "config" and "scene" accessible from qml
     context = engine.rootContext()
     context.setContextProperty("config", config)
     context.setContextProperty("scene", scene)
+    context.setContextProperty("instrumentation", instrumentation)
 
     # This is crucial: to load custom images in qml, you need to add an "ImageProvider"
     # Here we choose to use a "PipelimeImageProvider" which loads images from pipelime
     # samples sequences.
-    provider = PipelimeImageProvider.get_instance()
+    # If "asynchronous" is enabled, images are decoded on a thread pool, without ever
+    # blocking the GUI.
+    provider_cfg = config["imageProvider"]
+    provider.cache.capacity = provider_cfg["cacheSize"]
+    provider.tile_size = provider_cfg["tileSize"]
+    provider.tile_cache = Path(provider_cfg["tileCache"]).expanduser()
+    if provider_cfg["asynchronous"]:
+        provider = PipelimeAsyncImageProvider(provider, provider_cfg["workers"])
     engine.addImageProvider("pipelime", provider)
 
-    # Start the app
+    # Thumbnails are stored on disk, and generated in background for all samples
+    thumbnails_cfg = config["thumbnails"]
+    thumbnails = ThumbnailImageProvider(
+        PipelimeImageProvider.get_instance(),
+        Path(thumbnails_cfg["cacheDir"]).expanduser(),
+        size=thumbnails_cfg["size"],
+        workers=thumbnails_cfg["workers"],
+    )
+    engine.addImageProvider(
+        "thumbnails",
+        PipelimeAsyncImageProvider(thumbnails, thumbnails_cfg["workers"]),
+    )
+    scene.datasetOpened.connect(lambda d: thumbnails.fill(d.name, d.imageKey))
+
+    # All the shapes of a sample are drawn into a single overlay image
+    engine.addImageProvider(
+        "shapes",
+        ShapeImageProvider(
+            scene, PipelimeImageProvider.get_instance(), config["colorPalette"]
+        ),
+    )
+
+    # Warm the image provider with the samples that are likely to be shown next
+    prefetch_cfg = config["prefetch"]
+    prefetcher = Prefetcher(
+        PipelimeImageProvider.get_instance(),
+        scene.dataset,
+        count=prefetch_cfg["count"],
+        max_bytes=prefetch_cfg["maxBytes"],
+        workers=prefetch_cfg["workers"],
+    )
+    context.setContextProperty("prefetcher", prefetcher)
+    scene.currentChanged.connect(lambda: setattr(prefetcher, "dataset", scene.dataset))
+
+    app.aboutToQuit.connect(thumbnails.close)
+
+    # Load the main window
     engine.load(QUrl.fromLocalFile(str(this_folder / "qml" / "main.qml")))
+    for window in engine.rootObjects():
+        window.frameSwapped.connect(instrumentation.frame)
+
+
+@click.command()
+@click.option("-i", "--input_folder", type=Path, required=True, multiple=True)
+def gui(input_folder: Tuple[Path, ...]) -> None:
+    # Create app and engine, everything is imported and set up before anything is
+    # shown, the "juiced" command starts faster
+    app = QApplication(sys.argv)
+    engine = QQmlApplicationEngine()
+    setup(app, engine, load_config(), input_folder)
+
+    # Start the app
     exit_code = app.exec()
     del engine
     sys.exit(exit_code)
@@ -6,4 +6,5 @@ class Naming:
     image: str = "image"
     criteria: str = "criteria"
     shape: str = "metadata.shape"
+    shapes: str = "metadata.shapes"
     labels: str = "metadata.labels"
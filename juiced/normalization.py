@@ -0,0 +1,357 @@
+from __future__ import annotations
+
+import json
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from pathlib import Path
+from threading import Lock, Thread, current_thread
+from traceback import print_exc
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+Window = Tuple[float, float]
+
+
+class Normalization(ABC):
+    """A strategy to compute the intensity window mapped to the [0, 255] range"""
+
+    @abstractmethod
+    def window(self, array: np.ndarray) -> Window:
+        """Compute the window of a single array"""
+        pass
+
+    def merge(self, windows: List[Window]) -> Window:
+        """Merge the windows computed on several arrays into a single one"""
+        lows, highs = zip(*windows)
+        return float(np.median(lows)), float(np.median(highs))
+
+
+class MinMaxNormalization(Normalization):
+    """Maps the minimum and maximum values to 0 and 255, NaNs are ignored"""
+
+    def window(self, array: np.ndarray) -> Window:
+        return float(np.nanmin(array)), float(np.nanmax(array))
+
+    def merge(self, windows: List[Window]) -> Window:
+        lows, highs = zip(*windows)
+        return min(lows), max(highs)
+
+
+class PercentileNormalization(Normalization):
+    """Clips the values outside the [low, high] percentiles, NaNs are ignored.
+
+    Percentiles are estimated on a strided subset of at most `max_pixels` pixels.
+    """
+
+    def __init__(
+        self, low: float = 1.0, high: float = 99.0, max_pixels: int = 2**18
+    ) -> None:
+        self._low = low
+        self._high = high
+        self._max_pixels = max_pixels
+
+    def window(self, array: np.ndarray) -> Window:
+        pixels = array.shape[0] * array.shape[1]
+        stride = max(1, int(np.sqrt(pixels / self._max_pixels)))
+        subset = array[::stride, ::stride]
+        low, high = np.nanpercentile(subset, [self._low, self._high])
+        return float(low), float(high)
+
+
+class FixedNormalization(Normalization):
+    """A fixed window, e.g. [0, 1] for bool arrays or a known sensor range"""
+
+    def __init__(self, low: float, high: float) -> None:
+        self._window = (float(low), float(high))
+
+    def window(self, array: np.ndarray) -> Window:
+        return self._window
+
+    def merge(self, windows: List[Window]) -> Window:
+        return self._window
+
+
+NORMALIZATIONS: Dict[str, Callable[..., Normalization]] = {
+    "minmax": MinMaxNormalization,
+    "percentile": PercentileNormalization,
+    "fixed": FixedNormalization,
+}
+
+
+def normalization_from_config(cfg: Dict[str, Any]) -> Normalization:
+    """Build a normalization from a dictionary like `{type: percentile, low: 1}`"""
+    cfg = dict(cfg)
+    return NORMALIZATIONS[cfg.pop("type")](**cfg)
+
+
+class Normalizer:
+    """Converts arrays of any dtype to uint8 with a per-dtype normalization strategy.
+
+    Strategies are looked up by dtype name (e.g. "uint16") and then by dtype kind
+    ("bool", "uint", "int", "float"). uint8 arrays and dtypes with no strategy are
+    passed through unchanged.
+
+    With `scope="dataset"` the window of every (dataset, item) pair is computed once
+    on up to `samples` items, in a background pass, and reused for every sample so
+    that display is consistent. Until the pass is over, the window of the first
+    requested item is used. If a sidecar file is set with `set_sidecar`, windows are
+    loaded from and saved to it. With `scope="item"`, every item is normalized on
+    its own statistics. `on_update` is called with the name of the dataset, the name
+    of the item and the dtype name every time a background pass changes a window.
+    Passes of datasets invalidated or removed meanwhile are discarded.
+
+    Integer arrays up to 16 bit are mapped with a lookup table, cached for the last
+    `max_luts` windows, all other arrays with a single float32 pass.
+    """
+
+    DEFAULT_STRATEGIES: Dict[str, Normalization] = {
+        "bool": FixedNormalization(0, 1),
+        "uint16": PercentileNormalization(0.5, 99.5),
+        "uint": MinMaxNormalization(),
+        "int": MinMaxNormalization(),
+        "float": MinMaxNormalization(),
+    }
+    KINDS = {"b": "bool", "u": "uint", "i": "int", "f": "float"}
+
+    def __init__(
+        self,
+        strategies: Optional[Dict[str, Normalization]] = None,
+        scope: str = "dataset",
+        samples: int = 32,
+        on_update: Optional[Callable[[str, str, str], None]] = None,
+        max_luts: int = 64,
+    ) -> None:
+        self._strategies = dict(self.DEFAULT_STRATEGIES)
+        self._windows: Dict[Hashable, Window] = {}
+        self._pending: Dict[Hashable, Thread] = {}
+        self._sidecars: Dict[str, Path] = {}
+        self._lock = Lock()
+        # Lookup tables by dtype name and window
+        self._luts: OrderedDict[Tuple[str, Window], np.ndarray] = OrderedDict()
+        self._max_luts = max_luts
+        self._luts_lock = Lock()
+        self.on_update = on_update
+        self.configure(strategies, scope, samples)
+
+    def configure(
+        self,
+        strategies: Optional[Dict[str, Normalization]] = None,
+        scope: str = "dataset",
+        samples: int = 32,
+    ) -> None:
+        """Change the strategies, must be called before any array is normalized"""
+        if scope not in ("dataset", "item"):
+            raise ValueError(f"Unknown normalization scope: {scope}")
+        with self._lock:
+            self._strategies.update(strategies or {})
+            self._scope = scope
+            self._samples = samples
+
+    def configure_from_dict(self, cfg: Dict[str, Any]) -> None:
+        """Same as `configure`, with strategies given as plain dictionaries"""
+        strategies = {
+            k: normalization_from_config(v)
+            for k, v in cfg.get("strategies", {}).items()
+        }
+        self.configure(strategies, cfg.get("scope", "dataset"), cfg.get("samples", 32))
+
+    def strategy(self, dtype: np.dtype) -> Optional[Normalization]:
+        with self._lock:
+            return self._strategy(dtype)
+
+    def _strategy(self, dtype: np.dtype) -> Optional[Normalization]:
+        # Must be called with the lock held
+        if dtype == np.uint8:
+            return None
+        return self._strategies.get(
+            dtype.name, self._strategies.get(self.KINDS.get(dtype.kind))
+        )
+
+    def set_sidecar(self, dataset: str, path: Path) -> None:
+        """Load and save the windows of a dataset to/from a json file"""
+        self._sidecars[dataset] = path
+        if path.exists():
+            try:
+                saved = json.loads(path.read_text())
+            except Exception:
+                print_exc()
+                return
+            with self._lock:
+                for name, window in saved.items():
+                    key, dtype = name.rsplit("/", maxsplit=1)
+                    self._windows[(dataset, key, dtype)] = tuple(window)
+
+    def invalidate(self, dataset: str) -> None:
+        """Forget the windows of a dataset, and discard its pending passes"""
+        with self._lock:
+            for k in [k for k in self._windows if k[0] == dataset]:
+                del self._windows[k]
+            for k in [k for k in self._pending if k[0] == dataset]:
+                del self._pending[k]
+
+    def remove(self, dataset: str) -> None:
+        """Forget the windows and the sidecar file of a dataset"""
+        self.invalidate(dataset)
+        self._sidecars.pop(dataset, None)
+
+    def stamp(self, dataset: str, key: str, dtype: str) -> Any:
+        """A json value that changes when the normalization of an item changes,
+        None while its window is not computed"""
+        with self._lock:
+            if self._strategy(np.dtype(dtype)) is None:
+                return "identity"
+            if self._scope == "item":
+                return "item"
+            window = self._windows.get((dataset, key, dtype))
+        return None if window is None else list(window)
+
+    def normalize(
+        self,
+        array: np.ndarray,
+        dataset: str,
+        key: str,
+        reader: Callable[[int], np.ndarray],
+        length: int,
+    ) -> np.ndarray:
+        """Normalize an array of a dataset item to uint8.
+
+        Args:
+            array (np.ndarray): The array to normalize.
+            dataset (str): The name of the dataset.
+            key (str): The name of the item.
+            reader (Callable[[int], np.ndarray]): A function that reads the item of
+            the sample at a given index, used by the background pass.
+            length (int): The number of samples in the dataset.
+
+        Returns:
+            np.ndarray: The normalized uint8 array.
+        """
+        # The configuration may change while the arrays of another thread are
+        # normalized, it is read once and consistently
+        with self._lock:
+            strategy = self._strategy(array.dtype)
+            scope = self._scope
+        if strategy is None:
+            return array
+
+        if scope == "item":
+            window = strategy.window(array)
+        else:
+            stats_key = (dataset, key, array.dtype.name)
+            with self._lock:
+                window = self._windows.get(stats_key)
+            if window is None:
+                # Computed without the lock, concurrent requests may compute it too
+                first = strategy.window(array)
+                with self._lock:
+                    window = self._windows.setdefault(stats_key, first)
+                    if window is first:
+                        self._start_pass(stats_key, strategy, reader, length)
+        return self.apply(array, window)
+
+    def apply(self, array: np.ndarray, window: Window) -> np.ndarray:
+        """Map `window` to [0, 255] in a single pass"""
+        low, high = window
+        scale = 255.0 / (high - low) if high > low else 0.0
+
+        if array.dtype == np.bool_:
+            lut = np.array([0, 255 if high > 0 else 0], dtype=np.uint8)
+            return lut[array.view(np.uint8)]
+
+        if array.dtype.kind in "ui" and array.dtype.itemsize <= 2:
+            lut = self._lut(array.dtype, window)
+            # Signed values are shifted so that the minimum maps to the first entry
+            unsigned = np.dtype(f"u{array.dtype.itemsize}")
+            index = array.view(unsigned)
+            if array.dtype.kind == "i":
+                index = index ^ unsigned.type(1 << (8 * array.dtype.itemsize - 1))
+            return lut[index]
+
+        out = np.subtract(array, low, dtype=np.float32)
+        out *= scale
+        np.clip(out, 0, 255, out=out)
+        if array.dtype.kind == "f":
+            np.nan_to_num(out, copy=False)
+        return out.astype(np.uint8)
+
+    def _lut(self, dtype: np.dtype, window: Window) -> np.ndarray:
+        lut_key = (dtype.name, window)
+        with self._luts_lock:
+            lut = self._luts.get(lut_key)
+            if lut is not None:
+                self._luts.move_to_end(lut_key)
+                return lut
+        low, high = window
+        scale = 255.0 / (high - low) if high > low else 0.0
+        info = np.iinfo(dtype)
+        values = np.arange(info.min, info.max + 1, dtype=np.float32)
+        lut = np.clip((values - low) * scale, 0, 255).astype(np.uint8)
+        with self._luts_lock:
+            self._luts[lut_key] = lut
+            while len(self._luts) > self._max_luts:
+                self._luts.popitem(last=False)
+        return lut
+
+    def _start_pass(
+        self,
+        stats_key: Tuple[str, str, str],
+        strategy: Normalization,
+        reader: Callable[[int], np.ndarray],
+        length: int,
+    ) -> None:
+        if stats_key in self._pending:
+            return
+        thread = Thread(
+            target=self._dataset_pass,
+            args=(stats_key, strategy, reader, length, self._samples),
+            daemon=True,
+        )
+        self._pending[stats_key] = thread
+        thread.start()
+
+    def _dataset_pass(
+        self,
+        stats_key: Tuple[str, str, str],
+        strategy: Normalization,
+        reader: Callable[[int], np.ndarray],
+        length: int,
+        samples: int,
+    ) -> None:
+        # Compute the window on evenly spaced samples
+        indices = np.unique(np.linspace(0, length - 1, samples, dtype=int))
+        windows = []
+        for idx in indices:
+            try:
+                array = np.asarray(reader(int(idx)))
+                if array.dtype.name == stats_key[2]:
+                    windows.append(strategy.window(array))
+            except Exception:
+                print_exc()
+
+        with self._lock:
+            # The dataset was invalidated or removed meanwhile
+            if self._pending.get(stats_key) is not current_thread():
+                return
+            del self._pending[stats_key]
+            if not windows:
+                return
+            self._windows[stats_key] = strategy.merge(windows)
+            self._save(stats_key[0])
+        if self.on_update is not None:
+            self.on_update(*stats_key)
+
+    def _save(self, dataset: str) -> None:
+        path = self._sidecars.get(dataset)
+        if path is None:
+            return
+        saved = {
+            f"{k[1]}/{k[2]}": list(v)
+            for k, v in self._windows.items()
+            if k[0] == dataset
+        }
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps(saved, indent=2))
+        except Exception:
+            print_exc()
@@ -0,0 +1,217 @@
+from __future__ import annotations
+
+import os
+import signal
+import socket
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from threading import Lock
+from traceback import print_exc
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from PySide6.QtCore import (
+    Property,
+    QCoreApplication,
+    QObject,
+    QSocketNotifier,
+    QTimer,
+    Signal,
+    Slot,
+)
+
+Snapshot = Callable[[], Any]
+Write = Callable[[Any], None]
+
+
+class WriteBehind(QObject):
+    """Write-behind persistence of edited items.
+
+    Edits are marked as dirty with `mark`, repeated edits of the same key are
+    coalesced. Dirty items are flushed when no edit is made for `quiet_ms`
+    milliseconds, or as soon as `batch_size` items are dirty. At flush time, a
+    snapshot of every item is taken on the calling thread, then snapshots are
+    written in order on a background thread. Writes of files should go through
+    `replace_file`, so that a crash while writing never leaves a truncated file::
+
+        writer = WriteBehind(quiet_ms=500)
+        writer.mark(
+            (idx, "metadata"),
+            lambda: dict(data),
+            lambda d: replace_file(path, json.dumps(d).encode()),
+        )
+
+    Call `close` before exiting, to flush and wait for all pending writes.
+    """
+
+    pendingChanged = Signal()
+    flushed = Signal()
+
+    def __init__(
+        self,
+        quiet_ms: int = 500,
+        batch_size: int = 64,
+        parent: Optional[QObject] = None,
+    ) -> None:
+        super().__init__(parent)
+        self._batch_size = batch_size
+        self._dirty: Dict[Hashable, Tuple[Snapshot, Write]] = {}
+        self._in_flight = 0
+        self._lock = Lock()
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="write-behind")
+        self._closed = False
+
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(quiet_ms)
+        self._timer.timeout.connect(self.flush)
+
+        self._flushes = 0
+        self._last_latency = 0.0
+        self._total_latency = 0.0
+
+    def mark(self, key: Hashable, snapshot: Snapshot, write: Write) -> None:
+        """Mark an item as dirty.
+
+        Args:
+            key (Hashable): The identifier of the item, used to coalesce edits.
+            snapshot (Snapshot): Returns a copy of the data to write, it is called
+            at flush time on the thread that flushes.
+            write (Write): Writes a snapshot, called on the background thread.
+        """
+        self._dirty[key] = (snapshot, write)
+        self.pendingChanged.emit()
+        if len(self._dirty) >= self._batch_size:
+            self.flush()
+        else:
+            self._timer.start()
+
+    def mark_batch(self, items: Iterable[Tuple[Hashable, Snapshot, Write]]) -> None:
+        """Mark many items as dirty and flush them all together"""
+        for key, snapshot, write in items:
+            self._dirty[key] = (snapshot, write)
+        self.flush()
+        self.pendingChanged.emit()
+
+    def submit(self, items: Iterable[Tuple[Any, Write]]) -> None:
+        """Write items in background, after the ones flushed so far.
+
+        Every item is an argument and a write function, which takes the snapshot
+        by itself on the background thread, e.g. an index and a function reading
+        and writing the item at that index.
+        """
+        batch = list(items)
+        with self._lock:
+            self._in_flight += len(batch)
+        self.pendingChanged.emit()
+        if self._closed:
+            self._write(batch)
+        else:
+            self._executor.submit(self._write, batch)
+
+    @Slot()
+    def flush(self) -> None:
+        """Write all dirty items in background"""
+        self._timer.stop()
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, {}
+        batch = []
+        for snapshot, write in dirty.values():
+            try:
+                batch.append((snapshot(), write))
+            except Exception:
+                print_exc()
+        with self._lock:
+            self._in_flight += len(batch)
+        if self._closed:
+            self._write(batch)
+        else:
+            self._executor.submit(self._write, batch)
+
+    @Slot()
+    def close(self) -> None:
+        """Flush and wait for all pending writes, idempotent"""
+        if self._closed:
+            return
+        self.flush()
+        self._executor.shutdown(wait=True)
+        self._closed = True
+
+    @Property(int, notify=pendingChanged)
+    def pendingWrites(self) -> int:
+        """The number of items that are dirty or being written"""
+        return len(self._dirty) + self._in_flight
+
+    @Property(float, notify=flushed)
+    def flushLatency(self) -> float:
+        """Duration of the last flush, in milliseconds"""
+        return self._last_latency * 1000
+
+    @Property(float, notify=flushed)
+    def meanFlushLatency(self) -> float:
+        """Mean duration of the flushes, in milliseconds"""
+        return self._total_latency / max(self._flushes, 1) * 1000
+
+    def _write(self, batch: List[Tuple[Any, Write]]) -> None:
+        t0 = time.perf_counter()
+        for data, write in batch:
+            try:
+                write(data)
+            except Exception:
+                print_exc()
+        latency = time.perf_counter() - t0
+        with self._lock:
+            self._in_flight -= len(batch)
+            self._flushes += 1
+            self._last_latency = latency
+            self._total_latency += latency
+        self.flushed.emit()
+        self.pendingChanged.emit()
+
+
+def replace_file(path: Path, data: bytes) -> None:
+    """Write a file atomically, to a temporary file next to it then renamed over it"""
+    path = Path(path)
+    fd, tmp = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=path.parent)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        if path.exists():
+            os.chmod(tmp, path.stat().st_mode)
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+def install_signal_handlers(
+    app: QCoreApplication, signals: Tuple[int, ...] = (signal.SIGINT, signal.SIGTERM)
+) -> None:
+    """Quit the application gracefully when one of `signals` is received.
+
+    Quitting emits `aboutToQuit`, where pending writes can be flushed. Python signal
+    handlers only run while the interpreter is executing, so signals are also
+    written to a socket watched by the Qt event loop, which wakes it up to run them.
+    """
+    for signum in signals:
+        signal.signal(signum, lambda *_: app.quit())
+    receiver, sender = socket.socketpair()
+    receiver.setblocking(False)
+    sender.setblocking(False)
+    signal.set_wakeup_fd(sender.fileno())
+
+    notifier = QSocketNotifier(receiver.fileno(), QSocketNotifier.Read, app)
+    # The connection keeps both sockets alive as long as the notifier
+    sockets = (receiver, sender)
+
+    def drain() -> None:
+        try:
+            sockets[0].recv(4096)
+        except OSError:
+            pass
+
+    notifier.activated.connect(drain)
@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Optional
+
+from PySide6.QtCore import (
+    Property,
+    QObject,
+    QRunnable,
+    QSize,
+    QThreadPool,
+    Signal,
+    Slot,
+)
+
+if TYPE_CHECKING:
+    from juiced.image_provider import PipelimeImageProvider
+    from juiced.scene import Dataset
+
+
+class Prefetcher(QObject):
+    """Warms the image provider with the samples that are likely to be shown next.
+
+    Every time the selected sample changes, call `navigate` with the new index: the
+    next `count` samples in the direction of travel are decoded in background, the
+    closest first. Queued prefetches planned for a previous position are dropped, so
+    when the user reverses direction nothing is wasted on the old one. The estimated
+    size of the prefetched images never exceeds `maxBytes`.
+    """
+
+    countChanged = Signal()
+    maxBytesChanged = Signal()
+    requestedSizeChanged = Signal()
+
+    def __init__(
+        self,
+        provider: PipelimeImageProvider,
+        dataset: Dataset,
+        count: int = 4,
+        max_bytes: int = 128 * 2**20,
+        workers: int = 2,
+        parent: Optional[QObject] = None,
+    ) -> None:
+        super().__init__(parent)
+        self._provider = provider
+        self._dataset = dataset
+        self._count = count
+        self._max_bytes = max_bytes
+        self._requested_size = QSize()
+        self._pool = QThreadPool(self)
+        self._pool.setMaxThreadCount(workers)
+
+        self._current = None
+        self._direction = 1
+        self._generation = 0
+        self._item_bytes = 0
+
+    @Property(int, notify=countChanged)
+    def count(self) -> int:
+        return self._count
+
+    @count.setter
+    def count(self, value: int) -> None:
+        if value != self._count:
+            self._count = value
+            self.countChanged.emit()
+
+    @Property(int, notify=maxBytesChanged)
+    def maxBytes(self) -> int:
+        return self._max_bytes
+
+    @maxBytes.setter
+    def maxBytes(self, value: int) -> None:
+        if value != self._max_bytes:
+            self._max_bytes = value
+            self.maxBytesChanged.emit()
+
+    @Property(QSize, notify=requestedSizeChanged)
+    def requestedSize(self) -> QSize:
+        return self._requested_size
+
+    @requestedSize.setter
+    def requestedSize(self, value: QSize) -> None:
+        if value != self._requested_size:
+            self._requested_size = value
+            self._item_bytes = 0
+            self.requestedSizeChanged.emit()
+
+    @property
+    def dataset(self) -> Dataset:
+        return self._dataset
+
+    @dataset.setter
+    def dataset(self, value: Dataset) -> None:
+        """Prefetch from another dataset, dropping the queued prefetches"""
+        if value is not self._dataset:
+            self.cancel()
+            self._dataset = value
+            self._current = None
+            self._item_bytes = 0
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    @Slot(int)
+    def navigate(self, index: int) -> None:
+        """Notify the prefetcher that the sample at `index` is now selected"""
+        length = len(self._dataset.samples)
+        if length == 0:
+            return
+
+        if self._current is not None and index != self._current:
+            delta = (index - self._current) % length
+            self._direction = 1 if delta <= length // 2 else -1
+        self._current = index
+
+        # Queued prefetches planned for the previous position are stale
+        self.cancel()
+        count = min(self._count, length - 1)
+        if self._item_bytes > 0:
+            count = min(count, self._max_bytes // self._item_bytes)
+        for i in range(1, count + 1):
+            target = (index + self._direction * i) % length
+            id_ = self._image_id(target)
+            runnable = _PrefetchRunnable(self, id_, self._generation)
+            self._pool.start(runnable, count - i)
+
+    @Slot()
+    def cancel(self) -> None:
+        """Drop all the queued prefetches"""
+        self._generation += 1
+        self._pool.clear()
+
+    def fetch(self, id_: str, generation: int) -> None:
+        if generation != self._generation:
+            return
+        nbytes = self._provider.prefetch(id_, self._requested_size)
+        self._item_bytes = max(self._item_bytes, nbytes)
+
+    def _image_id(self, index: int) -> str:
+        return f"{self._dataset.name}/{index}/{self._dataset.naming.image}"
+
+
+class _PrefetchRunnable(QRunnable):
+    def __init__(self, prefetcher: Prefetcher, id_: str, generation: int) -> None:
+        super().__init__()
+        self._prefetcher = prefetcher
+        self._id = id_
+        self._generation = generation
+
+    def run(self) -> None:
+        self._prefetcher.fetch(self._id, self._generation)
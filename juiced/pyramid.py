@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import json
+import math
+from pathlib import Path
+from typing import Any, List, Tuple
+
+import numpy as np
+
+
+class ImagePyramid:
+    """A multi-resolution pyramid of an image, split in square tiles.
+
+    Every level is half the size of the previous one, level 0 being the full
+    resolution image, down to the coarsest level, which fits in a single tile of a
+    level as large as the full image, see `count_levels`. Levels are
+    stored in a folder as `.npy` files and memory mapped, so reading a tile only
+    touches the pages of that tile, no matter how large the image is::
+
+        pyramid = ImagePyramid.build(array, folder, tile_size=256)
+        tile = pyramid.tile(level=2, tx=3, ty=1)
+
+    A json `source` can be saved with the pyramid, e.g. what the array was computed
+    from, to tell whether the pyramid must be built again.
+    """
+
+    META_FILE = "pyramid.json"
+
+    def __init__(self, folder: Path) -> None:
+        self._folder = Path(folder)
+        meta = json.loads((self._folder / self.META_FILE).read_text())
+        self._tile_size: int = meta["tile_size"]
+        self._size: Tuple[int, int] = tuple(meta["size"])
+        self._source: Any = meta.get("source")
+        self._levels: List[np.ndarray] = [
+            np.load(self._level_path(self._folder, i), mmap_mode="r")
+            for i in range(meta["levels"])
+        ]
+
+    @classmethod
+    def exists(cls, folder: Path) -> bool:
+        return (Path(folder) / cls.META_FILE).exists()
+
+    @staticmethod
+    def count_levels(width: int, height: int, tile_size: int) -> int:
+        """The number of levels of the pyramid of an image, as computed by the viewer.
+
+        The coarsest level is `ceil(log2(max(width, height) / tile_size))`, so that
+        a single tile covers the whole image when it is scaled by 2^level.
+        """
+        side = max(width, height, 1)
+        return 1 + max(0, math.ceil(math.log2(side / tile_size)))
+
+    @classmethod
+    def build(
+        cls, array: np.ndarray, folder: Path, tile_size: int = 256, source: Any = None
+    ) -> ImagePyramid:
+        """Build the pyramid of an HxW or HxWxC array and store it in `folder`"""
+        folder = Path(folder)
+        folder.mkdir(parents=True, exist_ok=True)
+        # A previous pyramid in the folder is incomplete from now on
+        (folder / cls.META_FILE).unlink(missing_ok=True)
+
+        height, width = array.shape[:2]
+        levels = cls.count_levels(width, height, tile_size)
+        level = cls._write_level(cls._level_path(folder, 0), array)
+        for i in range(1, levels):
+            level = cls._halve(level, cls._level_path(folder, i), tile_size)
+
+        # The meta file is written last, it marks the pyramid as complete
+        meta = {
+            "tile_size": tile_size,
+            "size": [width, height],
+            "levels": levels,
+            "source": source,
+        }
+        (folder / cls.META_FILE).write_text(json.dumps(meta))
+        return cls(folder)
+
+    @property
+    def tile_size(self) -> int:
+        return self._tile_size
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        """The (width, height) of the full resolution image"""
+        return self._size
+
+    @property
+    def source(self) -> Any:
+        """The source saved with the pyramid, None if none"""
+        return self._source
+
+    @property
+    def levels(self) -> int:
+        return len(self._levels)
+
+    def level_size(self, level: int) -> Tuple[int, int]:
+        height, width = self._levels[level].shape[:2]
+        return width, height
+
+    def tile(self, level: int, tx: int, ty: int) -> np.ndarray:
+        """A view on the tile at column `tx` and row `ty` of the given level"""
+        t = self._tile_size
+        return self._levels[level][ty * t : (ty + 1) * t, tx * t : (tx + 1) * t]
+
+    @staticmethod
+    def _level_path(folder: Path, level: int) -> Path:
+        return folder / f"level_{level:02d}.npy"
+
+    @staticmethod
+    def _write_level(path: Path, array: np.ndarray) -> np.ndarray:
+        out = np.lib.format.open_memmap(
+            path, mode="w+", dtype=array.dtype, shape=array.shape
+        )
+        out[:] = array
+        out.flush()
+        return np.load(path, mmap_mode="r")
+
+    @staticmethod
+    def _halve(level: np.ndarray, path: Path, strip: int) -> np.ndarray:
+        # 2x2 area average, computed in strips of rows to keep memory bounded. An
+        # axis that is a single pixel long is not halved
+        fy, fx = (2 if n > 1 else 1 for n in level.shape[:2])
+        height, width = level.shape[0] // fy, level.shape[1] // fx
+        out = np.lib.format.open_memmap(
+            path, mode="w+", dtype=level.dtype, shape=(height, width, *level.shape[2:])
+        )
+        for y in range(0, height, strip):
+            rows = level[fy * y : fy * min(y + strip, height), : fx * width]
+            blocks = rows.reshape(rows.shape[0] // fy, fy, width, fx, *level.shape[2:])
+            out[y : y + strip] = blocks.mean(axis=(1, 3), dtype=np.float32)
+        out.flush()
+        return np.load(path, mmap_mode="r")
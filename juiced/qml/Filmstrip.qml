@@ -0,0 +1,49 @@
+import QtQuick
+import QtQuick.Controls
+
+// Horizontal strip with the thumbnails of all the samples of a dataset. Only the
+// visible delegates are instantiated, so it scales to any number of samples.
+ListView {
+    id: root
+
+    // The dataset to show
+    property var dataset
+
+    // Size of the thumbnails
+    property int thumbnailSize: 128
+
+    // Index of the selected sample
+    property int selected: 0
+
+    // Emitted when the user clicks on a thumbnail
+    signal clicked(int index)
+
+    orientation: ListView.Horizontal
+    spacing: 4
+    clip: true
+    model: root.dataset.samples
+    currentIndex: root.selected
+    highlightMoveDuration: 0
+    reuseItems: true
+    ScrollBar.horizontal: ScrollBar { }
+
+    delegate: Rectangle {
+        width: root.thumbnailSize
+        height: root.thumbnailSize
+        color: index === root.selected ? config.eyecanColor : "transparent"
+
+        Image {
+            anchors.fill: parent
+            anchors.margins: 2
+            asynchronous: true
+            fillMode: Image.PreserveAspectFit
+            source: "image://thumbnails/" + root.dataset.name + "/" + index + "/" + root.dataset.imageKey
+            sourceSize: Qt.size(root.thumbnailSize, root.thumbnailSize)
+        }
+
+        MouseArea {
+            anchors.fill: parent
+            onClicked: { root.clicked(index) }
+        }
+    }
+}
@@ -0,0 +1,56 @@
+import QtQuick
+import QtQuick.Layouts
+
+// Semi-transparent table with the timers and counters of the "instrumentation"
+// object exposed from python
+Rectangle {
+    id: root
+
+    width: table.implicitWidth + 20
+    height: table.implicitHeight + 20
+    radius: 4
+    color: "#c0000000"
+
+    function format(value) {
+        return value === undefined || value === null ? "-" : value.toFixed(2)
+    }
+
+    GridLayout {
+        id: table
+        anchors.centerIn: parent
+        columns: 5
+        columnSpacing: 12
+        rowSpacing: 2
+
+        Repeater {
+            model: ["metric", "count", "p50 ms", "p95 ms", "p99 ms"]
+            delegate: Text {
+                required property string modelData
+                text: modelData
+                color: "white"
+                font.bold: true
+            }
+        }
+
+        // Rows are flattened into cells, 5 per row
+        Repeater {
+            model: instrumentation.metrics
+            delegate: Repeater {
+                required property var modelData
+                model: [
+                    modelData.name,
+                    String(modelData.count),
+                    root.format(modelData.p50),
+                    root.format(modelData.p95),
+                    root.format(modelData.p99)
+                ]
+                delegate: Text {
+                    required property string modelData
+                    text: modelData
+                    color: "white"
+                    font.family: "monospace"
+                }
+            }
+        }
+    }
+}
@@ -1,7 +1,7 @@
 import QtQuick
 import QtQuick.Layouts
 import QtQuick.Controls
-import QtQuick.Shapes
+import QtQuick.Window
 
 // Panel Content
 Item {
@@ -13,10 +13,32 @@ Item {
     // Enable/Disable dragging of regions shapes
     property var enableDrag: false
 
+    // Images with more pixels than this are shown in tiles
+    property real tiledThreshold: Infinity
+
+    // Size of the tiles, must match the one of the image provider
+    property int tileSize: 256
+
+    // Whether the current sample is shown with the tiled viewer
+    readonly property bool tiled: root.sample.imageSize.width * root.sample.imageSize.height > root.tiledThreshold
+
+    // The size requested to the image provider, only the pixels that are actually
+    // painted are decoded. Rounded up to a power of two, so that zooming does not
+    // trigger a new decoding at every step.
+    readonly property size requestedSize: Qt.size(
+        root.bucket(zoomable.contentWidth * Screen.devicePixelRatio),
+        root.bucket(zoomable.contentHeight * Screen.devicePixelRatio)
+    )
+
+    function bucket(value) {
+        return Math.pow(2, Math.ceil(Math.log2(Math.max(value, 1))))
+    }
+
     // Make the content zoomable / draggable
     Zoomable {
         id: zoomable
         anchors.fill: parent
+        visible: !root.tiled
         
         // Anything assing to "content" is zoomable / draggable
         content: Image {
@@ -25,69 +47,95 @@ Item {
             height: zoomable.height
             smooth: false
             antialiasing: false
-            source: root.sample.image
+            source: root.tiled ? "" : root.sample.image
+            sourceSize: root.requestedSize
             fillMode: Image.PreserveAspectFit
 
-            // Origin of the image RF
-            property var paintedX: (width - paintedWidth) / 2
-            property var paintedY: (height - paintedHeight) / 2
-
-            Shape {
-                id: viewShape
-                property var shape: root.sample.shape
-
-                // Transform: Image rf -> GUI rf
-                width: shape.w / image.sourceSize.width * image.paintedWidth
-                height: shape.h / image.sourceSize.height * image.paintedHeight
-                x: shape.x / image.sourceSize.width * image.paintedWidth + image.paintedX - width / 2
-                y: shape.y / image.sourceSize.height * image.paintedHeight + image.paintedY - height / 2
-                rotation: shape.angle * 180 / Math.PI
-                
-                // Make a rectangle using a ShapePath
-                // There is more than one way to do this. The one used here
-                // Allows to draw any shape (not only rectangles) with some 
-                // control over some details like fill/stroke styles. 
-                ShapePath {
-                    strokeWidth: 4
-                    strokeColor: "white"
-                    fillColor: "#4000206f"
-                    strokeStyle: ShapePath.DashLine
-                    dashPattern: [ 1, 3 ]
-                    startX: 0; startY: 0
-                    PathLine { x: 0; y: viewShape.height }
-                    PathLine { x: viewShape.width; y: viewShape.height }
-                    PathLine { x: viewShape.width; y: 0 }
-                    PathLine { x: 0; y: 0 }
-                }
+            // All the shapes of the layer, pre-rasterised into a single image
+            Image {
+                x: (image.width - image.paintedWidth) / 2
+                y: (image.height - image.paintedHeight) / 2
+                width: image.paintedWidth
+                height: image.paintedHeight
+                source: root.sample.shapeCount > 0 ? root.sample.shapesOverlay : ""
+                sourceSize: root.requestedSize
+                smooth: false
+
+                // Hit-testing through the spatial index of the sample
+                HoverHandler {
+                    id: hover
+                    enabled: root.sample.shapeCount > 0
 
-                // Make the shapes draggable
-                MouseArea {
-                    id: mouseArea
-                    anchors.fill: parent
-                    drag.target: parent
-                    enabled: root.enableDrag
+                    // The image pixel under the pointer, the index is only queried
+                    // when it changes
+                    readonly property real scale: image.paintedWidth > 0
+                        ? root.sample.imageSize.width / image.paintedWidth : 0
+                    property point pixel: Qt.point(
+                        Math.floor(hover.point.position.x * scale),
+                        Math.floor(hover.point.position.y * scale)
+                    )
+
+                    // The labels of the shapes of the layer under the pointer
+                    property var labels: {
+                        if (!hover.hovered || hover.scale <= 0)
+                            return []
+                        return root.sample.shapeIndex.at(
+                            hover.pixel.x, hover.pixel.y, 4 * hover.scale
+                        ).filter(i => i >= 0).map(i => {
+                            const shape = root.sample.shapes.get(i)
+                            return shape.label || shape.type
+                        })
+                    }
                 }
 
-                // Two-way binding for x, and y. This just a tutorial example,
-                // so I limited the GUI interation to the setting of x and y
-                // properties.
-                Binding {
-                    target: viewShape.shape
-                    property: "x"
-                    value: (viewShape.x - image.paintedX + viewShape.width / 2) / image.paintedWidth * image.sourceSize.width
-                    delayed: true
-                    when: image.paintedWidth > 0 && root.enableDrag
-                    restoreMode: Binding.RestoreNone
+                ToolTip.visible: hover.labels.length > 0
+                ToolTip.text: hover.labels.join(", ")
+            }
+
+            Loader {
+                x: (image.width - image.paintedWidth) / 2
+                y: (image.height - image.paintedHeight) / 2
+                width: image.paintedWidth
+                height: image.paintedHeight
+                active: !!root.sample.shape
+                sourceComponent: ShapeOverlay {
+                    shape: root.sample.shape
+                    imageSize: root.sample.imageSize
+                    enableDrag: root.enableDrag
                 }
-                Binding {
-                    target: viewShape.shape
-                    property: "y"
-                    value: (viewShape.y - image.paintedY + viewShape.height / 2) / image.paintedHeight * image.sourceSize.height
-                    delayed: true
-                    when: image.paintedHeight > 0 && root.enableDrag
-                    restoreMode: Binding.RestoreNone
+            }
+        }
+    }
+
+    // Very large images are loaded tile by tile, only where visible
+    Loader {
+        anchors.fill: parent
+        active: root.tiled
+        sourceComponent: TiledViewer {
+            source: root.sample.image
+            imageSize: root.sample.imageSize
+            tileSize: root.tileSize
+
+            Image {
+                anchors.fill: parent
+                source: root.sample.shapeCount > 0 ? root.sample.shapesOverlay : ""
+                // The tiled image can be huge, the overlay is capped in resolution
+                sourceSize: Qt.size(
+                    root.bucket(Math.min(width * Screen.devicePixelRatio, 4096)),
+                    root.bucket(Math.min(height * Screen.devicePixelRatio, 4096))
+                )
+                smooth: false
+            }
+
+            Loader {
+                anchors.fill: parent
+                active: !!root.sample.shape
+                sourceComponent: ShapeOverlay {
+                    shape: root.sample.shape
+                    imageSize: root.sample.imageSize
+                    enableDrag: root.enableDrag
                 }
             }
         }
     }
-}
\ No newline at end of file
+}
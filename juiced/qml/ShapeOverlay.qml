@@ -0,0 +1,83 @@
+import QtQuick
+import QtQuick.Shapes
+
+// Draws the shape of a sample over an image, the overlay must cover exactly the 
+// area where the image is painted.
+Item {
+    id: root
+
+    // The shape to draw, in full resolution image coordinates
+    property var shape
+
+    // The full resolution size of the image
+    property size imageSize
+
+    // Enable/Disable dragging of the shape
+    property var enableDrag: false
+
+    Shape {
+        id: viewShape
+        property var shape: root.shape
+
+        // Transform: Image rf -> GUI rf
+        width: shape.w / root.imageSize.width * root.width
+        height: shape.h / root.imageSize.height * root.height
+        x: shape.x / root.imageSize.width * root.width - width / 2
+        y: shape.y / root.imageSize.height * root.height - height / 2
+        rotation: shape.angle * 180 / Math.PI
+        
+        // Make a rectangle using a ShapePath
+        // There is more than one way to do this. The one used here
+        // Allows to draw any shape (not only rectangles) with some 
+        // control over some details like fill/stroke styles. 
+        ShapePath {
+            strokeWidth: 4
+            strokeColor: "white"
+            fillColor: "#4000206f"
+            strokeStyle: ShapePath.DashLine
+            dashPattern: [ 1, 3 ]
+            startX: 0; startY: 0
+            PathLine { x: 0; y: viewShape.height }
+            PathLine { x: viewShape.width; y: viewShape.height }
+            PathLine { x: viewShape.width; y: 0 }
+            PathLine { x: 0; y: 0 }
+        }
+
+        // Make the shapes draggable. The drag only moves the shape, never the item,
+        // whose position stays bound to it
+        MouseArea {
+            id: mouseArea
+            anchors.fill: parent
+            enabled: root.enableDrag
+
+            // Press position in overlay coordinates and the shape center then
+            property point pressPoint
+            property point pressCenter
+            // The last position, merged by Qt.callLater into a single update
+            property point dragPoint
+
+            onPressed: (mouse) => {
+                pressPoint = mapToItem(root, mouse.x, mouse.y)
+                dragPoint = pressPoint
+                pressCenter = Qt.point(root.shape.x, root.shape.y)
+            }
+            onPositionChanged: (mouse) => {
+                if (!pressed)
+                    return
+                dragPoint = mapToItem(root, mouse.x, mouse.y)
+                Qt.callLater(mouseArea.commitDrag)
+            }
+
+            // Push the dragged position to the shape, with all its fields at once
+            function commitDrag() {
+                root.shape.setGeometry(
+                    pressCenter.x + (dragPoint.x - pressPoint.x) / root.width * root.imageSize.width,
+                    pressCenter.y + (dragPoint.y - pressPoint.y) / root.height * root.imageSize.height,
+                    root.shape.w,
+                    root.shape.h,
+                    root.shape.angle
+                )
+            }
+        }
+    }
+}
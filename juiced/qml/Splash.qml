@@ -1,27 +1,47 @@
 import QtQuick
+import QtQuick.Controls
 import QtQuick.Window
 
 // Splash Screen shown when the App starts
 Window {
     id: splash
 
-    // Signal emitted when the splash timer times out
-    signal timeout
+    // Signal emitted when the splash is closed
+    signal done
 
-    // Splash duration in mulliseconds
-    property int timeoutInterval: 200
+    // Close the splash as soon as this becomes true
+    property bool ready: false
+
+    // Loading progress, between 0 and 1
+    property real progress: 0
+
+    // Estimated time to complete the loading, in seconds (negative if unknown)
+    property real eta: -1
 
     // Make splash screen modal
     visible: true 
     modality: Qt.ApplicationModal
     flags: Qt.SplashScreen
 
-    // Timer object that emits a single timeout signal after running once.
-    Timer {
-        interval: timeoutInterval; running: true; repeat: false
-        onTriggered: {
-            visible = false
-            splash.timeout()
+    function finish() {
+        visible = false
+        splash.done()
+    }
+
+    onReadyChanged: { if (ready) finish() }
+    Component.onCompleted: { if (ready) finish() }
+
+    // Loading progress on the bottom-left corner
+    Column {
+        x: 10
+        y: parent.height - 10 - height
+        z: 1
+        ProgressBar {
+            width: splash.width / 3
+            value: splash.progress
+        }
+        Text {
+            text: splash.eta < 0 ? "Loading..." : "Loading... " + Math.ceil(splash.eta) + "s left"
         }
     }
-}
\ No newline at end of file
+}
@@ -0,0 +1,20 @@
+import QtQuick
+
+// Splash shown by the "juiced" command as soon as Qt is loaded, while the rest of
+// the app is imported in background. It looks like the splash of the main window,
+// which replaces it seamlessly, but is not configurable: the configuration is not
+// loaded yet
+Splash {
+    id: startup
+
+    width: 700
+    height: 200
+    color: "#fafafa"
+
+    Image {
+        width: startup.width
+        height: startup.height
+        fillMode: Image.PreserveAspectFit
+        source: "../images/eyecan_logo_downscaled.png"
+    }
+}
@@ -0,0 +1,65 @@
+import QtQuick
+import QtQuick.Controls
+import QtQuick.Layouts
+
+// Live dashboard with the histogram of the labels of every criterion
+ListView {
+    id: root
+
+    // The label statistics model of a dataset
+    property var statistics
+
+    model: root.statistics
+    spacing: 10
+    clip: true
+    ScrollBar.vertical: ScrollBar { }
+
+    header: Text {
+        text: "Labeled samples: " + root.statistics.total
+        bottomPadding: 10
+    }
+
+    delegate: ColumnLayout {
+        id: criterion
+        width: ListView.view.width
+
+        // Roles of the criterion, the last bin counts values out of the domain
+        required property string name
+        required property var bins
+        required property var counts
+
+        // The largest count, used to scale the bars
+        property int maxCount: Math.max(1, Math.max.apply(null, criterion.counts))
+
+        Text {
+            text: criterion.name
+            font.bold: true
+        }
+
+        Repeater {
+            model: criterion.bins.length
+
+            delegate: RowLayout {
+                required property int index
+
+                Layout.fillWidth: true
+                // The "other" bin is shown only when some value falls in it
+                visible: index < criterion.bins.length - 1 || criterion.counts[index] > 0
+
+                Text {
+                    text: criterion.bins[index]
+                    Layout.preferredWidth: 80
+                    elide: Text.ElideRight
+                }
+                Rectangle {
+                    Layout.preferredHeight: 12
+                    Layout.preferredWidth: Math.max(1, (criterion.width - 160) * criterion.counts[index] / criterion.maxCount)
+                    color: config.colorPalette[index % config.colorPalette.length]
+                }
+                Text {
+                    text: criterion.counts[index]
+                }
+            }
+        }
+    }
+}
@@ -0,0 +1,128 @@
+import QtQuick
+import QtQuick.Window
+
+// Viewer for very large images, which are requested to the image provider in tiles
+// of a resolution pyramid: only the tiles that are visible at the current zoom level
+// are loaded. Can be zoomed with Ctrl+Wheel and dragged.
+Item {
+    id: root
+
+    // Clip stuff outside of bounds
+    clip: true
+
+    // Acquire the focus when the mouse area contains the mouse
+    focus: mouseArea.containsMouse
+
+    // The image url, without the tile suffix
+    property string source
+
+    // The full resolution size of the image
+    property size imageSize
+
+    // Size of the tiles, must match the one of the image provider
+    property int tileSize: 256
+
+    // Anything added as a child is placed over the image area, and zoomed with it
+    default property alias overlay: overlayItem.data
+
+    // Screen pixels per image pixel, initially the image fits the viewer
+    property real zoom: Math.min(
+        width / Math.max(imageSize.width, 1), height / Math.max(imageSize.height, 1)
+    )
+
+    // Position of the image origin in the viewer
+    property real originX: (width - imageSize.width * zoom) / 2
+    property real originY: (height - imageSize.height * zoom) / 2
+
+    // The coarsest level fits in a single tile, same as ImagePyramid.count_levels
+    readonly property int maxLevel: Math.max(0, Math.ceil(
+        Math.log2(Math.max(imageSize.width, imageSize.height) / tileSize)
+    ))
+
+    // The pyramid level with just enough resolution for the current zoom
+    readonly property int level: Math.max(0, Math.min(
+        maxLevel, Math.floor(Math.log2(1 / (zoom * Screen.devicePixelRatio)))
+    ))
+
+    // Size of a tile of the current level, in image pixels
+    readonly property real tileExtent: tileSize * Math.pow(2, level)
+
+    // Range of visible tiles
+    readonly property int firstColumn: Math.max(0, Math.floor(-originX / zoom / tileExtent))
+    readonly property int firstRow: Math.max(0, Math.floor(-originY / zoom / tileExtent))
+    readonly property int lastColumn: Math.min(
+        Math.ceil(imageSize.width / tileExtent) - 1,
+        Math.floor((width - originX) / zoom / tileExtent)
+    )
+    readonly property int lastRow: Math.min(
+        Math.ceil(imageSize.height / tileExtent) - 1,
+        Math.floor((height - originY) / zoom / tileExtent)
+    )
+    readonly property int columns: Math.max(0, lastColumn - firstColumn + 1)
+    readonly property int rows: Math.max(0, lastRow - firstRow + 1)
+
+    function tileUrl(level, column, row) {
+        return root.source + "/" + level + "/" + column + "/" + row
+    }
+
+    // The coarsest level is always shown below, while tiles are loading
+    Image {
+        x: root.originX
+        y: root.originY
+        width: root.imageSize.width * root.zoom
+        height: root.imageSize.height * root.zoom
+        source: root.source ? root.tileUrl(root.maxLevel, 0, 0) : ""
+        smooth: true
+    }
+
+    // Only the visible tiles are instantiated
+    Repeater {
+        model: root.source ? root.columns * root.rows : 0
+        Image {
+            readonly property int column: root.firstColumn + index % root.columns
+            readonly property int row: root.firstRow + Math.floor(index / root.columns)
+
+            x: root.originX + column * root.tileExtent * root.zoom
+            y: root.originY + row * root.tileExtent * root.zoom
+            width: Math.min(root.tileExtent, root.imageSize.width - column * root.tileExtent) * root.zoom
+            height: Math.min(root.tileExtent, root.imageSize.height - row * root.tileExtent) * root.zoom
+            source: root.tileUrl(root.level, column, row)
+            asynchronous: true
+            smooth: root.level > 0
+        }
+    }
+
+    Item {
+        id: overlayItem
+        x: root.originX
+        y: root.originY
+        width: root.imageSize.width * root.zoom
+        height: root.imageSize.height * root.zoom
+    }
+
+    // Mouse area that handles the zooming / dragging
+    MouseArea {
+        id: mouseArea
+        anchors.fill: parent
+        hoverEnabled: true
+
+        property point lastPosition
+
+        onPressed: (mouse)=>{ lastPosition = Qt.point(mouse.x, mouse.y) }
+        onPositionChanged: (mouse)=>{
+            if (pressed) {
+                root.originX += mouse.x - lastPosition.x
+                root.originY += mouse.y - lastPosition.y
+                lastPosition = Qt.point(mouse.x, mouse.y)
+            }
+        }
+        onWheel: (wheel)=>{
+            if(wheel.modifiers & Qt.ControlModifier) {
+                var speed = wheel.angleDelta.y > 0 ? 1.1 : 1 / 1.1
+                root.originX = mouseX + (root.originX - mouseX) * speed
+                root.originY = mouseY + (root.originY - mouseY) * speed
+                root.zoom = root.zoom * speed
+            }
+        }
+    }
+}
@@ -15,6 +15,10 @@ Item {
     // Assign anything to this property to make it zoomable/draggable
     property alias content: loader.sourceComponent
 
+    // The current size of the zoomed content
+    readonly property alias contentWidth: loader.width
+    readonly property alias contentHeight: loader.height
+
     // Mouse area that handles the zooming / dragging
     MouseArea{
         id: mouseArea
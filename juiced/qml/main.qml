@@ -22,9 +22,13 @@ Window {
         // Pick some properties from the configuration
         width: config.splashWindow.width
         height: config.splashWindow.height
-        timeoutInterval: config.splashWindow.timeMillis
         color: config.splashWindow.color
 
+        // Close as soon as the first sample is ready
+        ready: scene.dataset.ready
+        progress: scene.dataset.progress
+        eta: scene.dataset.eta
+
         // Add an image with a text displaying the pipelime version 
         // On the bottom-right corner
         Image {
@@ -43,25 +47,69 @@ Window {
         }
 
         // Close the splash and make the real window visislbe
-        onTimeout: {
+        onDone: {
             appWindow.visible = true
             close()
         }
     }
 
     // Property containing the selected sample index
-    // Can be browsed with:
+    // Can be browsed, through the samples matching the filter, with:
     // - A: previous
     // - D: next
     property var selected: 0
 
+    // Prefetch the samples that follow the selected one in the direction of travel
+    onSelectedChanged: { prefetcher.navigate(appWindow.selected) }
+    Component.onCompleted: { prefetcher.navigate(appWindow.selected) }
+    Binding {
+        target: prefetcher
+        property: "requestedSize"
+        value: viewer.requestedSize
+    }
+
+    // The selected sample is bound by the views, it is never released by the model
+    Binding {
+        target: scene.dataset.samples
+        property: "pinned"
+        value: appWindow.selected
+    }
+
     // Window content
     ColumnLayout {
         anchors.fill: parent
         RowLayout {
             Layout.fillWidth: true
+            // Datasets are opened when they are first selected
+            ComboBox {
+                visible: scene.names.length > 1
+                model: scene.names
+                currentIndex: scene.current
+                onActivated: (index) => {
+                    appWindow.withNoBindings(() => {
+                        appWindow.selected = 0
+                        scene.current = index
+                    })
+                }
+            }
+            Text {
+                text: 'Sample ' + (appWindow.selected + 1) + " / " + scene.dataset.samples.count
+            }
+            ProgressBar {
+                visible: scene.dataset.progress < 1
+                value: scene.dataset.progress
+            }
+
+            // Only samples matching the query are browsed, e.g. "anomalous == true"
+            TextField {
+                id: query
+                Layout.fillWidth: true
+                placeholderText: qsTr("Filter, e.g. anomalous == true and color == blue")
+                onEditingFinished: { scene.dataset.filter.query = query.text }
+            }
             Text {
-                text: 'Sample ' + (appWindow.selected + 1) + " / " + scene.dataset.samples.length
+                text: scene.dataset.filter.error || (scene.dataset.filter.count + " matching")
+                color: scene.dataset.filter.error ? config.eyecanColor : "black"
             }
         }
         RowLayout {
@@ -71,20 +119,50 @@ Window {
                 id: viewer
                 Layout.fillHeight: true
                 Layout.preferredWidth: (appWindow.height + appWindow.width) / 2
-                sample: scene.dataset.samples[appWindow.selected]
+                sample: scene.dataset.samples.get(appWindow.selected)
                 enableDrag: true
+                tiledThreshold: config.viewer.tiledThreshold
+                tileSize: config.imageProvider.tileSize
             }
             LabelingView {
                 id: labeling
                 Layout.fillWidth: true
                 Layout.fillHeight: true
-                sample: scene.dataset.samples[appWindow.selected]
+                sample: scene.dataset.samples.get(appWindow.selected)
                 criteria: scene.dataset.criteria
                 enableEdit: true
             }
+            StatisticsView {
+                Layout.preferredWidth: 280
+                Layout.fillHeight: true
+                statistics: scene.dataset.statistics
+            }
+        }
+        Filmstrip {
+            Layout.fillWidth: true
+            Layout.preferredHeight: config.thumbnails.size + 16
+            dataset: scene.dataset
+            thumbnailSize: config.thumbnails.size
+            selected: appWindow.selected
+            onClicked: (index)=>{ appWindow.withNoBindings(() => { appWindow.selected = index }) }
         }
     }
     
+    // Timers and counters of the hot paths, toggled with a shortcut. Showing the
+    // overlay turns the instrumentation on
+    PerformanceOverlay {
+        id: performance
+        anchors.top: parent.top
+        anchors.right: parent.right
+        anchors.margins: 10
+        visible: false
+        onVisibleChanged: {
+            if (visible) {
+                instrumentation.enabled = true
+            }
+        }
+    }
+
     // Decorator that temporarely disables two-way bindings to avoid side-effects
     function withNoBindings(fn) {
         var prevEnableDrag = viewer.enableDrag
@@ -101,18 +179,34 @@ Window {
 
     function decrement() {
         function _decrement() {
-            appWindow.selected = appWindow.selected > 0 ? (appWindow.selected - 1) : scene.dataset.samples.length - 1
+            var previous = scene.dataset.filter.previous(appWindow.selected)
+            if (previous >= 0) {
+                appWindow.selected = previous
+            }
         }
         appWindow.withNoBindings(_decrement)
     }
 
     function increment() {
         function _increment() {
-            appWindow.selected = (appWindow.selected + 1) % scene.dataset.samples.length
+            var next = scene.dataset.filter.next(appWindow.selected)
+            if (next >= 0) {
+                appWindow.selected = next
+            }
         }
         appWindow.withNoBindings(_increment)
     }
 
+    // Undo/redo an edit, then show the edited sample
+    function history(fn) {
+        appWindow.withNoBindings(() => {
+            var index = fn()
+            if (index >= 0) {
+                appWindow.selected = index
+            }
+        })
+    }
+
     // Global keyboard shortcuts
     Shortcut {
         sequence: "A"
@@ -122,6 +216,18 @@ Window {
         sequence: "D"
         onActivated: { appWindow.increment() }
     }
+    Shortcut {
+        sequence: StandardKey.Undo
+        onActivated: { appWindow.history(() => scene.undo()) }
+    }
+    Shortcut {
+        sequences: [StandardKey.Redo, "Ctrl+Shift+Z"]
+        onActivated: { appWindow.history(() => scene.redo()) }
+    }
+    Shortcut {
+        sequence: config.instrumentation.shortcut
+        onActivated: { performance.visible = !performance.visible }
+    }
     Shortcut {
         sequence: "Q"
         onActivated: { appWindow.close() }
@@ -0,0 +1,578 @@
+from __future__ import annotations
+
+import operator
+import re
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
+
+import numpy as np
+import yaml
+from PySide6.QtCore import (
+    Property,
+    QAbstractListModel,
+    QByteArray,
+    QModelIndex,
+    QObject,
+    Qt,
+    QTimer,
+    Signal,
+    Slot,
+)
+
+from juiced.labels import LabelStore
+from juiced.statistics import Histogram
+
+Mask = np.ndarray
+
+_OPERATORS: Dict[str, Callable[[Any, Any], Any]] = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+_DEFAULT = object()
+_TOKENS = re.compile(
+    r"""\s*(?:(?P<paren>[()])|(?P<op>==|!=|<=|>=|<|>)"""
+    r"""|(?P<word>\[[^\]]*\]|"[^"]*"|'[^']*'|[^\s()<>=!]+))"""
+)
+
+
+def _safe(fn: Callable[..., Any], *args: Any) -> bool:
+    # Values of different types never match, instead of raising
+    try:
+        return bool(fn(*args))
+    except (TypeError, ValueError):
+        return False
+
+
+class LabelIndex:
+    """Inverted index of the labels of a dataset.
+
+    Every value of the "choice", "bool" and "int" criteria with at most
+    `max_values` values has a bitmap of the samples with that label, packed 8
+    samples per byte, so that 64 values of 1M samples take 8 MB. Equality lookups
+    unpack a single bitmap and are combined with vectorised boolean operations.
+    Bitmaps are updated in O(1) on every edit with `update`, and filled for newly
+    loaded samples with `add`. Other criteria and ordering comparisons are answered
+    with vectorised comparisons on the columns of the `LabelStore`.
+    """
+
+    def __init__(self, store: LabelStore, max_values: int = 64) -> None:
+        self._store = store
+        self._loaded = np.zeros(len(store), dtype=bool)
+        self._histograms: Dict[str, Histogram] = {}
+        self._bitmaps: Dict[str, np.ndarray] = {}
+        for name in store.names:
+            criterion = store.criterion(name)
+            if criterion.type not in ("choice", "bool", "int"):
+                continue
+            histogram = Histogram(criterion)
+            if len(histogram.labels) <= max_values + 1:
+                self._histograms[name] = histogram
+                self._bitmaps[name] = np.zeros(
+                    (len(histogram.labels), (len(store) + 7) // 8), dtype=np.uint8
+                )
+
+    @property
+    def loaded(self) -> Mask:
+        """The samples whose labels are loaded"""
+        return self._loaded
+
+    def add(self, start: int, stop: int) -> None:
+        """Index the labels of the samples from `start` to `stop`, once loaded"""
+        # The bytes covering the range are unpacked, rewritten and packed again
+        lo, hi = start // 8, (stop + 7) // 8
+        offset = lo * 8
+        for name, histogram in self._histograms.items():
+            bitmaps = self._bitmaps[name]
+            bins = histogram.bins(self._store, name, start, stop)
+            block = np.unpackbits(bitmaps[:, lo:hi], axis=1)
+            block[:, start - offset : stop - offset] = 0
+            block[bins, np.arange(start, stop) - offset] = 1
+            bitmaps[:, lo:hi] = np.packbits(block, axis=1)
+        self._loaded[start:stop] = True
+
+    def update(self, idx: int, name: str, old: Any, new: Any) -> None:
+        """Move an edited sample from the bitmap of its old value to the new one"""
+        histogram = self._histograms.get(name)
+        if histogram is not None and self._loaded[idx]:
+            bitmaps = self._bitmaps[name]
+            byte, bit = idx >> 3, 0x80 >> (idx & 7)
+            bitmaps[histogram.bin(old), byte] &= ~np.uint8(bit)
+            bitmaps[histogram.bin(new), byte] |= np.uint8(bit)
+
+    def match(self, name: str, op: str, value: Any) -> Mask:
+        """The samples whose label `name` satisfies `label <op> value`"""
+        if op == "in":
+            mask = np.zeros(len(self._store), dtype=bool)
+            for v in value if isinstance(value, list) else [value]:
+                mask |= self.match(name, "==", v)
+            return mask
+        if op in ("==", "!="):
+            mask = self._equals(name, value)
+            return mask if op == "==" else ~mask
+        if self._store.criterion(name).type in ("choice", "bool"):
+            raise ValueError(f"Criterion {name} only supports ==, != and in")
+        return self._compare(name, op, value)
+
+    def _equals(self, name: str, value: Any) -> Mask:
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            return self._compare(name, "==", value)
+        index = histogram.bin(value)
+        bitmap = self._bitmaps[name][index]
+        mask = np.unpackbits(bitmap, count=len(self._store)).astype(bool)
+        if index == histogram.other:
+            # Values outside the domain share a bitmap, they are compared one by one
+            for idx in np.flatnonzero(mask):
+                mask[idx] = _safe(operator.eq, self._store.get(idx, name), value)
+        return mask
+
+    def _compare(self, name: str, op: str, value: Any) -> Mask:
+        fn = _OPERATORS[op]
+        criterion = self._store.criterion(name)
+        column = self._store.column(name)
+        if criterion.type in ("int", "range"):
+            numeric = isinstance(value, (int, float)) and not isinstance(value, bool)
+            encoded = value if numeric else None
+        else:
+            encoded = self._store.encode(name, value)
+        if column is not None and encoded is not None:
+            mask = fn(column, encoded)
+        else:
+            mask = np.full(len(self._store), op == "!=", dtype=bool)
+
+        # Overflow entries of the column are meaningless, their value is compared
+        for idx, v in self._store.overflow(name).items():
+            mask[idx] = _safe(fn, v, value)
+        return mask
+
+
+class MetadataIndex:
+    """Columns of the scalar values in the metadata of the samples, by key path.
+
+    Values are captured from the metadata of the samples while it is in memory, when
+    it is loaded with `add` and when it is edited with `update`, so that queries
+    never read it again. Like in a `LabelStore`, every key path has a column with
+    one entry per sample: numbers and bools in a float64 column, NaN where missing,
+    and strings as codes in an int32 column, -1 where missing. Comparisons are
+    vectorised on the columns, strings are compared once per distinct value.
+
+    Values inside lists and other values (null, dates, ...) are not indexed, and at
+    most `max_paths` key paths are indexed, the first ones found.
+    """
+
+    def __init__(self, length: int, max_paths: int = 256) -> None:
+        self._length = length
+        self._max_paths = max_paths
+        self._numbers: Dict[str, np.ndarray] = {}
+        self._codes: Dict[str, np.ndarray] = {}
+        self._strings: Dict[str, List[str]] = {}
+        self._lookup: Dict[str, Dict[str, int]] = {}
+        self._paths: Set[str] = set()
+
+    @property
+    def paths(self) -> Set[str]:
+        """The indexed key paths"""
+        return self._paths
+
+    @property
+    def nbytes(self) -> int:
+        columns = [*self._numbers.values(), *self._codes.values()]
+        return sum(c.nbytes for c in columns)
+
+    def add(self, start: int, batch: Sequence[Optional[Mapping[str, Any]]]) -> None:
+        """Index the metadata of the consecutive samples starting at `start`"""
+        stop = start + len(batch)
+        for column in self._numbers.values():
+            column[start:stop] = np.nan
+        for column in self._codes.values():
+            column[start:stop] = -1
+
+        # Values are gathered by key path, then every column is set at once
+        values: Dict[str, Tuple[List[int], List[Any]]] = {}
+        for idx, metadata in enumerate(batch, start=start):
+            if metadata is None:
+                continue
+            for path, value in _leaves(metadata, ""):
+                ids, vs = values.setdefault(path, ([], []))
+                ids.append(idx)
+                vs.append(value)
+        for path, (ids, vs) in values.items():
+            self._set(path, np.array(ids, dtype=np.int64), vs)
+
+    def update(self, idx: int, key: str, metadata: Mapping[str, Any]) -> None:
+        """Index again the values of a sample under `key`, after an edit"""
+        for path in self._paths:
+            if path == key or path.startswith(f"{key}.") or key.startswith(f"{path}."):
+                if path in self._numbers:
+                    self._numbers[path][idx] = np.nan
+                if path in self._codes:
+                    self._codes[path][idx] = -1
+        # Values inside lists are not indexed
+        value: Any = metadata
+        for part in key.split("."):
+            if not isinstance(value, Mapping):
+                return
+            value = value.get(part)
+        ids = np.array([idx], dtype=np.int64)
+        for path, leaf in _leaves(value, key):
+            self._set(path, ids, [leaf])
+
+    def match(self, path: str, op: str, value: Any) -> Mask:
+        """The samples whose value at `path` satisfies `value_at_path <op> value`.
+
+        Raises:
+            ValueError: If the key path is not indexed.
+        """
+        if path not in self._paths:
+            raise ValueError(f"{path} is neither a criterion nor an indexed field")
+        if op == "in":
+            mask = np.zeros(self._length, dtype=bool)
+            for v in value if isinstance(value, list) else [value]:
+                mask |= self.match(path, "==", v)
+            return mask
+        if op == "!=":
+            return ~self.match(path, "==", value)
+
+        fn = _OPERATORS[op]
+        mask = np.zeros(self._length, dtype=bool)
+        if value is None:
+            # Null matches the samples without a value
+            if op == "==":
+                mask[:] = True
+                numbers, codes = self._numbers.get(path), self._codes.get(path)
+                if numbers is not None:
+                    mask &= np.isnan(numbers)
+                if codes is not None:
+                    mask &= codes < 0
+            return mask
+
+        numbers = self._numbers.get(path)
+        if numbers is not None and isinstance(value, (bool, int, float)):
+            with np.errstate(invalid="ignore"):
+                mask |= fn(numbers, float(value))
+        codes = self._codes.get(path)
+        if codes is not None and isinstance(value, str):
+            # One comparison per distinct string, then a lookup of the codes
+            table = [_safe(fn, s, value) for s in self._strings[path]] + [False]
+            mask |= np.array(table, dtype=bool)[codes]
+        return mask
+
+    def _set(self, path: str, ids: np.ndarray, values: List[Any]) -> None:
+        if path not in self._paths:
+            if len(self._paths) >= self._max_paths:
+                return
+            self._paths.add(path)
+
+        kinds = np.array([isinstance(v, str) for v in values], dtype=bool)
+        if not kinds.all():
+            column = self._numbers.get(path)
+            if column is None:
+                column = self._numbers[path] = np.full(self._length, np.nan)
+            column[ids[~kinds]] = [float(v) for v, s in zip(values, kinds) if not s]
+        if kinds.any():
+            column = self._codes.get(path)
+            if column is None:
+                column = self._codes[path] = np.full(self._length, -1, np.int32)
+                self._strings[path], self._lookup[path] = [], {}
+            strings, lookup = self._strings[path], self._lookup[path]
+            codes = []
+            for v, s in zip(values, kinds):
+                if s:
+                    code = lookup.get(v)
+                    if code is None:
+                        code = lookup[v] = len(strings)
+                        strings.append(v)
+                    codes.append(code)
+            column[ids[kinds]] = codes
+
+
+def _leaves(value: Any, path: str) -> Iterator[Tuple[str, Any]]:
+    # The key paths and the values of the indexable leaves of a metadata tree
+    if isinstance(value, Mapping):
+        for k, v in value.items():
+            yield from _leaves(v, f"{path}.{k}" if path else str(k))
+    elif isinstance(value, (bool, int, float, str)) and path:
+        yield path, value
+
+
+class QueryEngine:
+    """Answers queries over the labels and the metadata of the samples of a dataset.
+
+    A query is made of predicates like `field <op> value`, combined with `and`,
+    `or`, `not` and parentheses, e.g.::
+
+        anomalous == true and (color == blue or color == green)
+        color in [blue, green] and digit >= 3
+        position == default
+        shape.type == box
+
+    Fields are criteria names or key paths inside the metadata of the samples, ops
+    are `==`, `!=`, `<`, `<=`, `>`, `>=` and `in`, values are parsed as yaml, and
+    the keyword `default` stands for the default of a criterion. Criteria are
+    answered from a `LabelIndex`, key paths from a `MetadataIndex`, both updated as
+    samples are loaded and edited.
+    """
+
+    def __init__(self, store: LabelStore) -> None:
+        self._store = store
+        self._names = set(store.names)
+        self._index = LabelIndex(store)
+        self._metadata = MetadataIndex(len(store))
+
+    @property
+    def index(self) -> LabelIndex:
+        return self._index
+
+    @property
+    def metadata(self) -> MetadataIndex:
+        return self._metadata
+
+    def add(self, start: int, batch: Sequence[Optional[Mapping[str, Any]]]) -> None:
+        """Index the consecutive samples starting at `start`, once loaded.
+
+        Labels are read from the label store, all the other fields from `batch`.
+        """
+        self._index.add(start, start + len(batch))
+        self._metadata.add(start, batch)
+
+    def update_label(self, idx: int, name: str, old: Any, new: Any) -> None:
+        self._index.update(idx, name, old, new)
+
+    def update_metadata(self, idx: int, key: str, metadata: Mapping[str, Any]) -> None:
+        """Update the indexed values of a sample affected by an edit of `key`"""
+        self._metadata.update(idx, key, metadata)
+
+    def evaluate(self, query: str) -> np.ndarray:
+        """The sorted indices of the loaded samples matching a query.
+
+        Raises:
+            ValueError: If the query is not valid.
+        """
+        node = _Parser(query).parse()
+        mask = node(self) if node is not None else np.ones_like(self._index.loaded)
+        return np.flatnonzero(mask & self._index.loaded)
+
+    def match(self, field: str, op: str, value: Any) -> Mask:
+        if field in self._names:
+            if value is _DEFAULT:
+                value = self._store.criterion(field).default
+            return self._index.match(field, op, value)
+        if value is _DEFAULT:
+            raise ValueError(f"{field} is not a criterion, it has no default")
+        return self._metadata.match(field, op, value)
+
+
+Node = Callable[[QueryEngine], Mask]
+
+
+class _Parser:
+    # Recursive descent parser of the queries, producing a function of the engine
+
+    def __init__(self, query: str) -> None:
+        self._tokens: List[Tuple[str, str]] = []
+        pos = 0
+        query = query.strip()
+        while pos < len(query):
+            match = _TOKENS.match(query, pos)
+            if match is None or match.end() == pos:
+                raise ValueError(f"Invalid query at: {query[pos:]}")
+            self._tokens.append((match.lastgroup, match.group(match.lastgroup)))
+            pos = match.end()
+        self._pos = 0
+
+    def parse(self) -> Optional[Node]:
+        if not self._tokens:
+            return None
+        node = self._or()
+        if self._pos < len(self._tokens):
+            raise ValueError(f"Unexpected {self._tokens[self._pos][1]}")
+        return node
+
+    def _peek(self) -> Tuple[str, str]:
+        if self._pos < len(self._tokens):
+            return self._tokens[self._pos]
+        return ("end", "")
+
+    def _next(self, kind: Optional[str] = None) -> str:
+        token_kind, text = self._peek()
+        if token_kind == "end" or (kind is not None and token_kind != kind):
+            raise ValueError(f"Unexpected {text or 'end of query'}")
+        self._pos += 1
+        return text
+
+    def _keyword(self, word: str) -> bool:
+        if self._peek() == ("word", word):
+            self._pos += 1
+            return True
+        return False
+
+    def _or(self) -> Node:
+        node = self._and()
+        while self._keyword("or"):
+            left, right = node, self._and()
+            node = lambda e, left=left, right=right: left(e) | right(e)  # noqa: E731
+        return node
+
+    def _and(self) -> Node:
+        node = self._not()
+        while self._keyword("and"):
+            left, right = node, self._not()
+            node = lambda e, left=left, right=right: left(e) & right(e)  # noqa: E731
+        return node
+
+    def _not(self) -> Node:
+        if self._keyword("not"):
+            inner = self._not()
+            return lambda e: ~inner(e)
+        if self._peek() == ("paren", "("):
+            self._next()
+            node = self._or()
+            if self._next("paren") != ")":
+                raise ValueError("Missing )")
+            return node
+        return self._predicate()
+
+    def _predicate(self) -> Node:
+        field = self._next("word")
+        op = "in" if self._keyword("in") else self._next("op")
+        text = self._next("word")
+        value = _DEFAULT if text == "default" else yaml.safe_load(text)
+        return lambda e: e.match(field, op, value)
+
+
+class SampleFilter(QAbstractListModel):
+    """A model of the samples of a dataset matching a query.
+
+    Rows are the sorted indices of the matching samples, recomputed with
+    vectorised operations by a `QueryEngine` when `query` changes, and at most every
+    `interval_ms` milliseconds after `invalidate` is called (e.g. when labels
+    change). Use `next` and `previous` to navigate the matching samples by their
+    index in the dataset. An empty query matches all samples.
+    """
+
+    queryChanged = Signal()
+    errorChanged = Signal()
+    countChanged = Signal()
+
+    def __init__(
+        self,
+        engine: QueryEngine,
+        samples: QAbstractListModel,
+        interval_ms: int = 100,
+        parent: Optional[QObject] = None,
+    ) -> None:
+        super().__init__(parent)
+        self._engine = engine
+        self._samples = samples
+        self._query = ""
+        self._error = ""
+        self._ids = np.arange(len(samples))
+
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(interval_ms)
+        self._timer.timeout.connect(self.refilter)
+
+    def roleNames(self) -> Dict[int, QByteArray]:
+        return self._samples.roleNames()
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self._ids)
+
+    def data(self, index: QModelIndex, role: int = Qt.DisplayRole) -> Any:
+        if not index.isValid() or not 0 <= index.row() < len(self._ids):
+            return None
+        sample = self._samples.get(int(self._ids[index.row()]))
+        if role == self._samples.SampleRole:
+            return sample
+        elif role == self._samples.ImageRole:
+            return sample.image
+        elif role == self._samples.LabelsRole:
+            return sample.labels
+        return None
+
+    @Property(str, notify=queryChanged)
+    def query(self) -> str:
+        return self._query
+
+    @query.setter
+    def query(self, value: str) -> None:
+        if value != self._query:
+            self._query = value
+            self.queryChanged.emit()
+            self.refilter()
+
+    @Property(str, notify=errorChanged)
+    def error(self) -> str:
+        """Why the query is not valid, empty if it is"""
+        return self._error
+
+    @Property(int, notify=countChanged)
+    def count(self) -> int:
+        return len(self._ids)
+
+    def invalidate(self) -> None:
+        """Schedule the query to be evaluated again"""
+        if self._query and not self._timer.isActive():
+            self._timer.start()
+
+    @Slot()
+    def refilter(self) -> None:
+        self._timer.stop()
+        try:
+            ids = (
+                self._engine.evaluate(self._query)
+                if self._query
+                else np.arange(len(self._samples))
+            )
+            error = ""
+        except (ValueError, yaml.YAMLError) as e:
+            ids, error = self._ids, str(e)
+        if error != self._error:
+            self._error = error
+            self.errorChanged.emit()
+        if not np.array_equal(ids, self._ids):
+            self.beginResetModel()
+            self._ids = ids
+            self.endResetModel()
+            self.countChanged.emit()
+
+    @Slot(int, result=int)
+    def sourceIndex(self, row: int) -> int:
+        """The index in the dataset of a row"""
+        return int(self._ids[row])
+
+    @Slot(int, result=bool)
+    def contains(self, idx: int) -> bool:
+        pos = np.searchsorted(self._ids, idx)
+        return bool(pos < len(self._ids) and self._ids[pos] == idx)
+
+    @Slot(int, result=int)
+    def next(self, idx: int) -> int:
+        """The first matching sample after `idx`, wrapping around, -1 if none"""
+        if len(self._ids) == 0:
+            return -1
+        pos = np.searchsorted(self._ids, idx, side="right")
+        return int(self._ids[pos % len(self._ids)])
+
+    @Slot(int, result=int)
+    def previous(self, idx: int) -> int:
+        """The last matching sample before `idx`, wrapping around, -1 if none"""
+        if len(self._ids) == 0:
+            return -1
+        pos = np.searchsorted(self._ids, idx, side="left") - 1
+        return int(self._ids[pos])
@@ -1,22 +1,76 @@
 from __future__ import annotations
 
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from copy import deepcopy
 from math import pi
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from threading import Lock
+from traceback import print_exc
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
 
+import numpy as np
 import pipelime
-import pipelime.sequences.samples as plsamples
 import pydash as py_
 from pipelime.sequences.streams.underfolder import UnderfolderStream
-from PySide6.QtCore import Property, QObject, Signal, Slot
+from PySide6.QtCore import (
+    Property,
+    QAbstractListModel,
+    QByteArray,
+    QModelIndex,
+    QObject,
+    QSize,
+    Qt,
+    Signal,
+    Slot,
+)
 
-from image_provider import PipelimeImageProvider
+from juiced.archive import DICT_SUFFIXES, ArchiveStream, decode, encode, is_archive
+from juiced.cache import LRUCache, deep_sizeof
 from juiced.criterion import Criterion, CriterionProxy
+from juiced.image_provider import PipelimeImageProvider
+from juiced.instrumentation import Instrumentation
+from juiced.journal import EditJournal
+from juiced.labels import LabelStore
+from juiced.loading import MetadataLoader
 from juiced.naming import Naming
+from juiced.persistence import WriteBehind, replace_file
+from juiced.query import QueryEngine, SampleFilter
+from juiced.shapes import ShapeLayer, ShapeListModel
+from juiced.spatial import ShapeIndex, box_outline
+from juiced.statistics import LabelStatistics
 
 
 class OrientedBBox(QObject):
-    """A generic shape that can be moved/resized/rotated on a 2D plane"""
+    """A generic shape that can be moved/resized/rotated on a 2D plane.
+
+    Every setter notifies its own change, `dataChanged` and `edited`. Changes of
+    several fields can be applied atomically with `setGeometry` or in a `batch`::
+
+        with bbox.batch():
+            bbox.x, bbox.y, bbox.angle = 10.0, 20.0, 0.5
+
+    which notifies only the fields that really changed, then `dataChanged` and
+    `edited` once, with the key "" and the old and new geometry as dicts. Changes
+    made from outside, e.g. by an undo, are applied with `restore`, which notifies
+    them the same way but does not emit `edited`.
+    """
+
+    GEOMETRY = ("x", "y", "w", "h", "angle")
 
     xChanged = Signal()
     yChanged = Signal()
@@ -25,10 +79,71 @@ class OrientedBBox(QObject):
     angleChanged = Signal()
 
     dataChanged = Signal()
+    edited = Signal(str, object, object)
 
     def __init__(self, shape: Dict[str, Any], parent: Optional[QObject] = None) -> None:
         super().__init__(parent)
         self._shape = shape
+        # The old values of the fields changed in the current batch, if any
+        self._batch: Optional[Dict[str, float]] = None
+
+    def _set(self, key: str, value: float, signal: Signal) -> None:
+        old = self._shape[key]
+        if value == old:
+            return
+        self._shape[key] = value
+        if self._batch is not None:
+            self._batch.setdefault(key, old)
+            return
+        signal.emit()
+        self.dataChanged.emit()
+        self.edited.emit(key, old, value)
+
+    @contextmanager
+    def batch(self, edited: bool = True) -> Iterator[OrientedBBox]:
+        """Notify all the changes made inside the block at once, when it ends"""
+        if self._batch is not None:
+            yield self
+            return
+        self._batch = {}
+        try:
+            yield self
+        finally:
+            old, self._batch = self._batch, None
+            self._notify(old, edited)
+
+    def _notify(self, old: Dict[str, float], edited: bool = True) -> None:
+        changed = [k for k in self.GEOMETRY if k in old and old[k] != self._shape[k]]
+        if not changed:
+            return
+        for key in changed:
+            getattr(self, f"{key}Changed").emit()
+        self.dataChanged.emit()
+        if not edited:
+            return
+        if len(changed) == 1:
+            key = changed[0]
+            self.edited.emit(key, old[key], self._shape[key])
+        else:
+            new = {k: self._shape[k] for k in self.GEOMETRY}
+            self.edited.emit("", {**new, **old}, new)
+
+    def outline(self) -> np.ndarray:
+        """The four corners of the box"""
+        return box_outline(*(self._shape[k] for k in self.GEOMETRY))
+
+    @Slot(float, float, float, float, float)
+    def setGeometry(self, x: float, y: float, w: float, h: float, angle: float) -> None:
+        """Set all the fields at once, with a single change notification"""
+        with self.batch():
+            self.x, self.y, self.w, self.h, self.angle = x, y, w, h, angle
+
+    def restore(self, values: Mapping[str, float]) -> None:
+        """Set fields changed from outside, e.g. by an undo, not emitting `edited`"""
+        with self.batch(edited=False):
+            for key in self.GEOMETRY:
+                if key in values:
+                    setattr(self, key, values[key])
 
     @Property(float, notify=xChanged)
     def x(self) -> float:
@@ -36,10 +151,7 @@ class OrientedBBox(QObject):
 
     @x.setter
     def x(self, value: float) -> None:
-        if value != self.x:
-            self._shape["x"] = value
-            self.xChanged.emit()
-            self.dataChanged.emit()
+        self._set("x", value, self.xChanged)
 
     @Property(float, notify=yChanged)
     def y(self) -> float:
@@ -47,10 +159,7 @@ class OrientedBBox(QObject):
 
     @y.setter
     def y(self, value: float) -> None:
-        if value != self.y:
-            self._shape["y"] = value
-            self.yChanged.emit()
-            self.dataChanged.emit()
+        self._set("y", value, self.yChanged)
 
     @Property(float, notify=wChanged)
     def w(self) -> float:
@@ -58,10 +167,7 @@ class OrientedBBox(QObject):
 
     @w.setter
     def w(self, value: float) -> None:
-        if value != self.w:
-            self._shape["w"] = value
-            self.wChanged.emit()
-            self.dataChanged.emit()
+        self._set("w", value, self.wChanged)
 
     @Property(float, notify=hChanged)
     def h(self) -> float:
@@ -69,10 +175,7 @@ class OrientedBBox(QObject):
 
     @h.setter
     def h(self, value: float) -> None:
-        if value != self.h:
-            self._shape["h"] = value
-            self.hChanged.emit()
-            self.dataChanged.emit()
+        self._set("h", value, self.hChanged)
 
     @Property(float, notify=angleChanged)
     def angle(self) -> float:
@@ -80,131 +183,936 @@ class OrientedBBox(QObject):
 
     @angle.setter
     def angle(self, value: float) -> None:
-        if value != self.angle:
-            self._shape["angle"] = value
-            self.angleChanged.emit()
-            self.dataChanged.emit()
+        self._set("angle", value, self.angleChanged)
 
 
 class Sample(QObject):
-    """A sample with an image, a region and labels"""
+    """A sample with an image, a region, labels and a layer of shapes.
+
+    The region is an editable `OrientedBBox`, None if the sample has no box. The
+    shapes of the layer are exposed as a `ShapeListModel`, and drawn all at once by
+    the `ShapeImageProvider` at the `shapesOverlay` url. When the layer changes,
+    `onLayerChanged` replaces them and the url changes.
+    """
 
-    itemChanged = Signal(int, str, str)
+    edited = Signal(int, str, str, object, object)
     labelsChanged = Signal()
+    shapesChanged = Signal()
+    imageSizeChanged = Signal()
+    _imageSizeRead = Signal(int, int)
 
-    def __init__(self, sample: plsamples.Sample, parent: Dataset) -> None:
+    def __init__(self, idx: int, sample: Mapping[str, Any], parent: Dataset) -> None:
         super().__init__(parent)
         dname = parent.name
         naming = parent.naming
         self._naming = naming
 
-        self._idx = sample.id
-        self._image = f"image://pipelime/{dname}/{sample.id}/{naming.image}"
-        self._labels = py_.get(sample, naming.labels)
+        self._idx = idx
+        self._image_id = f"{dname}/{idx}/{naming.image}"
+        self._image = f"image://pipelime/{self._image_id}"
+        self._image_size: Optional[QSize] = None
+        self._image_size_requested = False
+        self._imageSizeRead.connect(self.onImageSizeRead)
+        self._labels = parent.label_store
+        self._labels_item, self._labels_path = naming.labels.split(".", maxsplit=1)
+        self._shape_item, self._shape_path = naming.shape.split(".", maxsplit=1)
 
+        self._dataset = parent
+        self._shapes: Optional[ShapeListModel] = None
+        self._shape_index: Optional[ShapeIndex] = None
+        self._shapes_overlay = f"image://shapes/{dname}/{idx}"
+        self._layer_version = 0
+
+        # Any other shape is part of the layer
         shape = py_.get(sample, naming.shape)
-        if shape["type"] == "box":
+        self._shape = None
+        if isinstance(shape, dict) and shape.get("type") == "box":
             self._shape = OrientedBBox(shape, parent=self)
-        else:
-            raise NotImplementedError("I'm too lazy to implement this")
+            self._shape.edited.connect(self.onShapeEdited)
+            self._shape.dataChanged.connect(self.onShapeChanged)
 
-        self._shape.dataChanged.connect(self.onShapeChanged)
-        self.labelsChanged.connect(self.onLabelsChanged)
+    def onShapeEdited(self, key: str, old: Any, new: Any) -> None:
+        # An empty key is an edit of the whole geometry
+        path = f"{self._shape_path}.{key}" if key else self._shape_path
+        self.edited.emit(self._idx, self._shape_item, path, old, new)
 
-    def onShapeChanged(self):
-        self.itemChanged.emit(self._idx, self._naming.shape.split(".")[0], "dict")
+    def refresh(self) -> None:
+        """Notify that labels were changed from outside, e.g. by an undo"""
+        self.labelsChanged.emit()
 
-    def onLabelsChanged(self):
-        self.itemChanged.emit(self._idx, self._naming.labels.split(".")[0], "dict")
+    def onLayerChanged(self) -> None:
+        """Replace the model and the index of the shapes of the layer, once changed"""
+        for obj in (self._shapes, self._shape_index):
+            if obj is not None:
+                obj.deleteLater()
+        self._shapes = self._shape_index = None
+        # The overlay is cached by qml by url
+        self._layer_version += 1
+        self._shapes_overlay = self._shapes_overlay.split("?")[0]
+        self._shapes_overlay += f"?v={self._layer_version}"
+        self.shapesChanged.emit()
 
     @Property(str, constant=True)
     def image(self) -> str:
         return self._image
 
+    @Property(QSize, notify=imageSizeChanged)
+    def imageSize(self) -> QSize:
+        """The full resolution size of the image, regardless of the decoded size.
+
+        Empty until it is read in background, which may decode the whole image.
+        """
+        if self._image_size is not None:
+            return self._image_size
+        provider = PipelimeImageProvider.get_instance()
+        size = provider.known_size(self._image_id)
+        if size is not None:
+            self._image_size = QSize(*size)
+            return self._image_size
+        if not self._image_size_requested:
+            self._image_size_requested = True
+            future = provider.request_size(self._image_id)
+            future.add_done_callback(self._emit_image_size)
+        return QSize(0, 0)
+
+    def _emit_image_size(self, future: Future) -> None:
+        # On the worker thread, the signal is queued to the thread of the sample
+        try:
+            size = future.result()
+        except Exception:
+            print_exc()
+            return
+        try:
+            self._imageSizeRead.emit(*size)
+        except RuntimeError:
+            # The sample was released meanwhile
+            pass
+
+    def onImageSizeRead(self, width: int, height: int) -> None:
+        self._image_size = QSize(width, height)
+        self.imageSizeChanged.emit()
+
     @Property("QVariant", notify=labelsChanged)
     def labels(self) -> Dict[str, Any]:
-        return self._labels
+        """The labels of the sample, read from the label store of the dataset"""
+        return self._labels.row(self._idx)
 
     @Slot(str, "QVariant")
     def setLabel(self, name: str, value: Any) -> None:
-        if self._labels.get(name) != value:
-            self._labels[name] = value
+        old = self._labels.get(self._idx, name)
+        if old != value:
+            self._labels.set(self._idx, name, value)
             self.labelsChanged.emit()
+            path = f"{self._labels_path}.{name}"
+            self.edited.emit(self._idx, self._labels_item, path, old, value)
 
     @Property(OrientedBBox, constant=True)
-    def shape(self) -> OrientedBBox:
+    def shape(self) -> Optional[OrientedBBox]:
         return self._shape
 
+    @Property(QObject, notify=shapesChanged)
+    def shapes(self) -> ShapeListModel:
+        """The shapes of the layer of the sample, as a list model"""
+        if self._shapes is None:
+            layer = self._dataset.shape_layer(self._idx)
+            self._shapes = ShapeListModel(layer, parent=self)
+        return self._shapes
+
+    @Property(QObject, notify=shapesChanged)
+    def shapeIndex(self) -> ShapeIndex:
+        """Spatial index of the shapes of the layer and of the region"""
+        if self._shape_index is None:
+            layer = self._dataset.shape_layer(self._idx)
+            region = None if self._shape is None else self._shape.outline()
+            self._shape_index = ShapeIndex(layer, region, parent=self)
+        return self._shape_index
+
+    def onShapeChanged(self) -> None:
+        if self._shape_index is not None:
+            self._shape_index.update_region(self._shape.outline())
+
+    @Property(int, notify=shapesChanged)
+    def shapeCount(self) -> int:
+        return len(self._dataset.shape_layer(self._idx))
+
+    @Property(str, notify=shapesChanged)
+    def shapesOverlay(self) -> str:
+        """The url of the image with all the shapes of the layer"""
+        # The layer is built here, the image is drawn on another thread
+        self._dataset.publish_layer(self._idx)
+        return self._shapes_overlay
+
+
+class SampleListModel(QAbstractListModel):
+    """Lazy list model of the samples of a dataset.
+
+    `Sample` wrappers are created on demand by `factory`, and only the `pool_size`
+    most recently used ones are kept alive, `on_evict` is called with the index of
+    every released sample. The `pinned` sample, bound by qml to the selected one, is
+    never released, since views hold it. Rows are exposed to views in batches of
+    `batch_size` through `canFetchMore`/`fetchMore`, while `count` and `get` always
+    cover the whole dataset, so that startup does not depend on the dataset size.
+    """
+
+    SampleRole = Qt.UserRole + 1
+    ImageRole = Qt.UserRole + 2
+    LabelsRole = Qt.UserRole + 3
+
+    pinnedChanged = Signal()
+
+    def __init__(
+        self,
+        length: int,
+        factory: Callable[[int], Sample],
+        pool_size: int = 256,
+        batch_size: int = 256,
+        on_evict: Optional[Callable[[int], None]] = None,
+        parent: Optional[QObject] = None,
+    ) -> None:
+        super().__init__(parent)
+        self._length = length
+        self._factory = factory
+        self._on_evict = on_evict
+        self._pool: OrderedDict[int, Sample] = OrderedDict()
+        self._pool_size = pool_size
+        self._batch_size = batch_size
+        self._fetched = 0
+        self._pinned = -1
+
+    def __len__(self) -> int:
+        return self._length
+
+    def roleNames(self) -> Dict[int, QByteArray]:
+        return {
+            self.SampleRole: QByteArray(b"sample"),
+            self.ImageRole: QByteArray(b"image"),
+            self.LabelsRole: QByteArray(b"labels"),
+        }
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else self._fetched
+
+    def canFetchMore(self, parent: QModelIndex) -> bool:
+        return not parent.isValid() and self._fetched < self._length
+
+    def fetchMore(self, parent: QModelIndex) -> None:
+        if parent.isValid():
+            return
+        n = min(self._batch_size, self._length - self._fetched)
+        if n > 0:
+            self.beginInsertRows(QModelIndex(), self._fetched, self._fetched + n - 1)
+            self._fetched += n
+            self.endInsertRows()
+
+    def data(self, index: QModelIndex, role: int = Qt.DisplayRole) -> Any:
+        if not index.isValid() or not 0 <= index.row() < self._fetched:
+            return None
+        sample = self.get(index.row())
+        if role == self.SampleRole:
+            return sample
+        elif role == self.ImageRole:
+            return sample.image
+        elif role == self.LabelsRole:
+            return sample.labels
+        return None
+
+    @Property(int, constant=True)
+    def count(self) -> int:
+        return self._length
+
+    @Slot(int, result=QObject)
+    def get(self, idx: int) -> Sample:
+        """The sample at a given index, created if not already alive"""
+        sample = self._pool.get(idx)
+        if sample is not None:
+            self._pool.move_to_end(idx)
+            return sample
+
+        sample = self._factory(idx)
+        self._pool[idx] = sample
+        if len(self._pool) > self._pool_size and self._pinned in self._pool:
+            self._pool.move_to_end(self._pinned)
+            self._pool.move_to_end(idx)
+        while len(self._pool) > self._pool_size:
+            evicted_idx, evicted = self._pool.popitem(last=False)
+            evicted.deleteLater()
+            if self._on_evict is not None:
+                self._on_evict(evicted_idx)
+        return sample
+
+    @Property(int, notify=pinnedChanged)
+    def pinned(self) -> int:
+        """The index of the sample that is never released, -1 if none"""
+        return self._pinned
+
+    @pinned.setter
+    def pinned(self, value: int) -> None:
+        if value != self._pinned:
+            self._pinned = value
+            self.pinnedChanged.emit()
+
+    def is_alive(self, idx: int) -> bool:
+        return idx in self._pool
+
+    def find(self, idx: int) -> Optional[Sample]:
+        """The sample at a given index if it is alive, None otherwise"""
+        return self._pool.get(idx)
+
+    def alive(self) -> List[Sample]:
+        """The samples currently alive"""
+        return list(self._pool.values())
+
+    def refresh(self, idx: int) -> None:
+        """Notify that the data of a sample was changed from outside"""
+        sample = self._pool.get(idx)
+        if sample is not None:
+            sample.refresh()
+        if idx < self._fetched:
+            self.dataChanged.emit(self.index(idx), self.index(idx))
+
 
 class Dataset(QObject):
-    """A sequence of samples with a name"""
+    """A sequence of samples with a name.
+
+    The metadata of all samples is loaded in background by a `MetadataLoader`, the
+    loading progress is exposed with the `progress`, `eta` and `ready` properties.
+    Samples requested before their metadata is loaded read it synchronously. Loaded
+    metadata is kept in a `metadata_cache` with a memory budget, usually shared with
+    other datasets, and read again from disk when evicted. The metadata of samples
+    that are alive or have pending edits is never evicted.
+
+    Edits are persisted in background by a `WriteBehind` writer, call `close` to
+    flush all pending writes. If an `EditJournal` is given, edits are first appended
+    to it, so that they can be undone and recovered after a crash: the journal is
+    replayed if the previous session did not shut down cleanly, and compacted every
+    time the writer has no more pending writes.
+
+    Samples can be filtered with queries over labels and metadata, answered from
+    indexes that are kept up to date as samples are loaded and edited, see
+    `QueryEngine` and the `filter` model.
+
+    Labels are moved from the metadata of the samples to a columnar `LabelStore` as
+    soon as it is loaded, labels missing from a sample are set to the criterion
+    default. With `defaults="virtual"` they are written only when
+    the sample is edited, with `defaults="persist"` all samples with missing labels
+    are written in a single batch when loading is over.
+
+    The shapes of a sample are packed into a `ShapeLayer` when first requested with
+    `shape_layer`, and the layers of the most recent samples are kept.
+    """
+
+    progressChanged = Signal()
+    readyChanged = Signal()
+    historyChanged = Signal()
+
+    # Number of shape layers kept in memory
+    LAYERS = 32
 
     def __init__(
         self,
         stream: UnderfolderStream,
         name: str,
         naming: Naming,
+        loader: Optional[MetadataLoader] = None,
+        writer: Optional[WriteBehind] = None,
+        defaults: str = "virtual",
+        journal: Optional[EditJournal] = None,
+        metadata_cache: Optional[LRUCache] = None,
         parent: Optional[QObject] = None,
     ) -> None:
         super().__init__(parent)
+        if defaults not in ("virtual", "persist"):
+            raise ValueError(f"Unknown defaults mode: {defaults}")
         self._stream = stream
         self._name = name
         self._naming = naming
-        self._samples = [Sample(stream.get_sample(i), self) for i in range(len(stream))]
+        self._length = len(stream)
+        self._samples = SampleListModel(
+            self._length, self._make_sample, on_evict=self._release, parent=self
+        )
+
+        criteria = [
+            Criterion.parse_obj(x)
+            for x in py_.get(stream.get_sample(0), self._naming.criteria)
+        ]
+        self._criteria = [CriterionProxy(x) for x in criteria]
+        self._labels = LabelStore(criteria, self._length)
+        self._statistics = LabelStatistics(self._labels, parent=self)
+        self._labels.on_set = self.onLabelSet
+
+        # Labels and shapes are all stored in the metadata item
+        self._metadata_key, self._labels_path = naming.labels.split(".", maxsplit=1)
+        self._shapes_path = naming.shapes.split(".", maxsplit=1)[1]
+        self._layers: OrderedDict[int, ShapeLayer] = OrderedDict()
+        # Layers of the live samples, read by the shape image provider on its thread
+        self._published: Dict[int, ShapeLayer] = {}
+        self._published_lock = Lock()
+        self._defaults = defaults
+        self._defaulted: List[int] = []
+        if metadata_cache is None:
+            metadata_cache = LRUCache(256 * 2**20)
+        self._cache = metadata_cache
+        self._metadata_nbytes = 0
+        self._pinned: Dict[int, Dict[str, Any]] = {}
+        self._dirty: Set[int] = set()
+        self._loaded_mask = np.zeros(self._length, dtype=bool)
+        self._query = QueryEngine(self._labels)
+        self._filter = SampleFilter(self._query, self._samples, parent=self)
+        self._loaded = 0
+        self._ready = False
+        self._metrics = Instrumentation.get_instance()
+
+        self._writer = WriteBehind() if writer is None else writer
+        self._writer.setParent(self)
+        self._writer.flushed.connect(self.onFlushed)
 
-        criteria = py_.get(stream.get_sample(0), self._naming.criteria)
-        self._criteria = [CriterionProxy(Criterion.parse_obj(x)) for x in criteria]
+        self._journal = journal
+        if journal is not None and journal.unclean:
+            for entry in journal.entries():
+                self._apply_entry(entry)
 
-        for x in self._samples:
-            x.itemChanged.connect(self.onItemChanged)
-            for c in self._criteria:
-                if c.name not in x.labels:
-                    x.setLabel(c.name, c.default)
+        self._loader = MetadataLoader() if loader is None else loader
+        self._loader.setParent(self)
+        self._loader.batchLoaded.connect(self.onBatchLoaded)
+        self._loader.finished.connect(self.onLoadingFinished)
+        # Metadata files are listed on the loading thread, it takes a while
+        self._loader.load_listed(
+            self._metadata_paths, self._read_metadata, self._length
+        )
 
     @property
     def naming(self) -> Naming:
         return self._naming
 
-    def onItemChanged(self, idx: int, name: str, format: str) -> None:
-        """When an item is changed, automatically stream it to filesystem"""
+    @property
+    def label_store(self) -> LabelStore:
+        return self._labels
 
-        data, _ = self._stream.get_data(idx, name, format)
-        self._stream.set_data(idx, name, data, format)
+    def _metadata_paths(self) -> Optional[List[Path]]:
+        paths = []
+        for i in range(self._length):
+            path = getattr(self._stream.reader[i], "filesmap", {}).get(
+                self._metadata_key
+            )
+            if path is None:
+                return None
+            paths.append(Path(path))
+        return paths
 
-    @Property("QVariantList", constant=True)
-    def samples(self) -> List[Sample]:
+    def _item_file(self, idx: int, name: str) -> Optional[Path]:
+        # The file of an item, None if the dataset is not on the filesystem
+        path = getattr(self._stream.reader[idx], "filesmap", {}).get(name)
+        return None if path is None else Path(path)
+
+    def _read_metadata(self, idx: int) -> Dict[str, Any]:
+        return py_.get(self._stream.get_sample(idx), self._metadata_key)
+
+    def metadata(self, idx: int) -> Dict[str, Any]:
+        """The metadata of a sample, read synchronously if not loaded or evicted"""
+        metadata = self._pinned.get(idx)
+        if metadata is None:
+            metadata = self._cache.get(f"{self._name}/{idx}")
+        if metadata is None:
+            self._metrics.count("dataset.metadata.miss")
+            with self._metrics.timer("dataset.metadata.read"):
+                metadata = self._read_metadata(idx)
+            if self._loaded_mask[idx]:
+                # Labels in the file may be stale, the label store is up to date
+                self._strip_labels([metadata])
+                self._cache_metadata(idx, [metadata])
+            else:
+                self._load(idx, [metadata])
+        return metadata
+
+    def _strip_labels(self, batch: List[Dict[str, Any]]) -> List[Any]:
+        rows = [py_.get(metadata, self._labels_path) for metadata in batch]
+        names = self._labels.names
+        for labels in rows:
+            if labels is not None:
+                for name in names:
+                    labels.pop(name, None)
+        return rows
+
+    def _cache_metadata(self, start: int, batch: List[Dict[str, Any]]) -> None:
+        if self._metadata_nbytes == 0:
+            # All the samples are assumed to have about the same size
+            self._metadata_nbytes = deep_sizeof(batch[0])
+        for i, metadata in enumerate(batch, start=start):
+            self._cache.put(f"{self._name}/{i}", metadata, self._metadata_nbytes)
+
+    def _load(self, start: int, batch: List[Dict[str, Any]]) -> None:
+        # Labels are moved from the metadata to the label store in a single pass.
+        # Defaults are set without emitting any signal, in "persist" mode they are
+        # written all together when loading is over
+        stop = start + len(batch)
+        rows = [py_.get(metadata, self._labels_path) for metadata in batch]
+        missing = self._labels.load(start, rows)
+        self._strip_labels(batch)
+        self._cache_metadata(start, batch)
+        self._loaded_mask[start:stop] = True
+        self._statistics.add(start, stop)
+        self._query.add(start, batch)
+        self._filter.invalidate()
+        if self._defaults == "persist":
+            self._defaulted.extend((start + np.flatnonzero(missing)).tolist())
+
+    def _pin(self, idx: int) -> Dict[str, Any]:
+        metadata = self.metadata(idx)
+        self._pinned[idx] = metadata
+        return metadata
+
+    def _release(self, idx: int) -> None:
+        self._unpin(idx)
+        with self._published_lock:
+            self._published.pop(idx, None)
+
+    def _unpin(self, idx: int) -> None:
+        if idx not in self._dirty and not self._samples.is_alive(idx):
+            self._pinned.pop(idx, None)
+
+    def onLoadingFinished(self) -> None:
+        if self._defaults == "persist" and self._defaulted:
+            # Only plain data reaches the writer thread: the file and the labels of
+            # every sample, taken here. The metadata is read and written there
+            key = self._metadata_key
+            items = [
+                (i, self._item_file(i, key), self._labels.row(i))
+                for i in self._defaulted
+            ]
+            self._writer.submit((item, self._write_defaults) for item in items)
+            self._defaulted = []
+
+    def _write_defaults(self, item: Tuple[int, Optional[Path], Dict[str, Any]]) -> None:
+        # On the writer thread, without the reader. Samples without a file are in
+        # an archive, whose stream is thread safe
+        idx, path, labels = item
+        with self._metrics.timer("dataset.item.set"):
+            if path is None:
+                data, _ = self._stream.get_data(idx, self._metadata_key, "dict")
+            else:
+                data = decode(path.read_bytes(), path.suffix)
+            current = py_.get(data, self._labels_path) or {}
+            current.update(labels)
+            py_.set_(data, self._labels_path, current)
+            if path is None:
+                self._stream.set_data(idx, self._metadata_key, data, "dict")
+            else:
+                replace_file(path, encode(data, path.suffix))
+
+    def onBatchLoaded(self, start: int, batch: List[Optional[Dict[str, Any]]]) -> None:
+        stop = start + len(batch)
+        if not self._loaded_mask[start:stop].any() and None not in batch:
+            self._load(start, batch)
+        else:
+            for i, metadata in enumerate(batch, start=start):
+                # Metadata read synchronously may have already been edited
+                if not self._loaded_mask[i] and metadata is not None:
+                    self._load(i, [metadata])
+        self._loaded += len(batch)
+        self.progressChanged.emit()
+        if not self._ready and self._loaded_mask[0]:
+            self._ready = True
+            self.readyChanged.emit()
+
+    def _make_sample(self, idx: int) -> Sample:
+        with self._metrics.timer("sample.create"):
+            sample = Sample(idx, {self._metadata_key: self._pin(idx)}, self)
+            sample.edited.connect(self.onEdited)
+        return sample
+
+    def onEdited(self, idx: int, item: str, key: str, old: Any, new: Any) -> None:
+        """Journal an edit and stream the edited item to filesystem in background"""
+        with self._metrics.timer("dataset.edit"):
+            self._on_edited(idx, item, key, old, new)
+
+    def _on_edited(self, idx: int, item: str, key: str, old: Any, new: Any) -> None:
+        if self._journal is not None:
+            self._journal.record(idx, item, key, old, new)
+            self.historyChanged.emit()
+        self._pin(idx)
+        self._dirty.add(idx)
+        self._writer.mark((idx, item), *self._metadata_io(idx, item))
+        if not key.startswith(f"{self._labels_path}."):
+            self.onMetadataEdited(idx, key)
+
+    def onLabelSet(self, idx: int, name: str, old: Any, new: Any) -> None:
+        self._statistics.update(idx, name, old, new)
+        self._query.update_label(idx, name, old, new)
+        self._filter.invalidate()
+
+    def onMetadataEdited(self, idx: int, key: str) -> None:
+        self._query.update_metadata(idx, key, self.metadata(idx))
+        self._filter.invalidate()
+        path = self._shapes_path
+        if key == path or key.startswith(f"{path}.") or path.startswith(f"{key}."):
+            self._layers.pop(idx, None)
+            sample = self._samples.find(idx)
+            if sample is not None:
+                sample.onLayerChanged()
+
+    def shape_layer(self, idx: int) -> ShapeLayer:
+        """All the shapes of a sample, packed, the most recent ones are kept"""
+        layer = self._layers.get(idx)
+        if layer is not None:
+            self._layers.move_to_end(idx)
+            return layer
+        layer = ShapeLayer.from_list(py_.get(self.metadata(idx), self._shapes_path))
+        self._layers[idx] = layer
+        if len(self._layers) > self.LAYERS:
+            self._layers.popitem(last=False)
+        return layer
+
+    def publish_layer(self, idx: int) -> None:
+        """Make the layer of a live sample available to `published_layer`"""
+        layer = self.shape_layer(idx)
+        with self._published_lock:
+            self._published[idx] = layer
+
+    def published_layer(self, idx: int) -> Optional[ShapeLayer]:
+        """The published layer of a sample, None if not published. Thread safe"""
+        with self._published_lock:
+            return self._published.get(idx)
+
+    def onFlushed(self) -> None:
+        # All the journaled edits are in the dataset files once nothing is pending
+        if self._writer.pendingWrites > 0:
+            return
+        if self._journal is not None:
+            self._journal.compact()
+        dirty, self._dirty = self._dirty, set()
+        for idx in dirty:
+            self._unpin(idx)
+
+    def _set_value(self, idx: int, item: str, key: str, value: Any) -> None:
+        if item != self._metadata_key:
+            raise ValueError(f"Only {self._metadata_key} items can be edited")
+        metadata = self._pin(idx)
+        self._dirty.add(idx)
+        prefix = f"{self._labels_path}."
+        if key.startswith(prefix):
+            self._labels.set(idx, key[len(prefix) :], value)
+        else:
+            # The region of a live sample is updated like by an interactive edit, so
+            # that views, overlays and spatial index follow
+            sample = self._samples.find(idx)
+            geometry = self._region_geometry(key, value)
+            if sample is not None and sample.shape is not None and geometry:
+                sample.shape.restore(geometry)
+            else:
+                # Geometries are updated in place, the shape of a live sample refers
+                # to the same dictionary
+                current = py_.get(metadata, key)
+                if isinstance(current, dict) and isinstance(value, dict):
+                    current.update(value)
+                else:
+                    py_.set_(metadata, key, value)
+            self.onMetadataEdited(idx, key)
+        self._writer.mark((idx, item), *self._metadata_io(idx, item))
+        self._samples.refresh(idx)
+
+    def _region_geometry(self, key: str, value: Any) -> Optional[Dict[str, float]]:
+        # The geometry set by an edit of the region, None if it is not one
+        path = self._naming.shape.split(".", maxsplit=1)[1]
+        if key == path and isinstance(value, dict):
+            geometry = {k: v for k, v in value.items() if k in OrientedBBox.GEOMETRY}
+            # Other fields, e.g. the type, are never edited
+            return geometry if len(geometry) == len(value) else None
+        field = key[len(path) + 1 :] if key.startswith(f"{path}.") else None
+        return {field: value} if field in OrientedBBox.GEOMETRY else None
+
+    def _apply_entry(self, entry: Optional[Dict[str, Any]]) -> int:
+        if entry is None:
+            return -1
+        self._set_value(entry["sample"], entry["item"], entry["key"], entry["new"])
+        self.historyChanged.emit()
+        return entry["sample"]
+
+    @Slot(result=int)
+    def undo(self) -> int:
+        """Undo the last edit, returns the index of the edited sample or -1"""
+        return -1 if self._journal is None else self._apply_entry(self._journal.undo())
+
+    @Slot(result=int)
+    def redo(self) -> int:
+        """Redo the last undone edit, returns the index of the edited sample or -1"""
+        return -1 if self._journal is None else self._apply_entry(self._journal.redo())
+
+    @Property(bool, notify=historyChanged)
+    def canUndo(self) -> bool:
+        return self._journal is not None and self._journal.can_undo
+
+    @Property(bool, notify=historyChanged)
+    def canRedo(self) -> bool:
+        return self._journal is not None and self._journal.can_redo
+
+    def _metadata_io(
+        self, idx: int, name: Optional[str] = None, format: str = "dict"
+    ) -> Tuple[Callable[[], Any], Callable[[Any], None]]:
+        # Snapshot and write functions of an item, for the write-behind writer. The
+        # reader is only used here, on the GUI thread
+        name = self._metadata_key if name is None else name
+        path = self._item_file(idx, name)
+        if format != "dict" or (path is not None and path.suffix not in DICT_SUFFIXES):
+            path = None
+
+        def snapshot() -> Any:
+            with self._metrics.timer("dataset.item.get"):
+                data = _snapshot()
+            if path is not None:
+                # The reader caches the items it read, they are replaced by writes
+                self._stream.reader[idx][name] = deepcopy(data)
+            return data
+
+        def _snapshot() -> Any:
+            if name == self._metadata_key:
+                data = deepcopy(self.metadata(idx))
+                labels = py_.get(data, self._labels_path) or {}
+                labels.update(self._labels.row(idx))
+                py_.set_(data, self._labels_path, labels)
+                return data
+            data, _ = self._stream.get_data(idx, name, format)
+            return deepcopy(data)
+
+        def write(data: Any) -> None:
+            with self._metrics.timer("dataset.item.set"):
+                if path is None:
+                    self._stream.set_data(idx, name, data, format)
+                else:
+                    # Files are replaced atomically
+                    replace_file(path, encode(data, path.suffix))
+
+        return snapshot, write
+
+    @Property(WriteBehind, constant=True)
+    def writer(self) -> WriteBehind:
+        return self._writer
+
+    @Slot()
+    def close(self) -> None:
+        """Stop loading, flush all pending writes and close the journal"""
+        self._loader.stop()
+        self._writer.close()
+        if self._journal is not None:
+            self._journal.close()
+        if isinstance(self._stream, ArchiveStream):
+            self._stream.close()
+
+    @Property(float, notify=progressChanged)
+    def progress(self) -> float:
+        """The fraction of samples whose metadata is loaded"""
+        return self._loaded / max(self._length, 1)
+
+    @Property(float, notify=progressChanged)
+    def eta(self) -> float:
+        """Estimated seconds to load all the metadata"""
+        if self._loaded == 0:
+            return -1.0
+        elapsed = time.monotonic() - self._loader.started
+        return elapsed / self._loaded * (self._length - self._loaded)
+
+    @Property(bool, notify=readyChanged)
+    def ready(self) -> bool:
+        """True when the first sample is loaded"""
+        return self._ready
+
+    @Property(QObject, constant=True)
+    def samples(self) -> SampleListModel:
         return self._samples
 
+    @Property(QObject, constant=True)
+    def filter(self) -> SampleFilter:
+        """The samples matching a query, used for navigation"""
+        return self._filter
+
+    @Property(QObject, constant=True)
+    def statistics(self) -> LabelStatistics:
+        """Live histograms of the labels of the loaded samples"""
+        return self._statistics
+
     @Property(str, constant=True)
     def name(self) -> str:
         return self._name
 
+    @Property(str, constant=True)
+    def imageKey(self) -> str:
+        return self._naming.image
+
     @Property("QVariantList", constant=True)
     def criteria(self) -> List[CriterionProxy]:
         return self._criteria
 
 
+def open_stream(path: Path) -> Tuple[UnderfolderStream, Path]:
+    """The stream of a dataset and the folder of its sidecar files"""
+    if is_archive(path):
+        # The archive is never written, sidecar files go next to it
+        return ArchiveStream(path), path.parent / ".juiced" / path.name
+    return UnderfolderStream(path), path / ".juiced"
+
+
 class Scene(QObject):
-    """Root scene object"""
+    """Root scene object, with one or more datasets.
+
+    Datasets are opened lazily, the first time they are selected with `current` or
+    opened with `open`, and load their metadata in background concurrently. They
+    share the image and the metadata caches of the `PipelimeImageProvider`, so the
+    memory used does not grow with the number of open datasets. Every dataset gets
+    its own `MetadataLoader` and `WriteBehind` writer from `loader_factory` and
+    `writer_factory`. `closeDataset` flushes a dataset and releases everything
+    related to it.
+
+    Datasets are underfolders or underfolders packed in a zip or tar archive, read
+    through an `ArchiveStream`. Edits are journaled in the `.juiced` folder of every
+    dataset (`.juiced/<archive name>` next to archives), and the edits of the
+    current dataset can be undone with `undo`/`redo`.
+
+    Listing a large dataset takes a while, `streams` can map the paths of some
+    datasets to their `open_stream`, created in advance on another thread.
+    """
+
+    datasetsChanged = Signal()
+    currentChanged = Signal()
+    datasetOpened = Signal(QObject)
 
     def __init__(
         self,
-        dataset: Path,
+        datasets: Union[Path, Sequence[Path]],
         naming: Optional[Naming] = None,
+        loader_factory: Optional[Callable[[], MetadataLoader]] = None,
+        writer_factory: Optional[Callable[[], WriteBehind]] = None,
+        defaults: str = "virtual",
+        undo_merge_ms: int = 1000,
+        streams: Optional[Dict[Path, Tuple[UnderfolderStream, Path]]] = None,
         parent: Optional[QObject] = None,
     ) -> None:
         super().__init__(parent)
-        if naming is None:
-            naming = Naming()
+        self._naming = Naming() if naming is None else naming
+        self._streams = dict(streams or {})
+        self._loader_factory = loader_factory or MetadataLoader
+        self._writer_factory = writer_factory or WriteBehind
+        self._defaults = defaults
+        self._undo_merge_ms = undo_merge_ms
+
+        if isinstance(datasets, (str, Path)):
+            datasets = [datasets]
+        self._paths: List[Path] = []
+        self._names: List[str] = []
+        self._datasets: Dict[str, Dataset] = {}
+        self._current = 0
+        for path in datasets:
+            self.add(str(path))
+
+    @Slot(str, result=int)
+    def add(self, path: str) -> int:
+        """Add a dataset without opening it, returns its index"""
+        path = Path(path)
+        name, n = path.name, 1
+        while name in self._names:
+            n += 1
+            name = f"{path.name}_{n}"
+        self._paths.append(path)
+        self._names.append(name)
+        self.datasetsChanged.emit()
+        return len(self._paths) - 1
+
+    @Slot(int, result=QObject)
+    def open(self, index: int) -> Dataset:
+        """The dataset at a given index, opened if it is not already"""
+        name = self._names[index]
+        dataset = self._datasets.get(name)
+        if dataset is not None:
+            return dataset
+
+        path = self._paths[index]
+        opened = self._streams.pop(path, None)
+        stream, sidecar = open_stream(path) if opened is None else opened
+        provider = PipelimeImageProvider.get_instance()
+        provider.add_dataset(stream.reader, name)
+        provider.normalizer.set_sidecar(name, sidecar / "statistics.json")
+        dataset = Dataset(
+            stream,
+            name,
+            self._naming,
+            loader=self._loader_factory(),
+            writer=self._writer_factory(),
+            defaults=self._defaults,
+            journal=EditJournal(sidecar, merge_ms=self._undo_merge_ms),
+            metadata_cache=provider.metadata_cache,
+            parent=self,
+        )
+        self._datasets[name] = dataset
+        self.datasetOpened.emit(dataset)
+        return dataset
+
+    @Slot(int)
+    def closeDataset(self, index: int) -> None:
+        """Flush, close and unload a dataset, removing it from the scene.
+
+        The last dataset of the scene cannot be closed.
+        """
+        if len(self._paths) <= 1:
+            return
+        name = self._names.pop(index)
+        self._close_stream(self._paths.pop(index))
+        dataset = self._datasets.pop(name, None)
+        if dataset is not None:
+            # Forget it in the provider first, the stream is closed with the dataset
+            PipelimeImageProvider.get_instance().remove_dataset(name)
+            dataset.close()
+            dataset.deleteLater()
+
+        self.datasetsChanged.emit()
+        if index <= self._current:
+            self._current = max(0, self._current - 1)
+            self.currentChanged.emit()
 
-        dataset_name = "dataset"
-        stream = UnderfolderStream(dataset)
-        PipelimeImageProvider.get_instance().add_dataset(stream.reader, dataset_name)
-        self._dataset = Dataset(stream, dataset_name, naming)
+    @Property("QVariantList", notify=datasetsChanged)
+    def names(self) -> List[str]:
+        return list(self._names)
 
-    @Property(Dataset, constant=True)
+    @Property(int, notify=currentChanged)
+    def current(self) -> int:
+        """The index of the selected dataset"""
+        return self._current
+
+    @current.setter
+    def current(self, value: int) -> None:
+        if value != self._current:
+            self._current = value
+            self.currentChanged.emit()
+
+    def find(self, name: str) -> Optional[Dataset]:
+        """The dataset with a given name, None if it is not open"""
+        return self._datasets.get(name)
+
+    @Property(Dataset, notify=currentChanged)
     def dataset(self) -> Dataset:
-        return self._dataset
+        """The selected dataset"""
+        return self.open(self._current)
+
+    @Slot()
+    def close(self) -> None:
+        """Flush all pending writes, must be called before exiting"""
+        for dataset in self._datasets.values():
+            dataset.close()
+        for path in list(self._streams):
+            self._close_stream(path)
+
+    def _close_stream(self, path: Path) -> None:
+        # Streams opened in advance for datasets that were never opened
+        stream, _ = self._streams.pop(path, (None, None))
+        if isinstance(stream, ArchiveStream):
+            stream.close()
+
+    @Slot(result=int)
+    def undo(self) -> int:
+        """Undo the last edit, returns the index of the edited sample or -1"""
+        return self.dataset.undo()
+
+    @Slot(result=int)
+    def redo(self) -> int:
+        """Redo the last undone edit, returns the index of the edited sample or -1"""
+        return self.dataset.redo()
 
     @Property(str, constant=True)
     def version(self) -> str:
@@ -0,0 +1,357 @@
+from __future__ import annotations
+
+from itertools import chain
+from traceback import print_exc
+from typing import TYPE_CHECKING, Any, Dict, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+from PySide6.QtCore import (
+    QAbstractListModel,
+    QByteArray,
+    QModelIndex,
+    QObject,
+    QPointF,
+    QSize,
+    QSizeF,
+    Qt,
+    Slot,
+)
+from PySide6.QtGui import QImage
+from PySide6.QtQml import QQmlImageProviderBase
+from PySide6.QtQuick import QQuickImageProvider
+
+from juiced.conversion import array_to_qimage
+
+if TYPE_CHECKING:
+    from juiced.image_provider import PipelimeImageProvider
+    from juiced.scene import Scene
+
+
+class ShapeLayer:
+    """All the shapes of a sample, packed in NumPy arrays.
+
+    Shapes are read from a list of dictionaries, one per shape::
+
+        {"type": "box", "x": 10, "y": 20, "w": 4, "h": 3, "angle": 0.5}
+        {"type": "polygon", "points": [[0, 0], [4, 0], [2, 3]]}
+        {"type": "keypoint", "x": 10, "y": 20}
+
+    each with an optional "label". Every shape has a type code, a centre, a size and
+    an angle, and its outline is stored as a run of `vertices`, from `offsets[i]` to
+    `offsets[i + 1]`: the four corners of a box, the points of a polygon or the
+    single point of a keypoint. Shapes of unknown type are skipped. Layers are
+    read-only, so that they can be shared with other threads.
+    """
+
+    BOX, POLYGON, KEYPOINT = 0, 1, 2
+    TYPES = {"box": BOX, "polygon": POLYGON, "keypoint": KEYPOINT}
+
+    def __init__(
+        self,
+        types: np.ndarray,
+        centers: np.ndarray,
+        sizes: np.ndarray,
+        angles: np.ndarray,
+        vertices: np.ndarray,
+        offsets: np.ndarray,
+        labels: Sequence[Optional[str]],
+    ) -> None:
+        self.types = types
+        self.centers = centers
+        self.sizes = sizes
+        self.angles = angles
+        self.vertices = vertices
+        self.offsets = offsets
+        self.labels = list(labels)
+
+        # Label codes, used to pick a color for every shape
+        self.label_names = sorted({x for x in self.labels if x is not None})
+        codes = {name: i for i, name in enumerate(self.label_names)}
+        self.label_codes = np.array(
+            [codes.get(x, -1) for x in self.labels], dtype=np.int32
+        )
+        for array in (types, centers, sizes, angles, vertices, offsets):
+            array.setflags(write=False)
+        self.label_codes.setflags(write=False)
+
+    def __len__(self) -> int:
+        return len(self.types)
+
+    @classmethod
+    def from_list(cls, shapes: Optional[Sequence[Mapping[str, Any]]]) -> ShapeLayer:
+        """Pack a list of shape dictionaries, None is an empty layer"""
+        shapes = [s for s in shapes or [] if s.get("type") in cls.TYPES]
+        n = len(shapes)
+        types = np.array([cls.TYPES[s["type"]] for s in shapes], dtype=np.int8)
+        labels = [s.get("label") for s in shapes]
+
+        # Boxes and keypoints first, polygons fill their fields from the points
+        centers = np.array(
+            [(s.get("x", 0.0), s.get("y", 0.0)) for s in shapes], dtype=np.float64
+        ).reshape(n, 2)
+        sizes = np.array(
+            [(s.get("w", 0.0), s.get("h", 0.0)) for s in shapes], dtype=np.float64
+        ).reshape(n, 2)
+        angles = np.array([s.get("angle", 0.0) for s in shapes], dtype=np.float64)
+
+        polygons = np.flatnonzero(types == cls.POLYGON)
+        points = [shapes[i].get("points") or [] for i in polygons]
+        counts = np.where(types == cls.BOX, 4, 1).astype(np.int64)
+        counts[polygons] = [len(p) for p in points]
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        vertices = np.zeros((offsets[-1], 2), dtype=np.float64)
+
+        keypoints = np.flatnonzero(types == cls.KEYPOINT)
+        vertices[offsets[keypoints]] = centers[keypoints]
+
+        boxes = np.flatnonzero(types == cls.BOX)
+        if len(boxes):
+            corners = np.array([[-1, -1], [1, -1], [1, 1], [-1, 1]]) / 2
+            cos, sin = np.cos(angles[boxes]), np.sin(angles[boxes])
+            local = corners[None] * sizes[boxes, None]
+            rotated = np.stack(
+                [
+                    local[..., 0] * cos[:, None] - local[..., 1] * sin[:, None],
+                    local[..., 0] * sin[:, None] + local[..., 1] * cos[:, None],
+                ],
+                axis=-1,
+            )
+            at = offsets[boxes, None] + np.arange(4)
+            vertices[at] = rotated + centers[boxes, None]
+
+        polygons = polygons[counts[polygons] > 0]
+        if len(polygons):
+            flat = np.array(list(chain.from_iterable(points)), dtype=np.float64)
+            flat = flat.reshape(-1, 2)
+            starts = np.repeat(offsets[polygons], counts[polygons])
+            first = np.cumsum(counts[polygons]) - counts[polygons]
+            rank = np.arange(len(flat)) - np.repeat(first, counts[polygons])
+            vertices[starts + rank] = flat
+            low = np.minimum.reduceat(flat, first)
+            high = np.maximum.reduceat(flat, first)
+            centers[polygons] = (low + high) / 2
+            sizes[polygons] = high - low
+        return cls(types, centers, sizes, angles, vertices, offsets, labels)
+
+    def type_name(self, i: int) -> str:
+        return ("box", "polygon", "keypoint")[self.types[i]]
+
+    def points(self, i: int) -> np.ndarray:
+        """The outline of a shape, as a view on `vertices`"""
+        return self.vertices[self.offsets[i] : self.offsets[i + 1]]
+
+    def bounds(self) -> np.ndarray:
+        """The axis aligned bounding box of every shape, as (x0, y0, x1, y1) rows"""
+        # Empty polygons have no vertices, they are collapsed on their centre
+        bounds = np.concatenate([self.centers, self.centers], axis=1)
+        nonempty = np.flatnonzero(np.diff(self.offsets) > 0)
+        if len(nonempty):
+            at = self.offsets[nonempty]
+            bounds[nonempty, :2] = np.minimum.reduceat(self.vertices, at)
+            bounds[nonempty, 2:] = np.maximum.reduceat(self.vertices, at)
+        return bounds
+
+
+def parse_palette(colors: Sequence[str]) -> np.ndarray:
+    """RGBA rows from "#rrggbb" or "#rrggbbaa" strings"""
+    rows = []
+    for color in colors:
+        color = color.lstrip("#")
+        rgba = [int(color[i : i + 2], 16) for i in range(0, len(color), 2)]
+        rows.append(rgba + [255] * (4 - len(rgba)))
+    return np.array(rows, dtype=np.uint8).reshape(-1, 4)
+
+
+def rasterize(
+    layer: ShapeLayer,
+    image_size: Tuple[int, int],
+    size: Tuple[int, int],
+    palette: np.ndarray,
+    line_width: int = 2,
+    point_radius: int = 3,
+) -> np.ndarray:
+    """Draw the outlines of all the shapes of a layer into an RGBA array.
+
+    All the segments are sampled at one point per pixel and plotted at once, so the
+    cost is proportional to the number of painted pixels, regardless of the number
+    of shapes. Shapes are colored by label, or by type if they have no label.
+
+    Args:
+        layer (ShapeLayer): The shapes to draw.
+        image_size (Tuple[int, int]): The (width, height) of the image the shapes
+        refer to.
+        size (Tuple[int, int]): The (width, height) of the output.
+        palette (np.ndarray): RGBA colors, one per row.
+        line_width (int, optional): The width of the outlines in pixels. Defaults
+        to 2.
+        point_radius (int, optional): The radius of keypoints in pixels. Defaults
+        to 3.
+
+    Returns:
+        np.ndarray: A (height, width, 4) uint8 array, transparent where empty.
+    """
+    width, height = size
+    out = np.zeros((height, width, 4), dtype=np.uint8)
+    if not len(layer) or not len(layer.vertices) or not len(palette):
+        return out
+
+    # Image coordinates to output pixels, far away vertices are clamped so that
+    # huge segments do not generate a huge number of points
+    scale = np.array([width / max(image_size[0], 1), height / max(image_size[1], 1)])
+    points = layer.vertices * scale
+    points = np.clip(points, -1, [width, height])
+
+    # Every vertex is joined to the next one of its shape, the last to the first
+    counts = np.diff(layer.offsets)
+    owner = np.repeat(np.arange(len(layer)), counts)
+    following = np.arange(1, len(points) + 1)
+    nonempty = counts > 0
+    following[layer.offsets[1:][nonempty] - 1] = layer.offsets[:-1][nonempty]
+    start, delta = points, points[following] - points
+
+    steps = np.ceil(np.abs(delta).max(axis=1)).astype(np.int64) + 1
+    segment = np.repeat(np.arange(len(points)), steps)
+    first = np.cumsum(steps) - steps
+    t = (np.arange(len(segment)) - first[segment]) / np.maximum(steps - 1, 1)[segment]
+    xy = np.floor(start[segment] + delta[segment] * t[:, None]).astype(np.int64)
+
+    codes = np.where(layer.label_codes >= 0, layer.label_codes, layer.types)
+    colors = palette[codes % len(palette)]
+    _plot(out, xy, colors[owner[segment]], line_width)
+
+    keypoints = np.flatnonzero(layer.types == ShapeLayer.KEYPOINT)
+    if len(keypoints):
+        xy = np.floor(points[layer.offsets[keypoints]]).astype(np.int64)
+        _plot(out, xy - point_radius, colors[keypoints], 2 * point_radius + 1)
+    return out
+
+
+def _plot(out: np.ndarray, xy: np.ndarray, colors: np.ndarray, width: int) -> None:
+    # Paint a width x width square with its top left corner at every point
+    height, w = out.shape[:2]
+    for dy in range(width):
+        for dx in range(width):
+            x, y = xy[:, 0] + dx, xy[:, 1] + dy
+            inside = (x >= 0) & (x < w) & (y >= 0) & (y < height)
+            out[y[inside], x[inside]] = colors[inside]
+
+
+class ShapeListModel(QAbstractListModel):
+    """List model on the shapes of a `ShapeLayer`, rows are read lazily"""
+
+    TypeRole = Qt.UserRole + 1
+    LabelRole = Qt.UserRole + 2
+    CenterRole = Qt.UserRole + 3
+    SizeRole = Qt.UserRole + 4
+    AngleRole = Qt.UserRole + 5
+    PointsRole = Qt.UserRole + 6
+
+    def __init__(self, layer: ShapeLayer, parent: Optional[QObject] = None) -> None:
+        super().__init__(parent)
+        self._layer = layer
+
+    @property
+    def layer(self) -> ShapeLayer:
+        return self._layer
+
+    @Slot(int, result="QVariant")
+    def get(self, row: int) -> Dict[str, Any]:
+        """The type, label, centre, size and angle of a shape"""
+        layer = self._layer
+        return {
+            "type": layer.type_name(row),
+            "label": layer.labels[row],
+            "center": QPointF(*layer.centers[row]),
+            "size": QSizeF(*layer.sizes[row]),
+            "angle": float(layer.angles[row]),
+        }
+
+    def roleNames(self) -> Dict[int, QByteArray]:
+        return {
+            self.TypeRole: QByteArray(b"type"),
+            self.LabelRole: QByteArray(b"label"),
+            self.CenterRole: QByteArray(b"center"),
+            self.SizeRole: QByteArray(b"size"),
+            self.AngleRole: QByteArray(b"angle"),
+            self.PointsRole: QByteArray(b"points"),
+        }
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self._layer)
+
+    def data(self, index: QModelIndex, role: int = Qt.DisplayRole) -> Any:
+        layer = self._layer
+        if not index.isValid() or not 0 <= index.row() < len(layer):
+            return None
+        i = index.row()
+        if role in (self.TypeRole, Qt.DisplayRole):
+            return layer.type_name(i)
+        elif role == self.LabelRole:
+            return layer.labels[i]
+        elif role == self.CenterRole:
+            return QPointF(*layer.centers[i])
+        elif role == self.SizeRole:
+            return QSizeF(*layer.sizes[i])
+        elif role == self.AngleRole:
+            return float(layer.angles[i])
+        elif role == self.PointsRole:
+            return [QPointF(x, y) for x, y in layer.points(i)]
+        return None
+
+
+class ShapeImageProvider(QQuickImageProvider):
+    """Image provider of the shapes of the samples of a `Scene`, pre-rasterised.
+
+    All the shapes of a sample are drawn into a single transparent image, at the
+    requested size, with the following url::
+
+        image://PROVIDER_NAME/DATASET_NAME/SAMPLE_INDEX
+
+    The image must be stretched over the area where the image of the sample is
+    painted, so that thousands of shapes cost a single textured quad. Its longest
+    side is at most `max_size` pixels, and it is drawn at the size of the image of
+    the sample, within that bound, when no size is requested.
+
+    Only layers published by the samples alive are drawn, see
+    `Dataset.publish_layer`, so that the layers are never built on the image
+    loading thread.
+    """
+
+    def __init__(
+        self,
+        scene: Scene,
+        images: PipelimeImageProvider,
+        palette: Sequence[str],
+        line_width: int = 2,
+        max_size: int = 2048,
+    ) -> None:
+        super().__init__(QQmlImageProviderBase.ImageType.Image)
+        self._scene = scene
+        self._images = images
+        self._palette = parse_palette(palette)
+        self.line_width = line_width
+        self.max_size = max_size
+
+    def requestImage(self, id: str, size: QSize, requestedSize: QSize) -> QImage:
+        try:
+            name, idx = id.split("?")[0].split("/")
+            dataset = self._scene.find(name)
+            layer = dataset.published_layer(int(idx))
+            image_size = self._images.image_size(f"{name}/{idx}/{dataset.imageKey}")
+        except Exception:
+            print_exc()
+            return QImage()
+        if layer is None:
+            # The sample was released meanwhile
+            layer = ShapeLayer.from_list(None)
+
+        width = requestedSize.width() if requestedSize.width() > 0 else image_size[0]
+        height = requestedSize.height() if requestedSize.height() > 0 else image_size[1]
+        scale = min(1.0, self.max_size / max(width, height, 1))
+        width, height = max(1, round(width * scale)), max(1, round(height * scale))
+        array = rasterize(
+            layer, image_size, (width, height), self._palette, self.line_width
+        )
+        size.setWidth(width)
+        size.setHeight(height)
+        return array_to_qimage(array)
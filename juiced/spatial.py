@@ -0,0 +1,231 @@
+from __future__ import annotations
+
+import math
+from typing import List, Optional, Set
+
+import numpy as np
+from PySide6.QtCore import QObject, Slot
+
+from juiced.shapes import ShapeLayer
+
+
+class GridIndex:
+    """A uniform grid over axis aligned bounding boxes, for spatial queries.
+
+    Boxes are (x0, y0, x1, y1) rows, identified by their row. The grid is stored as
+    a sorted array of (cell, box) pairs, so that the boxes of a cell are a slice::
+
+        index = GridIndex(layer.bounds())
+        index.at(10.0, 20.0)
+        index.rect(0.0, 0.0, 100.0, 100.0)
+        index.nearest(10.0, 20.0, k=5)
+
+    Queries return the rows whose box contains the point, intersects the rectangle
+    or is closest to the point. Boxes can be moved with `update`: moved boxes are
+    tested one by one until they are many, then the grid is rebuilt.
+    """
+
+    # Boxes spanning more cells than this are tested one by one
+    MAX_CELLS = 64
+
+    def __init__(self, bounds: np.ndarray, cell: Optional[float] = None) -> None:
+        self._bounds = np.array(bounds, dtype=np.float64).reshape(-1, 4)
+        self._cell = cell
+        self._build()
+
+    def __len__(self) -> int:
+        return len(self._bounds)
+
+    @property
+    def bounds(self) -> np.ndarray:
+        return self._bounds
+
+    def update(self, i: int, bounds: np.ndarray) -> None:
+        """Move a box, the grid is rebuilt after a number of moves"""
+        self._bounds[i] = bounds
+        self._moved.add(i)
+        if len(self._moved) > max(64, math.isqrt(len(self._bounds))):
+            self._build()
+
+    def at(self, x: float, y: float) -> np.ndarray:
+        """The sorted rows of the boxes that contain a point"""
+        return self.rect(x, y, x, y)
+
+    def rect(self, x0: float, y0: float, x1: float, y1: float) -> np.ndarray:
+        """The sorted rows of the boxes that intersect a rectangle"""
+        candidates = self._candidates(x0, y0, x1, y1)
+        b = self._bounds[candidates]
+        hit = (b[:, 0] <= x1) & (b[:, 2] >= x0) & (b[:, 1] <= y1) & (b[:, 3] >= y0)
+        return candidates[hit]
+
+    def nearest(self, x: float, y: float, k: int = 1) -> np.ndarray:
+        """The rows of the `k` boxes closest to a point, closest first"""
+        k = min(k, len(self._bounds))
+        if k <= 0:
+            return np.zeros(0, dtype=np.int64)
+
+        # Search squares of growing size, until they contain k boxes that are not
+        # farther than the half side of the square
+        radius = self._size
+        extent = np.abs(self._bounds).max() + abs(x) + abs(y) + self._size
+        while True:
+            ids = self.rect(x - radius, y - radius, x + radius, y + radius)
+            distances = self._distances(ids, x, y)
+            if np.count_nonzero(distances <= radius) >= k or radius > extent:
+                break
+            radius *= 2
+        order = np.argsort(distances, kind="stable")[:k]
+        return ids[order]
+
+    def _distances(self, ids: np.ndarray, x: float, y: float) -> np.ndarray:
+        b = self._bounds[ids]
+        dx = np.maximum(np.maximum(b[:, 0] - x, x - b[:, 2]), 0)
+        dy = np.maximum(np.maximum(b[:, 1] - y, y - b[:, 3]), 0)
+        return np.hypot(dx, dy)
+
+    def _build(self) -> None:
+        bounds = self._bounds
+        self._moved: Set[int] = set()
+        if not len(bounds):
+            self._origin = np.zeros(2)
+            self._size, self._shape = 1.0, (1, 1)
+            self._cells = self._rows = np.zeros(0, dtype=np.int64)
+            self._large = np.zeros(0, dtype=np.int64)
+            return
+
+        # By default cells are as large as the typical box
+        self._origin = bounds[:, :2].min(axis=0)
+        extent = np.maximum(bounds[:, 2:].max(axis=0) - self._origin, 1e-9)
+        size = self._cell
+        if size is None:
+            sides = np.maximum(bounds[:, 2] - bounds[:, 0], bounds[:, 3] - bounds[:, 1])
+            size = float(np.median(sides))
+            # Never more than ~4 cells per box, to bound the memory of the grid
+            size = max(size, math.sqrt(extent[0] * extent[1] / (4 * len(bounds))))
+        self._size = max(size, 1e-9)
+        self._shape = tuple(np.ceil(extent / self._size).astype(np.int64) + 1)
+
+        low = self._cell_of(bounds[:, :2])
+        high = self._cell_of(bounds[:, 2:])
+        spans = high - low + 1
+        counts = spans[:, 0] * spans[:, 1]
+        large = counts > self.MAX_CELLS
+        self._large = np.flatnonzero(large)
+
+        # One (cell, row) pair for every cell covered by every box
+        rows = np.flatnonzero(~large)
+        counts = counts[rows]
+        pair_rows = np.repeat(rows, counts)
+        rank = np.arange(len(pair_rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+        width = np.repeat(spans[rows, 0], counts)
+        cx = np.repeat(low[rows, 0], counts) + rank % width
+        cy = np.repeat(low[rows, 1], counts) + rank // width
+        cells = cy * self._shape[0] + cx
+        order = np.argsort(cells, kind="stable")
+        self._cells, self._rows = cells[order], pair_rows[order]
+
+    def _cell_of(self, points: np.ndarray) -> np.ndarray:
+        cells = np.floor((points - self._origin) / self._size).astype(np.int64)
+        return np.clip(cells, 0, np.array(self._shape) - 1)
+
+    def _candidates(self, x0: float, y0: float, x1: float, y1: float) -> np.ndarray:
+        (cx0, cy0), (cx1, cy1) = self._cell_of(np.array([[x0, y0], [x1, y1]]))
+        # Large and moved boxes are always candidates, the others come from the rows
+        # of cells covered by the rectangle
+        moved = np.fromiter(self._moved, np.int64, len(self._moved))
+        candidates = [self._large, moved]
+        if len(self._cells):
+            cells = np.arange(cy0, cy1 + 1) * self._shape[0]
+            lo = np.searchsorted(self._cells, cells + cx0)
+            hi = np.searchsorted(self._cells, cells + cx1, side="right")
+            candidates.extend(self._rows[a:b] for a, b in zip(lo, hi))
+        return np.unique(np.concatenate(candidates))
+
+
+class ShapeIndex(QObject):
+    """Spatial queries on the shapes of a sample, for hit-testing and culling.
+
+    The shapes of the `ShapeLayer` are identified by their row, the region of the
+    sample, if any, by -1. Candidates are found on the bounding boxes with a
+    `GridIndex`, `at` then tests the exact outline of every candidate. Call
+    `update_region` when the region is moved, the index is updated in place.
+    """
+
+    REGION = -1
+
+    def __init__(
+        self,
+        layer: ShapeLayer,
+        region: Optional[np.ndarray] = None,
+        parent: Optional[QObject] = None,
+    ) -> None:
+        super().__init__(parent)
+        self._layer = layer
+        self._region = region
+        bounds = layer.bounds()
+        if region is not None:
+            bounds = np.concatenate([bounds, self._outline_bounds(region)[None]])
+        self._grid = GridIndex(bounds)
+
+    def update_region(self, region: np.ndarray) -> None:
+        """Move the region to the given outline"""
+        if self._region is None:
+            return
+        self._region = region
+        self._grid.update(len(self._layer), self._outline_bounds(region))
+
+    @Slot(float, float, float, result="QVariantList")
+    def at(self, x: float, y: float, tolerance: float = 0.0) -> List[int]:
+        """The shapes under a point, within `tolerance` from their outline"""
+        t = tolerance
+        ids = self._grid.rect(x - t, y - t, x + t, y + t)
+        return [self._id(i) for i in ids if self._hit(i, x, y, tolerance)]
+
+    @Slot(float, float, float, float, result="QVariantList")
+    def inRect(self, x0: float, y0: float, x1: float, y1: float) -> List[int]:
+        """The shapes whose bounding box intersects a rectangle, e.g. the viewport"""
+        return [self._id(i) for i in self._grid.rect(x0, y0, x1, y1)]
+
+    @Slot(float, float, int, result="QVariantList")
+    def nearest(self, x: float, y: float, k: int) -> List[int]:
+        """The `k` shapes whose bounding box is closest to a point, closest first"""
+        return [self._id(i) for i in self._grid.nearest(x, y, k)]
+
+    def _id(self, row: int) -> int:
+        return self.REGION if row == len(self._layer) else int(row)
+
+    def _outline(self, row: int) -> np.ndarray:
+        return self._region if row == len(self._layer) else self._layer.points(row)
+
+    def _outline_bounds(self, outline: np.ndarray) -> np.ndarray:
+        return np.concatenate([outline.min(axis=0), outline.max(axis=0)])
+
+    def _hit(self, row: int, x: float, y: float, tolerance: float) -> bool:
+        outline = self._outline(row)
+        if len(outline) == 0:
+            return False
+        if len(outline) < 3:
+            return bool(np.hypot(*(outline - (x, y)).T).min() <= tolerance)
+
+        # Crossing number, plus the distance from the edges for the tolerance
+        a, b = outline, np.roll(outline, -1, axis=0)
+        crosses = (a[:, 1] > y) != (b[:, 1] > y)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            at_x = a[:, 0] + (y - a[:, 1]) * (b[:, 0] - a[:, 0]) / (b[:, 1] - a[:, 1])
+        if np.count_nonzero(crosses & (x < at_x)) % 2 == 1:
+            return True
+        if tolerance <= 0:
+            return False
+        edge = b - a
+        length = np.maximum((edge**2).sum(axis=1), 1e-12)
+        t = np.clip(((np.array([x, y]) - a) * edge).sum(axis=1) / length, 0, 1)
+        closest = a + edge * t[:, None]
+        return bool(np.hypot(*(closest - (x, y)).T).min() <= tolerance)
+
+
+def box_outline(x: float, y: float, w: float, h: float, angle: float) -> np.ndarray:
+    """The four corners of an oriented box"""
+    corners = np.array([[-w, -h], [w, -h], [w, h], [-w, h]]) / 2
+    cos, sin = math.cos(angle), math.sin(angle)
+    rotation = np.array([[cos, sin], [-sin, cos]])
+    return corners @ rotation + (x, y)
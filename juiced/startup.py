@@ -0,0 +1,132 @@
+from __future__ import annotations
+
+import importlib
+import sys
+from pathlib import Path
+from threading import Thread
+from traceback import print_exc
+from typing import TYPE_CHECKING, Any, Dict, Optional, Sequence, Tuple
+
+from PySide6.QtCore import QObject, QUrl, Signal, Slot
+from PySide6.QtQml import QQmlApplicationEngine
+from PySide6.QtWidgets import QApplication
+
+if TYPE_CHECKING:
+    from juiced.cli import StartupProfile
+
+this_folder = Path(__file__).parent
+
+# Imported in background in this order, the heaviest dependencies first, so that the
+# profile of the startup shows their cost one by one. "juiced.main" imports all the
+# rest of juiced
+LAZY_MODULES = (
+    "numpy",
+    "PIL.Image",
+    "yaml",
+    "pydantic",
+    "pydash",
+    "choixe.configurations",
+    "pipelime.sequences.streams.underfolder",
+    "juiced.main",
+)
+
+
+class Launcher(QObject):
+    """Shows a splash at once, then sets up the app without blocking it.
+
+    After the first frame of the splash a thread imports `LAZY_MODULES`, loads the
+    configuration and opens the stream of the first dataset, which lists all its
+    files. Then, on the GUI thread, `juiced.main.setup` creates the scene and loads
+    the main window, whose own splash replaces this one. With `print_profile` the
+    `StartupProfile` is printed once the main window is loaded.
+    """
+
+    resolved = Signal(object, object)
+    failed = Signal()
+
+    def __init__(
+        self,
+        app: QApplication,
+        input_folder: Sequence[Path],
+        profile: StartupProfile,
+        print_profile: bool = False,
+        parent: Optional[QObject] = None,
+    ) -> None:
+        super().__init__(parent)
+        self._app = app
+        self._input_folder = list(input_folder)
+        self._profile = profile
+        self._print_profile = print_profile
+        self._thread: Optional[Thread] = None
+        self._engine: Optional[QQmlApplicationEngine] = None
+        self.resolved.connect(self._setup)
+        self.failed.connect(self._fail)
+
+        self._splash = QQmlApplicationEngine()
+        self._splash.load(QUrl.fromLocalFile(str(this_folder / "qml" / "Startup.qml")))
+        for window in self._splash.rootObjects():
+            window.frameSwapped.connect(self._start)
+
+    def close(self) -> None:
+        """Release the engine of the main window, call after the event loop"""
+        self._engine = None
+
+    @Slot()
+    def _start(self) -> None:
+        if self._thread is not None:
+            return
+        self._profile.mark("first frame")
+        self._thread = Thread(target=self._resolve, daemon=True)
+        self._thread.start()
+
+    def _resolve(self) -> None:
+        try:
+            for name in LAZY_MODULES:
+                with self._profile.stage(f"import {name}"):
+                    importlib.import_module(name)
+            with self._profile.stage("load config"):
+                config = sys.modules["juiced.main"].load_config()
+            with self._profile.stage("open first dataset"):
+                path = self._input_folder[0]
+                streams = {path: sys.modules["juiced.scene"].open_stream(path)}
+        except Exception:
+            print_exc()
+            self.failed.emit()
+            return
+        self.resolved.emit(config, streams)
+
+    @Slot(object, object)
+    def _setup(
+        self, config: Dict[str, Any], streams: Dict[Path, Tuple[Any, Path]]
+    ) -> None:
+        from juiced.main import setup
+
+        try:
+            with self._profile.stage("setup scene and main window"):
+                self._engine = QQmlApplicationEngine()
+                setup(self._app, self._engine, config, self._input_folder, streams)
+        except Exception:
+            print_exc()
+            self._fail()
+            return
+        for window in self._splash.rootObjects():
+            window.close()
+        self._splash.deleteLater()
+        self._profile.mark("main window loaded")
+        if self._print_profile:
+            self._profile.print()
+
+    @Slot()
+    def _fail(self) -> None:
+        self._app.exit(1)
+
+
+def run(input_folder: Sequence[Path], profile: StartupProfile, verbose: bool) -> int:
+    """Run the app, returns its exit code. With `verbose` print the profile"""
+    with profile.stage("create application"):
+        app = QApplication(sys.argv)
+    with profile.stage("show splash"):
+        launcher = Launcher(app, input_folder, profile, print_profile=verbose)
+    exit_code = app.exec()
+    launcher.close()
+    return exit_code
@@ -0,0 +1,222 @@
+from __future__ import annotations
+
+import math
+from typing import Any, Dict, List, Optional, Set
+
+import numpy as np
+from PySide6.QtCore import (
+    Property,
+    QAbstractListModel,
+    QByteArray,
+    QModelIndex,
+    QObject,
+    Qt,
+    QTimer,
+    Signal,
+)
+
+from juiced.criterion import Criterion
+from juiced.labels import LabelStore
+
+
+class Histogram:
+    """The value counts of a single criterion.
+
+    "choice", "bool" and "int" values are counted one by one, "range" values in
+    `bins` bins of equal width. Values that fall outside the criterion domain are
+    counted in an extra "other" bin, the last one.
+    """
+
+    def __init__(self, criterion: Criterion, bins: int = 10) -> None:
+        self._type = criterion.type
+        data = criterion.data
+        if self._type == "choice":
+            self._labels = [str(x) for x in data.get("choices", [])]
+        elif self._type == "bool":
+            self._labels = ["false", "true"]
+        elif self._type == "int":
+            self._low = int(data.get("from", 0))
+            high = int(data.get("to", 0))
+            self._labels = [str(x) for x in range(self._low, high + 1)]
+        elif self._type == "range":
+            self._low = float(data.get("from", 0.0))
+            high = float(data.get("to", 1.0))
+            step = data.get("step")
+            if high == self._low:
+                # A single value, binned without dividing by the width
+                bins = 1
+            elif step:
+                bins = max(1, min(bins, round((high - self._low) / float(step))))
+            self._width = (high - self._low) / bins
+            edges = [self._low + i * self._width for i in range(bins + 1)]
+            self._labels = [f"{a:.3g}-{b:.3g}" for a, b in zip(edges, edges[1:])]
+        else:
+            self._labels = []
+        self._other = len(self._labels)
+        self._labels.append("other")
+        self.counts = np.zeros(len(self._labels), dtype=np.int64)
+
+    @property
+    def labels(self) -> List[str]:
+        return self._labels
+
+    @property
+    def other(self) -> int:
+        """The index of the bin of the values outside the domain"""
+        return self._other
+
+    def bin(self, value: Any) -> int:
+        """The bin of a single value"""
+        try:
+            if self._type == "choice":
+                index = self._labels.index(str(value), 0, self._other)
+            elif self._type == "bool":
+                index = int(value) if isinstance(value, (bool, np.bool_)) else -1
+            elif self._type == "int" and not isinstance(value, bool):
+                index = int(value) - self._low if int(value) == value else -1
+            elif self._type == "range" and not isinstance(value, bool):
+                # The upper bound of the domain belongs to the last bin
+                value = float(value)
+                if value == self._low + self._width * self._other:
+                    index = self._other - 1
+                else:
+                    index = math.floor((value - self._low) / self._width)
+            else:
+                index = -1
+        except (TypeError, ValueError, OverflowError, ZeroDivisionError):
+            index = -1
+        return index if 0 <= index < self._other else self._other
+
+    def bins(self, store: LabelStore, name: str, start: int, stop: int) -> np.ndarray:
+        """The bins of the labels of consecutive samples, computed on the column"""
+        column = store.column(name)
+        if column is None:
+            return np.full(stop - start, self._other, dtype=np.int64)
+        values = column[start:stop]
+        if self._type in ("choice", "bool"):
+            index = values.astype(np.int64)
+        elif self._type == "int":
+            index = values.astype(np.int64) - self._low
+        elif self._type == "range":
+            if self._width:
+                index = np.floor((values - self._low) / self._width)
+            else:
+                index = np.full(len(values), -1.0)
+            high = self._low + self._width * self._other
+            index = np.where(values == high, self._other - 1, index)
+            index = np.nan_to_num(index, nan=-1, posinf=-1, neginf=-1)
+            index = index.astype(np.int64)
+        else:
+            index = np.full(stop - start, -1, dtype=np.int64)
+        index[(index < 0) | (index >= self._other)] = self._other
+
+        # Overflow entries of the column are meaningless, their value is binned
+        for idx, value in store.overflow(name).items():
+            if start <= idx < stop:
+                index[idx - start] = self.bin(value)
+        return index
+
+    def add(self, index: np.ndarray) -> None:
+        self.counts += np.bincount(index, minlength=len(self.counts))
+
+    def update(self, old: Any, new: Any) -> None:
+        self.counts[self.bin(old)] -= 1
+        self.counts[self.bin(new)] += 1
+
+
+class LabelStatistics(QAbstractListModel):
+    """Live per-criterion histograms of the labels of a dataset.
+
+    Histograms are updated incrementally: `add` counts the labels of newly loaded
+    samples with vectorised operations on the columns of the `LabelStore`, and
+    `update` moves a single edited label between bins in O(1), so the dataset is
+    never rescanned. Every row of the model is a criterion, views are notified of
+    changes at most every `interval_ms` milliseconds.
+    """
+
+    NameRole = Qt.UserRole + 1
+    TypeRole = Qt.UserRole + 2
+    BinsRole = Qt.UserRole + 3
+    CountsRole = Qt.UserRole + 4
+
+    totalChanged = Signal()
+
+    def __init__(
+        self,
+        store: LabelStore,
+        bins: int = 10,
+        interval_ms: int = 100,
+        parent: Optional[QObject] = None,
+    ) -> None:
+        super().__init__(parent)
+        self._store = store
+        self._names = store.names
+        self._rows = {name: i for i, name in enumerate(self._names)}
+        self._histograms: Dict[str, Histogram] = {
+            name: Histogram(store.criterion(name), bins) for name in self._names
+        }
+        self._total = 0
+
+        self._dirty: Set[int] = set()
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(interval_ms)
+        self._timer.timeout.connect(self._notify)
+
+    def histogram(self, name: str) -> Histogram:
+        return self._histograms[name]
+
+    def add(self, start: int, stop: int) -> None:
+        """Count the labels of the samples from `start` to `stop`, once loaded"""
+        for name, histogram in self._histograms.items():
+            histogram.add(histogram.bins(self._store, name, start, stop))
+        self._total += stop - start
+        self._dirty.update(range(len(self._names)))
+        self._timer.start()
+
+    def update(self, idx: int, name: str, old: Any, new: Any) -> None:
+        """Move an edited label from the bin of its old value to the new one"""
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            return
+        histogram.update(old, new)
+        self._dirty.add(self._rows[name])
+        if not self._timer.isActive():
+            self._timer.start()
+
+    def _notify(self) -> None:
+        for row in sorted(self._dirty):
+            self.dataChanged.emit(self.index(row), self.index(row))
+        self._dirty.clear()
+        self.totalChanged.emit()
+
+    def roleNames(self) -> Dict[int, QByteArray]:
+        return {
+            self.NameRole: QByteArray(b"name"),
+            self.TypeRole: QByteArray(b"type"),
+            self.BinsRole: QByteArray(b"bins"),
+            self.CountsRole: QByteArray(b"counts"),
+        }
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self._names)
+
+    def data(self, index: QModelIndex, role: int = Qt.DisplayRole) -> Any:
+        if not index.isValid() or not 0 <= index.row() < len(self._names):
+            return None
+        name = self._names[index.row()]
+        histogram = self._histograms[name]
+        if role in (self.NameRole, Qt.DisplayRole):
+            return name
+        elif role == self.TypeRole:
+            return self._store.criterion(name).type
+        elif role == self.BinsRole:
+            return histogram.labels
+        elif role == self.CountsRole:
+            return histogram.counts.tolist()
+        return None
+
+    @Property(int, notify=totalChanged)
+    def total(self) -> int:
+        """The number of samples counted so far"""
+        return self._total
@@ -0,0 +1,251 @@
+from __future__ import annotations
+
+import json
+import mmap
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from threading import Lock
+from traceback import print_exc
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from PySide6.QtCore import QSize, Qt
+from PySide6.QtGui import QImage
+from PySide6.QtQml import QQmlImageProviderBase
+from PySide6.QtQuick import QQuickImageProvider
+
+from juiced.conversion import array_to_qimage
+
+if TYPE_CHECKING:
+    from juiced.image_provider import PipelimeImageProvider
+
+
+class ThumbnailStore:
+    """A persistent store of uint8 RGB thumbnails.
+
+    All thumbnails are appended to a single blob file, which is memory mapped for
+    reading, and located through an index of offsets saved as json next to it.
+    Thumbnails are identified by an arbitrary string key, e.g. the path, mtime and
+    size of the source file, and optionally by a source, e.g. the path only: a new
+    thumbnail of a source replaces the previous one. The space of the replaced
+    thumbnails is reclaimed when the store is opened, once it is more than
+    `max_garbage` of the blob file.
+    """
+
+    BLOB_FILE = "thumbnails.bin"
+    INDEX_FILE = "thumbnails.json"
+
+    def __init__(
+        self, folder: Path, autosave: int = 256, max_garbage: float = 0.5
+    ) -> None:
+        self._folder = Path(folder)
+        self._folder.mkdir(parents=True, exist_ok=True)
+        self._autosave = autosave
+        self._unsaved = 0
+        self._lock = Lock()
+
+        # Offset, width, height and optionally the source of every thumbnail
+        self._index: Dict[str, List[Any]] = {}
+        index_path = self._folder / self.INDEX_FILE
+        if index_path.exists():
+            try:
+                self._index = json.loads(index_path.read_text())
+            except Exception:
+                print_exc()
+        self._sources = {e[3]: k for k, e in self._index.items() if len(e) > 3}
+
+        blob_path = self._folder / self.BLOB_FILE
+        size = blob_path.stat().st_size if blob_path.exists() else 0
+        used = sum(e[1] * e[2] * 3 for e in self._index.values())
+        if size > 0 and size - used > size * max_garbage:
+            try:
+                self._compact()
+            except Exception:
+                print_exc()
+
+        self._blob = open(blob_path, "ab+")
+        self._mmap: Optional[mmap.mmap] = None
+        self._mapped = 0
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """A read-only view on the thumbnail, or None if missing"""
+        entry = self._index.get(key)
+        if entry is None:
+            return None
+        offset, width, height = entry[:3]
+        nbytes = width * height * 3
+        with self._lock:
+            if offset + nbytes > self._mapped:
+                self._remap()
+            buffer = self._mmap
+        array = np.frombuffer(buffer, dtype=np.uint8, count=nbytes, offset=offset)
+        return array.reshape(height, width, 3)
+
+    def put(self, key: str, array: np.ndarray, source: Optional[str] = None) -> None:
+        """Append an HxWx3 uint8 thumbnail, replacing the previous one of `source`"""
+        height, width = array.shape[:2]
+        data = np.ascontiguousarray(array, dtype=np.uint8).tobytes()
+        with self._lock:
+            self._blob.seek(0, os.SEEK_END)
+            offset = self._blob.tell()
+            self._blob.write(data)
+            self._blob.flush()
+            self._index[key] = [offset, width, height]
+            if source is not None:
+                self._index[key].append(source)
+                previous = self._sources.get(source)
+                if previous is not None and previous != key:
+                    self._index.pop(previous, None)
+                self._sources[source] = key
+            self._unsaved += 1
+            if self._unsaved >= self._autosave:
+                self._save()
+
+    def save(self) -> None:
+        """Write the index to disk"""
+        with self._lock:
+            self._save()
+
+    def _save(self) -> None:
+        path = self._folder / self.INDEX_FILE
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self._index))
+        tmp.replace(path)
+        self._unsaved = 0
+
+    def _compact(self) -> None:
+        # Copy the thumbnails still indexed to a new blob file, before any is mapped
+        blob_path = self._folder / self.BLOB_FILE
+        tmp = blob_path.with_suffix(".tmp")
+        with open(blob_path, "rb") as src, open(tmp, "wb") as dst:
+            for entry in self._index.values():
+                src.seek(entry[0])
+                data = src.read(entry[1] * entry[2] * 3)
+                entry[0] = dst.tell()
+                dst.write(data)
+        # Without the index, a crash leaves an empty store rather than a wrong one
+        (self._folder / self.INDEX_FILE).unlink(missing_ok=True)
+        tmp.replace(blob_path)
+        self._save()
+
+    def _remap(self) -> None:
+        # Views on the previous map may still be alive, so it is never closed
+        # explicitly: it is released when the last view is garbage collected
+        size = os.fstat(self._blob.fileno()).st_size
+        if size > 0:
+            self._mmap = mmap.mmap(self._blob.fileno(), size, access=mmap.ACCESS_READ)
+            self._mapped = size
+
+
+class ThumbnailImageProvider(QQuickImageProvider):
+    """QQuickImageProvider for thumbnails of pipelime dataset images.
+
+    Urls are the same as `PipelimeImageProvider`, and are decoded through it at
+    reduced resolution. Thumbnails of files are saved to a persistent
+    `ThumbnailStore`, keyed by path, mtime and size of the source file, so that
+    reopening a dataset needs no decoding at all. The keys are computed once per
+    url, until the dataset is filled again. Images are decoded with
+    `PipelimeImageProvider.decode`, so that thumbnails never evict full images from
+    its cache. Use `fill` to generate all the thumbnails of a dataset in
+    background::
+
+        provider = ThumbnailImageProvider(PipelimeImageProvider.get_instance(), folder)
+        engine.addImageProvider("thumbnails", PipelimeAsyncImageProvider(provider))
+        provider.fill("my_underfolder", "image")
+
+    """
+
+    def __init__(
+        self,
+        source: PipelimeImageProvider,
+        folder: Path,
+        size: int = 128,
+        workers: int = 4,
+    ) -> None:
+        super().__init__(QQmlImageProviderBase.ImageType.Image)
+        self._source = source
+        self._store = ThumbnailStore(folder)
+        self._size = size
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="thumbnails")
+        # Store key and source of every url
+        self._keys: Dict[str, Tuple[Optional[str], Optional[str]]] = {}
+        self._keys_lock = Lock()
+
+    @property
+    def store(self) -> ThumbnailStore:
+        return self._store
+
+    def fill(self, dataset: str, key: str) -> None:
+        """Generate in background all the missing thumbnails of a dataset"""
+        prefix = f"{dataset}/"
+        with self._keys_lock:
+            for id_ in [k for k in self._keys if k.startswith(prefix)]:
+                del self._keys[id_]
+        for idx in range(self._source.dataset_length(dataset)):
+            self._executor.submit(self._fill_one, f"{dataset}/{idx}/{key}")
+
+    def close(self) -> None:
+        """Stop the background generation and save the store index"""
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._store.save()
+
+    def _fill_one(self, id_: str) -> None:
+        store_key, _ = self._store_key(id_)
+        if store_key is not None and store_key not in self._store:
+            self.requestImage(id_, QSize(), QSize())
+
+    def _store_key(self, id_: str) -> Tuple[Optional[str], Optional[str]]:
+        # The key in the store and the source it replaces thumbnails of
+        with self._keys_lock:
+            keys = self._keys.get(id_)
+        if keys is not None:
+            return keys
+        try:
+            stamp = self._source.item_stamp(id_)
+            path = self._source.item_path(id_)
+        except Exception:
+            return None, None
+        query = id_.partition("?")[2]
+        keys = (
+            None if stamp is None else f"{stamp}:{self._size}",
+            None if path is None else f"{path.resolve()}?{query}:{self._size}",
+        )
+        with self._keys_lock:
+            self._keys[id_] = keys
+        return keys
+
+    def _to_array(self, qimg: QImage) -> np.ndarray:
+        qimg = qimg.convertToFormat(QImage.Format_RGB888)
+        width, height, stride = qimg.width(), qimg.height(), qimg.bytesPerLine()
+        rows = np.frombuffer(qimg.constBits(), np.uint8, count=height * stride)
+        return rows.reshape(height, stride)[:, : width * 3].reshape(height, width, 3)
+
+    def requestImage(self, id: str, size: QSize, requestedSize: QSize) -> QImage:
+        store_key, source = self._store_key(id)
+        if store_key is not None:
+            array = self._store.get(store_key)
+            if array is not None:
+                size.setWidth(array.shape[1])
+                size.setHeight(array.shape[0])
+                return array_to_qimage(array)
+
+        target = QSize(self._size, self._size)
+        try:
+            qimg, _ = self._source.decode(id, target)
+        except Exception:
+            print_exc()
+            return self._source.placeholder()
+        qimg = qimg.scaled(target, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        array = self._to_array(qimg)
+        if store_key is not None:
+            self._store.put(store_key, array, source)
+        size.setWidth(array.shape[1])
+        size.setHeight(array.shape[0])
+        return array_to_qimage(array.copy())
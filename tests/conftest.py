@@ -0,0 +1,53 @@
+import os
+import shutil
+from pathlib import Path
+
+import pytest
+
+# No display is needed, must be set before Qt is imported
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+MINIMNIST = Path(__file__).parents[1] / "juiced" / "minimnist"
+
+
+@pytest.fixture(scope="session")
+def qapp():
+    from PySide6.QtGui import QGuiApplication
+
+    return QGuiApplication.instance() or QGuiApplication([])
+
+
+@pytest.fixture()
+def minimnist(tmp_path: Path) -> Path:
+    """A writable copy of the minimnist underfolder"""
+    return Path(shutil.copytree(MINIMNIST, tmp_path / "minimnist"))
+
+
+@pytest.fixture()
+def scene(qapp, minimnist):
+    """A scene on minimnist, with metadata loaded on threads and no quiet period"""
+    from juiced.image_provider import PipelimeImageProvider
+    from juiced.loading import MetadataLoader
+    from juiced.persistence import WriteBehind
+    from juiced.scene import Scene
+
+    scene = Scene(
+        minimnist,
+        loader_factory=lambda: MetadataLoader(processes=False),
+        writer_factory=lambda: WriteBehind(quiet_ms=0),
+    )
+    yield scene
+    scene.close()
+    for name in scene.names:
+        PipelimeImageProvider.get_instance().remove_dataset(name)
+
+
+def wait(qapp, done, timeout: float = 10.0) -> None:
+    """Process events until `done` returns True"""
+    import time
+
+    deadline = time.monotonic() + timeout
+    while not done():
+        assert time.monotonic() < deadline, "Timed out"
+        qapp.processEvents()
+        time.sleep(0.001)
@@ -0,0 +1,71 @@
+import io
+import zipfile
+
+import numpy as np
+import pytest
+import yaml
+
+from juiced.archive import ArchiveIndex, ArchiveStream
+
+
+@pytest.fixture()
+def archive(tmp_path):
+    path = tmp_path / "dataset.zip"
+    with zipfile.ZipFile(path, "w") as zf:
+        zf.writestr("dataset/criteria.yml", yaml.safe_dump([{"name": "ok"}]))
+        for idx in range(3):
+            metadata = yaml.safe_dump({"sample_idx": idx})
+            zf.writestr(
+                f"dataset/data/{idx:06d}_metadata.yml",
+                metadata,
+                compress_type=zipfile.ZIP_DEFLATED,
+            )
+            buffer = io.BytesIO()
+            np.save(buffer, np.full((2, 3), idx, dtype=np.uint16))
+            zf.writestr(f"dataset/data/{idx:06d}_depth.npy", buffer.getvalue())
+    return path
+
+
+def test_offset_index(archive):
+    index = ArchiveIndex(archive)
+    assert len(index) == 3
+    assert set(index.items(1)) == {"metadata", "depth"}
+    assert set(index.items(-1)) == {"criteria"}
+    assert archive.with_name("dataset.zip.index.npy").exists()
+    # Reopened from the saved index
+    assert ArchiveIndex(archive).items(2) == index.items(2)
+
+
+def test_read(archive):
+    stream = ArchiveStream(archive)
+    try:
+        assert len(stream) == 3
+        assert stream.keys(0) == ["criteria", "depth", "metadata"]
+        assert stream.get_data(2, "metadata")[0] == {"sample_idx": 2}
+        depth = stream.array(1, "depth")
+        assert depth.dtype == np.uint16 and (depth == 1).all()
+        with pytest.raises(KeyError):
+            stream.read(0, "missing")
+    finally:
+        stream.close()
+
+
+def test_overlay(archive):
+    stream = ArchiveStream(archive)
+    stamp = stream.stamp(0, "metadata")
+    stream.set_data(0, "metadata", {"sample_idx": 10}, "dict")
+    stream.set_data(0, "metadata", {"sample_idx": 20}, "dict")
+    assert stream.get_data(0, "metadata") == ({"sample_idx": 20}, ".yml")
+    assert stream.stamp(0, "metadata") != stamp
+    # Edited arrays are no longer mapped
+    stream.set_data(0, "depth", np.zeros((2, 3), dtype=np.uint16))
+    assert stream.array(0, "depth") is None
+    stream.close()
+
+    stream = ArchiveStream(archive)
+    try:
+        assert stream.get_data(0, "metadata")[0] == {"sample_idx": 20}
+        assert stream.get_data(1, "metadata")[0] == {"sample_idx": 1}
+        assert (stream.get_data(0, "depth")[0] == 0).all()
+    finally:
+        stream.close()
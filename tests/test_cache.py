@@ -0,0 +1,41 @@
+from juiced.cache import LRUCache
+
+
+def test_byte_budget():
+    cache = LRUCache(100)
+    cache.put("a/0", "x", 40)
+    cache.put("a/1", "y", 40)
+    assert cache.size == 80
+    cache.get("a/0")
+    cache.put("a/2", "z", 40)
+    # The least recently used entry is evicted
+    assert "a/1" not in cache
+    assert cache.size == 80
+    cache.put("a/3", "big", 101)
+    assert "a/3" not in cache
+    assert (cache.hits, cache.misses) == (1, 0)
+
+
+def test_fair_eviction_between_namespaces():
+    cache = LRUCache(100)
+    for i in range(4):
+        cache.put(f"a/{i}", i, 20)
+    cache.put("b/0", 0, 20)
+    cache.put("b/1", 1, 20)
+    # "a" uses more memory, so it makes room for "b"
+    assert "a/0" not in cache
+    assert "b/0" in cache and "b/1" in cache
+    assert cache.usage("a") == 60
+    assert cache.usage("b") == 40
+
+
+def test_invalidate():
+    cache = LRUCache(100)
+    cache.put("a/0", 0, 10)
+    cache.put("a/1", 1, 10)
+    cache.put("b/0", 0, 10)
+    cache.invalidate_where("a", lambda key, value: value == 1)
+    assert "a/1" not in cache and "a/0" in cache
+    cache.invalidate("a")
+    assert cache.namespaces == ["b"]
+    assert cache.size == 10
@@ -0,0 +1,39 @@
+from juiced.journal import EditJournal
+
+
+def test_undo_redo(tmp_path):
+    journal = EditJournal(tmp_path, merge_ms=0)
+    journal.record(0, "metadata", "labels.digit", 1, 2)
+    journal.record(0, "metadata", "labels.digit", 2, 3)
+    entry = journal.undo()
+    assert (entry["key"], entry["old"], entry["new"]) == ("labels.digit", 3, 2)
+    assert journal.redo()["new"] == 3
+    assert journal.redo() is None
+    assert [e["new"] for e in journal.entries()] == [2, 3, 2, 3]
+    journal.close()
+
+
+def test_merged_edits(tmp_path):
+    journal = EditJournal(tmp_path, merge_ms=60_000)
+    journal.record(0, "metadata", "shape", {"x": 0}, {"x": 1})
+    journal.record(0, "metadata", "shape", {"x": 1}, {"x": 2})
+    assert journal.undo()["new"] == {"x": 0}
+    assert not journal.can_undo
+    journal.close()
+
+
+def test_replay_after_crash(tmp_path):
+    journal = EditJournal(tmp_path)
+    journal.record(0, "metadata", "labels.digit", 1, 2)
+    journal.record(1, "metadata", "labels.color", "blue", "green")
+    # A crash leaves the lock and a truncated last line
+    journal._file.write('{"sample": 2, "item": "meta')
+    journal._file.flush()
+    journal._file.close()
+
+    recovered = EditJournal(tmp_path)
+    assert recovered.unclean
+    entries = recovered.entries()
+    assert [(e["sample"], e["new"]) for e in entries] == [(0, 2), (1, "green")]
+    recovered.close()
+    assert not EditJournal(tmp_path).unclean
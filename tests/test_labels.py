@@ -0,0 +1,47 @@
+import numpy as np
+
+from juiced.criterion import Criterion
+from juiced.labels import LabelStore
+
+CRITERIA = [
+    Criterion(
+        name="color", type="choice", default="blue", data={"choices": ["blue", "red"]}
+    ),
+    Criterion(name="ok", type="bool", default=False),
+    Criterion(name="digit", type="int", default="zero"),
+    Criterion(name="beauty", type="range", default=0.5),
+]
+
+
+def test_round_trip():
+    rows = [
+        {"color": "red", "ok": True, "digit": 3, "beauty": 0.1},
+        {"color": "blue", "ok": False, "digit": 7, "beauty": 1},
+    ]
+    store = LabelStore(CRITERIA, 2)
+    missing = store.load(0, rows)
+    assert not missing.any()
+    assert [store.row(i) for i in range(2)] == rows
+    assert store.column("color").tolist() == [1, 0]
+    assert store.column("digit").dtype == np.int32
+
+
+def test_defaults_and_overflow():
+    store = LabelStore(CRITERIA, 2)
+    missing = store.load(0, [{"color": "green"}, None])
+    assert missing.tolist() == [True, True]
+    # Values that do not fit a column are kept as they are
+    assert store.get(0, "color") == "green"
+    assert store.get(1, "color") == "blue"
+    assert store.get(1, "digit") == "zero"
+    assert store.overflow("digit") == {0: "zero", 1: "zero"}
+
+
+def test_set():
+    changes = []
+    store = LabelStore(CRITERIA, 1, on_set=lambda *args: changes.append(args))
+    store.load(0, [{"color": "blue", "ok": False, "digit": 1, "beauty": 0.5}])
+    store.set(0, "digit", 2)
+    store.set(0, "digit", "two")
+    assert store.get(0, "digit") == "two"
+    assert changes == [(0, "digit", 1, 2), (0, "digit", 2, "two")]
@@ -0,0 +1,48 @@
+from threading import Event
+
+import numpy as np
+
+from juiced.normalization import Normalizer
+
+
+def test_window_update_is_notified_per_item(tmp_path):
+    updates = []
+    done = Event()
+    normalizer = Normalizer(on_update=lambda *args: (updates.append(args), done.set()))
+    normalizer.set_sidecar("data", tmp_path / "statistics.json")
+    arrays = [np.full((4, 4), i, dtype=np.uint16) for i in range(8)]
+    normalizer.normalize(arrays[0], "data", "depth", arrays.__getitem__, len(arrays))
+    assert done.wait(10)
+    assert updates == [("data", "depth", "uint16")]
+    assert (tmp_path / "statistics.json").exists()
+
+
+def test_removed_dataset_pass_is_discarded(tmp_path):
+    updates = []
+    release = Event()
+
+    def reader(idx):
+        release.wait(10)
+        return np.full((4, 4), idx, dtype=np.uint16)
+
+    normalizer = Normalizer(on_update=lambda *args: updates.append(args))
+    normalizer.set_sidecar("data", tmp_path / "statistics.json")
+    normalizer.normalize(np.zeros((4, 4), np.uint16), "data", "depth", reader, 8)
+    (thread,) = normalizer._pending.values()
+    normalizer.remove("data")
+    release.set()
+    thread.join(10)
+    assert updates == []
+    assert not (tmp_path / "statistics.json").exists()
+
+
+def test_lookup_tables_are_cached_per_window():
+    normalizer = Normalizer(max_luts=1)
+    array = np.arange(16, dtype=np.uint16).reshape(4, 4)
+    first = normalizer.apply(array, (0.0, 15.0))
+    assert first[3, 3] == 255
+    assert normalizer._lut(array.dtype, (0.0, 15.0)) is normalizer._lut(
+        array.dtype, (0.0, 15.0)
+    )
+    normalizer.apply(array, (0.0, 30.0))
+    assert list(normalizer._luts) == [("uint16", (0.0, 30.0))]
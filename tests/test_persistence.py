@@ -0,0 +1,29 @@
+import os
+import signal
+
+from PySide6.QtCore import QTimer
+
+from juiced.persistence import install_signal_handlers, replace_file
+
+
+def test_replace_file_is_atomic(tmp_path):
+    path = tmp_path / "000000_metadata.yml"
+    path.write_text("old: 1\n")
+    path.chmod(0o644)
+    replace_file(path, b"new: 2\n")
+    assert path.read_text() == "new: 2\n"
+    assert path.stat().st_mode & 0o777 == 0o644
+    assert list(tmp_path.iterdir()) == [path]
+
+
+def test_signal_quits_the_event_loop(qapp):
+    previous = signal.getsignal(signal.SIGTERM)
+    try:
+        install_signal_handlers(qapp, (signal.SIGTERM,))
+        QTimer.singleShot(0, lambda: os.kill(os.getpid(), signal.SIGTERM))
+        # Fails by timeout if the signal is not handled
+        QTimer.singleShot(5000, lambda: qapp.exit(1))
+        assert qapp.exec() == 0
+    finally:
+        signal.signal(signal.SIGTERM, previous)
+        signal.set_wakeup_fd(-1)
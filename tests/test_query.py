@@ -0,0 +1,75 @@
+import pytest
+
+from juiced.criterion import Criterion
+from juiced.labels import LabelStore
+from juiced.query import QueryEngine
+
+CRITERIA = [
+    Criterion(
+        name="color", type="choice", default="blue", data={"choices": ["blue", "red"]}
+    ),
+    Criterion(name="digit", type="int", default=0, data={"from": 0, "to": 9}),
+    Criterion(name="beauty", type="range", default=0.5),
+]
+METADATA = [
+    {"labels": {"color": "red", "digit": 3}, "shape": {"type": "box", "w": 4}},
+    {"labels": {"color": "blue", "digit": 7}, "shape": {"type": "poly"}},
+    {"labels": {"digit": 1, "beauty": 0.9}, "split": "test"},
+]
+
+
+@pytest.fixture()
+def engine():
+    store = LabelStore(CRITERIA, len(METADATA))
+    store.load(0, [m["labels"] for m in METADATA])
+    engine = QueryEngine(store)
+    engine.add(0, METADATA)
+    return engine
+
+
+@pytest.mark.parametrize(
+    "query, expected",
+    [
+        ("", [0, 1, 2]),
+        ("color == red", [0]),
+        ("color == default", [1, 2]),
+        ("digit >= 3", [0, 1]),
+        ("digit in [1, 7]", [1, 2]),
+        ("not (color == blue) or beauty > 0.8", [0, 2]),
+        ("color == blue and digit < 5", [2]),
+        ("shape.type == box", [0]),
+        ("shape.w > 3", [0]),
+        ("shape.type != box", [1, 2]),
+        ("split == null", [0, 1]),
+        ("split in [test, train]", [2]),
+    ],
+)
+def test_matches(engine, query, expected):
+    assert engine.evaluate(query).tolist() == expected
+
+
+def test_edits_are_indexed(engine):
+    engine.update_label(2, "color", "blue", "red")
+    engine._store.set(2, "color", "red")
+    assert engine.evaluate("color == red").tolist() == [0, 2]
+    metadata = {"labels": {}, "shape": {"type": "box"}}
+    engine.update_metadata(1, "shape", metadata)
+    assert engine.evaluate("shape.type == box").tolist() == [0, 1]
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "color ==",
+        "color == red and",
+        "(color == red",
+        "color == red)",
+        "color ~ red",
+        "color < red",
+        "unknown == 1",
+        "shape.type == default",
+    ],
+)
+def test_errors(engine, query):
+    with pytest.raises(ValueError):
+        engine.evaluate(query)
@@ -0,0 +1,89 @@
+from PySide6.QtCore import QUrl
+from PySide6.QtQml import QQmlComponent, QQmlEngine
+
+from tests.conftest import wait
+
+
+def evaluate(scene, expression: str):
+    """Evaluate an expression in qml, with the scene as a context property"""
+    engine = QQmlEngine()
+    engine.rootContext().setContextProperty("scene", scene)
+    component = QQmlComponent(engine)
+    qml = f"import QtQml\nQtObject {{ property var value: {expression} }}"
+    component.setData(qml.encode(), QUrl())
+    obj = component.create()
+    assert obj is not None, component.errorString()
+    return obj.property("value")
+
+
+def test_samples_from_qml(qapp, scene):
+    dataset = scene.dataset
+    wait(qapp, lambda: dataset.ready)
+    assert evaluate(scene, "scene.dataset.samples.count") == len(dataset.samples)
+
+
+def test_selected_sample_is_never_released(qapp, scene):
+    samples = scene.dataset.samples
+    samples._pool_size = 2
+    samples.pinned = 0
+    selected = samples.get(0)
+    for idx in range(1, len(samples)):
+        samples.get(idx)
+    assert samples.is_alive(0)
+    assert samples.get(0) is selected
+
+
+def test_undo_updates_shape_index(qapp, scene):
+    dataset = scene.dataset
+    wait(qapp, lambda: dataset.ready)
+    sample = dataset.samples.get(0)
+    shape = sample.shape
+    index = sample.shapeIndex
+    x, y = shape.x, shape.y
+    assert -1 in index.at(x, y, 0.0)
+    shape.setGeometry(x + 100, y + 100, shape.w, shape.h, shape.angle)
+    assert -1 not in index.at(x, y, 0.0)
+    assert dataset.undo() == 0
+    assert (shape.x, shape.y) == (x, y)
+    assert -1 in index.at(x, y, 0.0)
+
+
+def test_image_size_is_read_in_background(qapp, scene):
+    sample = scene.dataset.samples.get(0)
+    notified = []
+    sample.imageSizeChanged.connect(lambda: notified.append(True))
+    if sample.imageSize.isEmpty():
+        wait(qapp, lambda: notified)
+    assert not sample.imageSize.isEmpty()
+
+
+def test_persisted_defaults_are_written_in_background(qapp, minimnist):
+    import yaml
+
+    from juiced.image_provider import PipelimeImageProvider
+    from juiced.loading import MetadataLoader
+    from juiced.persistence import WriteBehind
+    from juiced.scene import Scene
+
+    path = minimnist / "data" / "000003_metadata.yml"
+    metadata = yaml.safe_load(path.read_text())
+    del metadata["labels"]["color"]
+    path.write_text(yaml.safe_dump(metadata))
+
+    scene = Scene(
+        minimnist,
+        loader_factory=lambda: MetadataLoader(processes=False),
+        writer_factory=lambda: WriteBehind(quiet_ms=0),
+        defaults="persist",
+    )
+    try:
+        # Datasets are opened when first accessed
+        assert scene.dataset is not None
+        labels = lambda: yaml.safe_load(path.read_text())["labels"]  # noqa: E731
+        wait(qapp, lambda: "color" in labels())
+        assert labels()["color"] == "magenta"
+        assert metadata["shape"] == yaml.safe_load(path.read_text())["shape"]
+    finally:
+        scene.close()
+        for name in scene.names:
+            PipelimeImageProvider.get_instance().remove_dataset(name)
@@ -0,0 +1,71 @@
+import numpy as np
+
+from juiced.shapes import ShapeLayer
+from juiced.spatial import GridIndex, ShapeIndex, box_outline
+
+
+def random_boxes(n, seed=0):
+    rng = np.random.default_rng(seed)
+    low = rng.uniform(0, 1000, (n, 2))
+    size = rng.exponential(20, (n, 2))
+    # A few boxes spanning most of the grid
+    size[:3] = 800
+    return np.concatenate([low, low + size], axis=1)
+
+
+def brute_rect(bounds, x0, y0, x1, y1):
+    b = bounds
+    hit = (b[:, 0] <= x1) & (b[:, 2] >= x0) & (b[:, 1] <= y1) & (b[:, 3] >= y0)
+    return np.flatnonzero(hit)
+
+
+def test_queries_match_brute_force():
+    bounds = random_boxes(500)
+    index = GridIndex(bounds)
+    rng = np.random.default_rng(1)
+    for x, y in rng.uniform(-100, 1100, (50, 2)):
+        assert index.at(x, y).tolist() == brute_rect(bounds, x, y, x, y).tolist()
+        expected = brute_rect(bounds, x, y, x + 150, y + 80)
+        assert index.rect(x, y, x + 150, y + 80).tolist() == expected.tolist()
+        nearest = index.nearest(x, y, k=5)
+        distances = index._distances(np.arange(len(bounds)), x, y)
+        assert np.allclose(distances[nearest], np.sort(distances)[:5])
+
+
+def test_moved_boxes():
+    bounds = random_boxes(200)
+    index = GridIndex(bounds)
+    rng = np.random.default_rng(2)
+    for i in rng.choice(len(bounds), 100, replace=False):
+        x, y = rng.uniform(0, 1000, 2)
+        index.update(i, [x, y, x + 10, y + 10])
+        assert i in index.at(x + 5, y + 5)
+    for x, y in rng.uniform(0, 1000, (20, 2)):
+        expected = brute_rect(index.bounds, x, y, x + 50, y + 50)
+        assert index.rect(x, y, x + 50, y + 50).tolist() == expected.tolist()
+
+
+def test_empty():
+    index = GridIndex(np.zeros((0, 4)))
+    assert index.at(0, 0).tolist() == []
+    assert index.nearest(0, 0, k=3).tolist() == []
+
+
+def test_shape_index():
+    layer = ShapeLayer.from_list(
+        [
+            {"type": "polygon", "points": [[0, 0], [10, 0], [0, 10]]},
+            {"type": "keypoint", "x": 20, "y": 20},
+        ]
+    )
+    index = ShapeIndex(layer, box_outline(50, 50, 10, 10, 0.0))
+    assert index.at(2, 2, 0.0) == [0]
+    # Inside the bounding box, outside the triangle
+    assert index.at(9, 9, 0.0) == []
+    assert index.at(20.5, 20, 0.0) == []
+    assert index.at(20.5, 20, 1.0) == [1]
+    assert index.at(50, 50, 0.0) == [ShapeIndex.REGION]
+    index.update_region(box_outline(80, 80, 10, 10, 0.0))
+    assert index.at(50, 50, 0.0) == []
+    assert index.at(80, 80, 0.0) == [ShapeIndex.REGION]
+    assert index.nearest(21, 21, 1) == [1]
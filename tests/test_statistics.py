@@ -0,0 +1,24 @@
+import numpy as np
+
+from juiced.criterion import Criterion
+from juiced.labels import LabelStore
+from juiced.statistics import Histogram
+
+
+def test_range_histogram_bins():
+    criterion = Criterion(name="beauty", type="range", data={"from": 0, "to": 1})
+    histogram = Histogram(criterion, bins=4)
+    assert [histogram.bin(v) for v in (0.0, 0.3, 1.0, 2.0, "x")] == [0, 1, 3, 4, 4]
+
+
+def test_empty_range_histogram():
+    criterion = Criterion(name="beauty", type="range", data={"from": 1, "to": 1})
+    histogram = Histogram(criterion)
+    assert len(histogram.labels) == 2
+    assert [histogram.bin(v) for v in (1.0, 0.5, 2.0)] == [0, 1, 1]
+
+    store = LabelStore([criterion], 3)
+    store.load(0, [{"beauty": 1.0}, {"beauty": 0.5}, {"beauty": 2.0}])
+    assert histogram.bins(store, "beauty", 0, 3).tolist() == [0, 1, 1]
+    histogram.add(histogram.bins(store, "beauty", 0, 3))
+    assert np.array_equal(histogram.counts, [1, 2])